@@ -1,22 +1,124 @@
-from flask import Flask, jsonify, request, abort
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, date, timezone
+from flask import Flask, jsonify, request, abort, url_for, Response, stream_with_context
 from database import db, app
+from config import Config
 from modules.vehicle_management import Vehicle, MaintenanceRecord, SparePart, FuelRecord, OwnershipHistory
 from modules.dispatch import Driver, Route
-from modules.monitoring import TrackingData
+from modules.monitoring import TrackingData, GPSData, FuelConsumption, Violation
+from modules.pagination import page_query
+from modules.ingest import ingest_points
+from modules.analytics import Analytics
+from modules.versioning import table_version, changes_since
+from modules.geometry import simplify_mask
+from modules import track_codec
+from modules.spatial import position_index
+from modules.positions import position_store
+
+VEHICLE_FIELDS = ['id','registration_number','brand','model','year','technical_specs','current_status','created_at','updated_at']
+DRIVER_FIELDS = ['id','name','license_number','license_expiry','contact_info','status']
+ROUTE_FIELDS = ['id','vehicle_id','driver_id','start_location','end_location','distance','estimated_time','status','created_at','updated_at','start_lat','start_lon','end_lat','end_lon']
+MAINTENANCE_FIELDS = ['id','vehicle_id','maintenance_type','description','cost','date','next_maintenance_date','parts_used','created_at']
+SPARE_PART_FIELDS = ['id','name','part_number','quantity','min_quantity','cost','supplier','last_order_date']
+FUEL_RECORD_FIELDS = ['id','vehicle_id','fuel_type','amount','cost','date','mileage']
+OWNERSHIP_FIELDS = ['id','vehicle_id','owner_name','start_date','end_date','documents']
+TRACKING_FIELDS = ['id','vehicle_id','route_id','latitude','longitude','speed','fuel_level','timestamp','additional_data']
+GPS_FIELDS = ['id','vehicle_id','timestamp','latitude','longitude','speed','heading']
+FUEL_CONSUMPTION_FIELDS = ['id','vehicle_id','timestamp','consumption_rate','current_level']
+VIOLATION_FIELDS = ['id','vehicle_id','driver_id','timestamp','violation_type','details','location']
+
+# Выгружаемые сущности: (модель, поля, столбец времени для фильтра from/to)
+EXPORTS = {
+    'tracking_data': (TrackingData, TRACKING_FIELDS, 'timestamp'),
+    'gps_data': (GPSData, GPS_FIELDS, 'timestamp'),
+    'fuel_consumption': (FuelConsumption, FUEL_CONSUMPTION_FIELDS, 'timestamp'),
+    'violations': (Violation, VIOLATION_FIELDS, 'timestamp'),
+    'fuel_records': (FuelRecord, FUEL_RECORD_FIELDS, 'date'),
+    'maintenance': (MaintenanceRecord, MAINTENANCE_FIELDS, 'date'),
+}
 
 def model_to_dict(obj, fields):
     return {f: getattr(obj, f) for f in fields}
 
+def parse_fields(allowed):
+    """Список полей из параметра fields= (проекция), по умолчанию — все разрешённые"""
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown or not fields:
+        abort(400, description=f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+def parse_limit():
+    """Размер страницы из параметра limit=, ограниченный API_MAX_PAGE_SIZE"""
+    limit = request.args.get('limit', Config.API_PAGE_SIZE, type=int)
+    if limit < 1:
+        abort(400, description='limit должен быть положительным')
+    return min(limit, Config.API_MAX_PAGE_SIZE)
+
+def not_modified(model):
+    """
+    Условный GET по версии таблицы: ETag — версия таблицы и хеш строки запроса,
+    Last-Modified — время последней записи в таблицу.
+    Возвращает (ответ 304 или None, заголовки для полного ответа); строки таблицы не читаются.
+    """
+    table = model.__table__.name
+    version, modified = table_version(db.session.connection(), table)
+    # время записи в ETag отличает версии после пересоздания базы, когда счётчики начинаются заново
+    stamp = f'{modified:%Y%m%d%H%M%S%f}' if modified is not None else '0'
+    digest = hashlib.md5(request.query_string).hexdigest()[:12]
+    etag = f'{table}-{version}-{stamp}-{digest}'
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if modified is not None:
+        modified = modified.replace(microsecond=0, tzinfo=timezone.utc)
+        headers['Last-Modified'] = modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        matched = since is not None and modified is not None and modified <= since
+    return (Response(status=304, headers=headers) if matched else None), headers
+
+def list_response(model, fields, sort_field=None, pk='id'):
+    """Страница списка сущностей: keyset-пагинация (limit/after) и выборка только запрошенных столбцов"""
+    cached, headers = not_modified(model)
+    if cached is not None:
+        return cached
+    fields = parse_fields(fields)
+    limit = parse_limit()
+    descending = request.args.get('order', 'asc') == 'desc'
+    sort_col = getattr(model, sort_field) if sort_field else None
+    pk_col = getattr(model, pk)
+    keys = [c for c in (sort_col, pk_col) if c is not None]
+    columns = [getattr(model, f) for f in fields] + [c for c in keys if c.key not in fields]
+    try:
+        rows, next_cursor = page_query(db.session.query(*columns), sort_col, pk_col,
+                                       after=request.args.get('after'), limit=limit, descending=descending)
+    except ValueError:
+        abort(400, description='Некорректный курсор after')
+    resp = jsonify([{f: row._mapping[f] for f in fields} for row in rows])
+    resp.headers.update(headers)
+    if next_cursor:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        resp.headers['X-Next-Cursor'] = next_cursor
+        resp.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return resp
+
 # --- VEHICLES ---
 @app.route('/api/vehicles', methods=['GET'])
 def get_vehicles():
-    vehicles = Vehicle.query.all()
-    return jsonify([model_to_dict(v, ['id','registration_number','brand','model','year','technical_specs','current_status','created_at','updated_at']) for v in vehicles])
+    return list_response(Vehicle, VEHICLE_FIELDS)
 
 @app.route('/api/vehicles/<int:vehicle_id>', methods=['GET'])
 def get_vehicle(vehicle_id):
     v = Vehicle.query.get_or_404(vehicle_id)
-    return jsonify(model_to_dict(v, ['id','registration_number','brand','model','year','technical_specs','current_status','created_at','updated_at']))
+    return jsonify(model_to_dict(v, VEHICLE_FIELDS))
 
 @app.route('/api/vehicles', methods=['POST'])
 def create_vehicle():
@@ -24,7 +126,7 @@ def create_vehicle():
     v = Vehicle(**data)
     db.session.add(v)
     db.session.commit()
-    return jsonify(model_to_dict(v, ['id','registration_number','brand','model','year','technical_specs','current_status','created_at','updated_at'])), 201
+    return jsonify(model_to_dict(v, VEHICLE_FIELDS)), 201
 
 @app.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
 def update_vehicle(vehicle_id):
@@ -33,7 +135,7 @@ def update_vehicle(vehicle_id):
     for k, val in data.items():
         setattr(v, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(v, ['id','registration_number','brand','model','year','technical_specs','current_status','created_at','updated_at']))
+    return jsonify(model_to_dict(v, VEHICLE_FIELDS))
 
 @app.route('/api/vehicles/<int:vehicle_id>', methods=['DELETE'])
 def delete_vehicle(vehicle_id):
@@ -46,13 +148,12 @@ def delete_vehicle(vehicle_id):
 # DRIVERS
 @app.route('/api/drivers', methods=['GET'])
 def get_drivers():
-    drivers = Driver.query.all()
-    return jsonify([model_to_dict(d, ['id','name','license_number','license_expiry','contact_info','status']) for d in drivers])
+    return list_response(Driver, DRIVER_FIELDS)
 
 @app.route('/api/drivers/<int:driver_id>', methods=['GET'])
 def get_driver(driver_id):
     d = Driver.query.get_or_404(driver_id)
-    return jsonify(model_to_dict(d, ['id','name','license_number','license_expiry','contact_info','status']))
+    return jsonify(model_to_dict(d, DRIVER_FIELDS))
 
 @app.route('/api/drivers', methods=['POST'])
 def create_driver():
@@ -60,7 +161,7 @@ def create_driver():
     d = Driver(**data)
     db.session.add(d)
     db.session.commit()
-    return jsonify(model_to_dict(d, ['id','name','license_number','license_expiry','contact_info','status'])), 201
+    return jsonify(model_to_dict(d, DRIVER_FIELDS)), 201
 
 @app.route('/api/drivers/<int:driver_id>', methods=['PUT'])
 def update_driver(driver_id):
@@ -69,7 +170,7 @@ def update_driver(driver_id):
     for k, val in data.items():
         setattr(d, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(d, ['id','name','license_number','license_expiry','contact_info','status']))
+    return jsonify(model_to_dict(d, DRIVER_FIELDS))
 
 @app.route('/api/drivers/<int:driver_id>', methods=['DELETE'])
 def delete_driver(driver_id):
@@ -86,13 +187,12 @@ def index():
 # --- ROUTES ---
 @app.route('/api/routes', methods=['GET'])
 def get_routes():
-    routes = Route.query.all()
-    return jsonify([model_to_dict(r, ['id','vehicle_id','driver_id','start_location','end_location','distance','estimated_time','status','created_at','updated_at','start_lat','start_lon','end_lat','end_lon']) for r in routes])
+    return list_response(Route, ROUTE_FIELDS)
 
 @app.route('/api/routes/<int:route_id>', methods=['GET'])
 def get_route(route_id):
     r = Route.query.get_or_404(route_id)
-    return jsonify(model_to_dict(r, ['id','vehicle_id','driver_id','start_location','end_location','distance','estimated_time','status','created_at','updated_at','start_lat','start_lon','end_lat','end_lon']))
+    return jsonify(model_to_dict(r, ROUTE_FIELDS))
 
 @app.route('/api/routes', methods=['POST'])
 def create_route():
@@ -100,7 +200,7 @@ def create_route():
     r = Route(**data)
     db.session.add(r)
     db.session.commit()
-    return jsonify(model_to_dict(r, ['id','vehicle_id','driver_id','start_location','end_location','distance','estimated_time','status','created_at','updated_at','start_lat','start_lon','end_lat','end_lon'])), 201
+    return jsonify(model_to_dict(r, ROUTE_FIELDS)), 201
 
 @app.route('/api/routes/<int:route_id>', methods=['PUT'])
 def update_route(route_id):
@@ -109,7 +209,7 @@ def update_route(route_id):
     for k, val in data.items():
         setattr(r, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(r, ['id','vehicle_id','driver_id','start_location','end_location','distance','estimated_time','status','created_at','updated_at','start_lat','start_lon','end_lat','end_lon']))
+    return jsonify(model_to_dict(r, ROUTE_FIELDS))
 
 @app.route('/api/routes/<int:route_id>', methods=['DELETE'])
 def delete_route(route_id):
@@ -121,13 +221,12 @@ def delete_route(route_id):
 # --- MAINTENANCE ---
 @app.route('/api/maintenance', methods=['GET'])
 def get_maintenance():
-    records = MaintenanceRecord.query.all()
-    return jsonify([model_to_dict(m, ['id','vehicle_id','maintenance_type','description','cost','date','next_maintenance_date','parts_used','created_at']) for m in records])
+    return list_response(MaintenanceRecord, MAINTENANCE_FIELDS)
 
 @app.route('/api/maintenance/<int:rec_id>', methods=['GET'])
 def get_maintenance_rec(rec_id):
     m = MaintenanceRecord.query.get_or_404(rec_id)
-    return jsonify(model_to_dict(m, ['id','vehicle_id','maintenance_type','description','cost','date','next_maintenance_date','parts_used','created_at']))
+    return jsonify(model_to_dict(m, MAINTENANCE_FIELDS))
 
 @app.route('/api/maintenance', methods=['POST'])
 def create_maintenance():
@@ -135,7 +234,7 @@ def create_maintenance():
     m = MaintenanceRecord(**data)
     db.session.add(m)
     db.session.commit()
-    return jsonify(model_to_dict(m, ['id','vehicle_id','maintenance_type','description','cost','date','next_maintenance_date','parts_used','created_at'])), 201
+    return jsonify(model_to_dict(m, MAINTENANCE_FIELDS)), 201
 
 @app.route('/api/maintenance/<int:rec_id>', methods=['PUT'])
 def update_maintenance(rec_id):
@@ -144,7 +243,7 @@ def update_maintenance(rec_id):
     for k, val in data.items():
         setattr(m, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(m, ['id','vehicle_id','maintenance_type','description','cost','date','next_maintenance_date','parts_used','created_at']))
+    return jsonify(model_to_dict(m, MAINTENANCE_FIELDS))
 
 @app.route('/api/maintenance/<int:rec_id>', methods=['DELETE'])
 def delete_maintenance(rec_id):
@@ -156,13 +255,12 @@ def delete_maintenance(rec_id):
 # --- SPARE PARTS ---
 @app.route('/api/spare_parts', methods=['GET'])
 def get_spare_parts():
-    parts = SparePart.query.all()
-    return jsonify([model_to_dict(p, ['id','name','part_number','quantity','min_quantity','cost','supplier','last_order_date']) for p in parts])
+    return list_response(SparePart, SPARE_PART_FIELDS)
 
 @app.route('/api/spare_parts/<int:part_id>', methods=['GET'])
 def get_spare_part(part_id):
     p = SparePart.query.get_or_404(part_id)
-    return jsonify(model_to_dict(p, ['id','name','part_number','quantity','min_quantity','cost','supplier','last_order_date']))
+    return jsonify(model_to_dict(p, SPARE_PART_FIELDS))
 
 @app.route('/api/spare_parts', methods=['POST'])
 def create_spare_part():
@@ -170,7 +268,7 @@ def create_spare_part():
     p = SparePart(**data)
     db.session.add(p)
     db.session.commit()
-    return jsonify(model_to_dict(p, ['id','name','part_number','quantity','min_quantity','cost','supplier','last_order_date'])), 201
+    return jsonify(model_to_dict(p, SPARE_PART_FIELDS)), 201
 
 @app.route('/api/spare_parts/<int:part_id>', methods=['PUT'])
 def update_spare_part(part_id):
@@ -179,7 +277,7 @@ def update_spare_part(part_id):
     for k, val in data.items():
         setattr(p, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(p, ['id','name','part_number','quantity','min_quantity','cost','supplier','last_order_date']))
+    return jsonify(model_to_dict(p, SPARE_PART_FIELDS))
 
 @app.route('/api/spare_parts/<int:part_id>', methods=['DELETE'])
 def delete_spare_part(part_id):
@@ -191,13 +289,12 @@ def delete_spare_part(part_id):
 # --- FUEL RECORDS ---
 @app.route('/api/fuel_records', methods=['GET'])
 def get_fuel_records():
-    records = FuelRecord.query.all()
-    return jsonify([model_to_dict(f, ['id','vehicle_id','fuel_type','amount','cost','date','mileage']) for f in records])
+    return list_response(FuelRecord, FUEL_RECORD_FIELDS)
 
 @app.route('/api/fuel_records/<int:rec_id>', methods=['GET'])
 def get_fuel_record(rec_id):
     f = FuelRecord.query.get_or_404(rec_id)
-    return jsonify(model_to_dict(f, ['id','vehicle_id','fuel_type','amount','cost','date','mileage']))
+    return jsonify(model_to_dict(f, FUEL_RECORD_FIELDS))
 
 @app.route('/api/fuel_records', methods=['POST'])
 def create_fuel_record():
@@ -205,7 +302,7 @@ def create_fuel_record():
     f = FuelRecord(**data)
     db.session.add(f)
     db.session.commit()
-    return jsonify(model_to_dict(f, ['id','vehicle_id','fuel_type','amount','cost','date','mileage'])), 201
+    return jsonify(model_to_dict(f, FUEL_RECORD_FIELDS)), 201
 
 @app.route('/api/fuel_records/<int:rec_id>', methods=['PUT'])
 def update_fuel_record(rec_id):
@@ -214,7 +311,7 @@ def update_fuel_record(rec_id):
     for k, val in data.items():
         setattr(f, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(f, ['id','vehicle_id','fuel_type','amount','cost','date','mileage']))
+    return jsonify(model_to_dict(f, FUEL_RECORD_FIELDS))
 
 @app.route('/api/fuel_records/<int:rec_id>', methods=['DELETE'])
 def delete_fuel_record(rec_id):
@@ -226,13 +323,12 @@ def delete_fuel_record(rec_id):
 # --- OWNERSHIP HISTORY ---
 @app.route('/api/ownership_history', methods=['GET'])
 def get_ownership_history():
-    records = OwnershipHistory.query.all()
-    return jsonify([model_to_dict(o, ['id','vehicle_id','owner_name','start_date','end_date','documents']) for o in records])
+    return list_response(OwnershipHistory, OWNERSHIP_FIELDS)
 
 @app.route('/api/ownership_history/<int:rec_id>', methods=['GET'])
 def get_ownership_record(rec_id):
     o = OwnershipHistory.query.get_or_404(rec_id)
-    return jsonify(model_to_dict(o, ['id','vehicle_id','owner_name','start_date','end_date','documents']))
+    return jsonify(model_to_dict(o, OWNERSHIP_FIELDS))
 
 @app.route('/api/ownership_history', methods=['POST'])
 def create_ownership_record():
@@ -240,7 +336,7 @@ def create_ownership_record():
     o = OwnershipHistory(**data)
     db.session.add(o)
     db.session.commit()
-    return jsonify(model_to_dict(o, ['id','vehicle_id','owner_name','start_date','end_date','documents'])), 201
+    return jsonify(model_to_dict(o, OWNERSHIP_FIELDS)), 201
 
 @app.route('/api/ownership_history/<int:rec_id>', methods=['PUT'])
 def update_ownership_record(rec_id):
@@ -249,7 +345,7 @@ def update_ownership_record(rec_id):
     for k, val in data.items():
         setattr(o, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(o, ['id','vehicle_id','owner_name','start_date','end_date','documents']))
+    return jsonify(model_to_dict(o, OWNERSHIP_FIELDS))
 
 @app.route('/api/ownership_history/<int:rec_id>', methods=['DELETE'])
 def delete_ownership_record(rec_id):
@@ -261,13 +357,12 @@ def delete_ownership_record(rec_id):
 # --- TRACKING DATA ---
 @app.route('/api/tracking_data', methods=['GET'])
 def get_tracking_data():
-    records = TrackingData.query.all()
-    return jsonify([model_to_dict(t, ['id','vehicle_id','route_id','latitude','longitude','speed','fuel_level','timestamp','additional_data']) for t in records])
+    return list_response(TrackingData, TRACKING_FIELDS, sort_field='timestamp')
 
 @app.route('/api/tracking_data/<int:rec_id>', methods=['GET'])
 def get_tracking_record(rec_id):
     t = TrackingData.query.get_or_404(rec_id)
-    return jsonify(model_to_dict(t, ['id','vehicle_id','route_id','latitude','longitude','speed','fuel_level','timestamp','additional_data']))
+    return jsonify(model_to_dict(t, TRACKING_FIELDS))
 
 @app.route('/api/tracking_data', methods=['POST'])
 def create_tracking_record():
@@ -275,7 +370,7 @@ def create_tracking_record():
     t = TrackingData(**data)
     db.session.add(t)
     db.session.commit()
-    return jsonify(model_to_dict(t, ['id','vehicle_id','route_id','latitude','longitude','speed','fuel_level','timestamp','additional_data'])), 201
+    return jsonify(model_to_dict(t, TRACKING_FIELDS)), 201
 
 @app.route('/api/tracking_data/<int:rec_id>', methods=['PUT'])
 def update_tracking_record(rec_id):
@@ -284,7 +379,7 @@ def update_tracking_record(rec_id):
     for k, val in data.items():
         setattr(t, k, val)
     db.session.commit()
-    return jsonify(model_to_dict(t, ['id','vehicle_id','route_id','latitude','longitude','speed','fuel_level','timestamp','additional_data']))
+    return jsonify(model_to_dict(t, TRACKING_FIELDS))
 
 @app.route('/api/tracking_data/<int:rec_id>', methods=['DELETE'])
 def delete_tracking_record(rec_id):
@@ -293,6 +388,230 @@ def delete_tracking_record(rec_id):
     db.session.commit()
     return '', 204
 
+@app.route('/api/tracks', methods=['GET'])
+def get_track():
+    """
+    Трек ТС (по маршруту и/или за период) в хронологическом порядке, с упрощением геометрии simplify=<метры>;
+    format=compact — компактное представление (modules/track_codec). Нужен route_id или период from/to;
+    из базы читается не больше TRACK_API_MAX_ROWS первых точек, обрезанный трек помечается truncated.
+    """
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    if vehicle_id is None:
+        abort(400, description='Нужен параметр vehicle_id')
+    tolerance = request.args.get('simplify', 0, type=float)
+    if tolerance < 0:
+        abort(400, description='simplify должен быть неотрицательным')
+    compact = request.args.get('format', 'json') == 'compact'
+    route_id = request.args.get('route_id', type=int)
+    start, end = parse_datetime_arg('from'), parse_datetime_arg('to')
+    if route_id is None and not (start and end):
+        abort(400, description='Нужен route_id или период from и to')
+    cached, headers = not_modified(TrackingData)
+    if cached is not None:
+        return cached
+    query = db.session.query(TrackingData.latitude, TrackingData.longitude, TrackingData.timestamp,
+                             TrackingData.speed, TrackingData.fuel_level) \
+        .filter(TrackingData.vehicle_id == vehicle_id,
+                TrackingData.latitude.isnot(None), TrackingData.longitude.isnot(None))
+    if route_id is not None:
+        query = query.filter(TrackingData.route_id == route_id)
+    if start:
+        query = query.filter(TrackingData.timestamp >= start)
+    if end:
+        query = query.filter(TrackingData.timestamp < end)
+    rows = query.order_by(TrackingData.timestamp).limit(Config.TRACK_API_MAX_ROWS + 1).all()
+    truncated = len(rows) > Config.TRACK_API_MAX_ROWS
+    rows = rows[:Config.TRACK_API_MAX_ROWS]
+    keep = simplify_mask([r.latitude for r in rows], [r.longitude for r in rows], tolerance).tolist()
+    kept = [r for r, k in zip(rows, keep) if k]
+    meta = {'vehicle_id': vehicle_id, 'route_id': route_id, 'simplify': tolerance, 'original_count': len(rows),
+            'truncated': truncated}
+    if compact:
+        resp = jsonify(track_codec.encode_track(kept, **meta))
+    else:
+        points = [[r.latitude, r.longitude, export_value(r.timestamp), r.speed, r.fuel_level] for r in kept]
+        resp = jsonify({**meta, 'count': len(points), 'points': points})
+    resp.headers.update(headers)
+    return resp
+
+# --- АНАЛИТИКА ПО ПАРКУ ---
+def fleet_report(method):
+    start, end = parse_datetime_arg('from'), parse_datetime_arg('to')
+    if not start or not end:
+        abort(400, description='Нужны параметры from и to')
+    vehicle_ids = request.args.get('vehicle_ids')
+    if vehicle_ids:
+        try:
+            vehicle_ids = [int(v) for v in vehicle_ids.split(',')]
+        except ValueError:
+            abort(400, description='vehicle_ids — список id через запятую')
+    result = method(start, end, vehicle_ids or None)
+    return jsonify([{'vehicle_id': vid, **values} for vid, values in result.items()])
+
+@app.route('/api/analytics/fleet_cost', methods=['GET'])
+def get_fleet_cost():
+    return fleet_report(Analytics.fleet_transportation_cost)
+
+@app.route('/api/analytics/fleet_consumption', methods=['GET'])
+def get_fleet_consumption():
+    return fleet_report(Analytics.fleet_fuel_consumption)
+
+@app.route('/api/analytics/fleet_efficiency', methods=['GET'])
+def get_fleet_efficiency():
+    return fleet_report(Analytics.fleet_vehicle_efficiency)
+
+# --- ПОТОКОВАЯ ВЫГРУЗКА ---
+def parse_datetime_arg(name):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        abort(400, description=f'Некорректная дата в параметре {name}: {raw}')
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+@app.route('/api/export/<entity>', methods=['GET'])
+def export_entity(entity):
+    """Выгрузка в NDJSON или CSV построчно через серверный курсор, без сборки ответа в памяти"""
+    if entity not in EXPORTS:
+        abort(404)
+    model, allowed, time_field = EXPORTS[entity]
+    fields = parse_fields(allowed)
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        abort(400, description='format должен быть ndjson или csv')
+    query = db.session.query(*[getattr(model, f) for f in fields])
+    for name in ('vehicle_id', 'route_id'):
+        value = request.args.get(name, type=int)
+        if value is not None:
+            if not hasattr(model, name):
+                abort(400, description=f'{entity} не поддерживает фильтр {name}')
+            query = query.filter(getattr(model, name) == value)
+    time_col = getattr(model, time_field)
+    start, end = parse_datetime_arg('from'), parse_datetime_arg('to')
+    if start:
+        query = query.filter(time_col >= start)
+    if end:
+        query = query.filter(time_col < end)
+    # yield_per включает потоковое чтение (серверный курсор в PostgreSQL) пачками по EXPORT_CHUNK_SIZE строк
+    query = query.order_by(time_col, model.id).execution_options(yield_per=Config.EXPORT_CHUNK_SIZE)
+
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == 'csv':
+            writer.writerow(fields)
+        count = 0
+        for row in query:
+            values = [export_value(v) for v in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buf.write(json.dumps(dict(zip(fields, values)), ensure_ascii=False, default=str))
+                buf.write('\n')
+            count += 1
+            if count % Config.EXPORT_CHUNK_SIZE == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename={entity}.{fmt}'
+    return resp
+
+# --- ПАКЕТНАЯ ЗАГРУЗКА ТЕЛЕМЕТРИИ ---
+def read_batch():
+    """Тело пакетного запроса: JSON-массив или NDJSON (по строке на точку)"""
+    if 'ndjson' in (request.content_type or ''):
+        items, errors = [], []
+        for i, line in enumerate(l for l in request.get_data(as_text=True).splitlines() if l.strip()):
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(None)
+                errors.append({'index': i, 'error': f'некорректный JSON: {e}'})
+        return items, errors
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(400, description='Ожидался JSON-массив точек или NDJSON')
+    return items, []
+
+def batch_response(model):
+    items, parse_errors = read_batch()
+    if len(items) > Config.INGEST_MAX_BATCH:
+        abort(413, description=f'Не более {Config.INGEST_MAX_BATCH} точек в одном запросе')
+    bad = {e['index'] for e in parse_errors}
+    inserted, errors = ingest_points(model, [item for i, item in enumerate(items) if i not in bad])
+    # Индексы ошибок валидации считаются по точкам без строк с битым JSON — возвращаем к исходным
+    valid_indexes = [i for i in range(len(items)) if i not in bad]
+    errors = sorted(parse_errors + [{**e, 'index': valid_indexes[e['index']]} for e in errors], key=lambda e: e['index'])
+    status = 201 if not errors else (207 if inserted else 400)
+    return jsonify({'inserted': inserted, 'errors': errors}), status
+
+@app.route('/api/tracking_data/batch', methods=['POST'])
+def create_tracking_batch():
+    return batch_response(TrackingData)
+
+@app.route('/api/gps_data/batch', methods=['POST'])
+def create_gps_batch():
+    return batch_response(GPSData)
+
+# --- ПОЗИЦИИ ТС ---
+def parse_floats(name, count):
+    raw = request.args.get(name)
+    try:
+        values = [float(v) for v in raw.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        abort(400, description=f'Параметр {name}: ожидалось {count} числа через запятую')
+    return values
+
+@app.route('/api/positions', methods=['GET'])
+def get_positions():
+    """Последние позиции ТС в прямоугольнике bbox=south,west,north,east или в радиусе near=lat,lon&radius=<метры>"""
+    cached, headers = not_modified(GPSData)
+    if cached is not None:
+        return cached
+    positions, index = position_index()
+    if request.args.get('bbox'):
+        south, west, north, east = parse_floats('bbox', 4)
+        found = [positions[i] for i in index.bbox(south, west, north, east).tolist()]
+    elif request.args.get('near'):
+        lat, lon = parse_floats('near', 2)
+        radius = request.args.get('radius', type=float)
+        if radius is None or radius < 0:
+            abort(400, description='Нужен параметр radius (метры)')
+        ids, distances = index.near(lat, lon, radius)
+        found = [{**positions[i], 'distance_m': round(d, 1)} for i, d in zip(ids.tolist(), distances.tolist())]
+    else:
+        abort(400, description='Нужен параметр bbox или near')
+    resp = jsonify(found[:parse_limit()])
+    resp.headers.update(headers)
+    return resp
+
+@app.route('/api/fleet/positions', methods=['GET'])
+def get_fleet_positions():
+    """Последние известные позиции всего парка из хранилища в памяти (без запросов к таблицам телеметрии)"""
+    position_store.sync()
+    return jsonify(position_store.records(position_store.snapshot()))
+
+# --- ЖУРНАЛ ИЗМЕНЕНИЙ ---
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    table = request.args.get('table')
+    if table not in db.metadata.tables:
+        abort(400, description='Неизвестная таблица')
+    since = request.args.get('since', 0, type=int)
+    changes, position, reset = changes_since(db.session.connection(), table, since)
+    return jsonify({'position': position, 'reset': reset,
+                    'changes': [{'id': row_id, 'op': op} for _, row_id, op in changes]})
+
 @app.route('/api')
 def api_help():
     return '''
@@ -348,6 +667,66 @@ def api_help():
     <b>Удалить:</b> <code>DELETE /api/drivers/1</code>
     </div>
     <div class="block">
+    <h2>Постраничная выдача</h2>
+    Все списки (<code>GET /api/&lt;сущность&gt;</code>) отдаются страницами по <code>limit</code> записей
+    (по умолчанию 100, не более 1000). Если есть следующая страница, в ответе будет заголовок
+    <code>X-Next-Cursor</code> — передайте его значение в параметре <code>after</code>.<br>
+    <code>fields</code> — список нужных столбцов через запятую, <code>order=desc</code> — обратный порядок.<br><br>
+    <code>GET /api/tracking_data?limit=500&amp;fields=vehicle_id,latitude,longitude,timestamp</code><br>
+    <code>GET /api/tracking_data?limit=500&amp;after=WyIyMDI1LTAxLTAxVDEwOjAwOjAwIiwgNDJd</code>
+    </div>
+    <div class="block">
+    <h2>Аналитика по парку</h2>
+    <code>GET /api/analytics/fleet_cost?from=2025-01-01&amp;to=2025-02-01[&amp;vehicle_ids=1,2,3]</code> — себестоимость по каждому ТС, в том числе на километр пробега по GPS<br>
+    <code>GET /api/analytics/fleet_consumption?from=2025-01-01&amp;to=2025-02-01</code> — расход топлива на 100 км: заправки к пробегу по GPS<br>
+    <code>GET /api/analytics/fleet_efficiency?from=2025-01-01&amp;to=2025-02-01</code> — пробег, время, расход и число задач по каждому ТС
+    </div>
+    <div class="block">
+    <h2>Потоковая выгрузка</h2>
+    <code>GET /api/export/&lt;сущность&gt;?format=ndjson|csv&amp;vehicle_id=1&amp;route_id=2&amp;from=2025-01-01&amp;to=2025-02-01</code><br>
+    Сущности: tracking_data, gps_data, fuel_consumption, violations, fuel_records, maintenance.
+    Ответ передаётся частями по мере чтения из базы, поэтому подходит для выгрузки за год по всему парку.
+    </div>
+    <div class="block">
+    <h2>Пакетная загрузка телеметрии</h2>
+    <code>POST /api/tracking_data/batch</code>, <code>POST /api/gps_data/batch</code> — до 10000 точек за запрос,
+    JSON-массивом или NDJSON (<code>Content-Type: application/x-ndjson</code>, по объекту на строку).
+    Все корректные точки записываются одной транзакцией, ошибки возвращаются по индексам:
+    <pre>{ "inserted": 998, "errors": [{"index": 17, "error": "не задано поле timestamp"}] }</pre>
+    </div>
+    <div class="block">
+    <h2>Условные запросы</h2>
+    Списки возвращают заголовки <code>ETag</code> и <code>Last-Modified</code>. Повторный запрос с
+    <code>If-None-Match</code> или <code>If-Modified-Since</code> получает <code>304 Not Modified</code> без тела,
+    если таблица с тех пор не менялась, — при опросе раз в несколько секунд это почти бесплатно.
+    </div>
+    <div class="block">
+    <h2>Треки</h2>
+    <code>GET /api/tracks?vehicle_id=1&amp;route_id=2&amp;simplify=10</code> — точки трека <code>[lat, lon, timestamp, speed, fuel]</code> по времени.
+    Необязательные параметры: <code>route_id</code>, <code>from</code>/<code>to</code> (ISO-дата).
+    <code>format=compact</code> — компактный ответ: <code>path</code> — координаты в формате Google polyline (5 знаков),
+    <code>time</code> (секунды), <code>speed</code> и <code>fuel</code> (точность 0.1) — разности соседних значений в той же кодировке;
+    ряд с пропусками передаётся обычным списком.
+    <code>simplify</code> — допуск упрощения в метрах (алгоритм Дугласа — Пекера): отброшенные точки лежат
+    не дальше этого расстояния от линии трека; по умолчанию 0 — без упрощения.
+    </div>
+    <div class="block">
+    <h2>Позиции ТС</h2>
+    <code>GET /api/positions?bbox=55.5,37.3,56.0,37.9</code> — последние известные позиции ТС в прямоугольнике
+    <code>юг,запад,север,восток</code> (градусы).<br>
+    <code>GET /api/positions?near=55.75,37.62&amp;radius=5000</code> — ТС в радиусе (метры) от точки,
+    по возрастанию расстояния, с полем <code>distance_m</code>. Размер ответа ограничен <code>limit</code>.<br>
+    <code>GET /api/fleet/positions</code> — последние позиции всех ТС (координаты, скорость, курс, топливо, время)
+    из хранилища в памяти: оно обновляется при пакетной загрузке телеметрии и сверяется с базой по версиям таблиц.
+    </div>
+    <div class="block">
+    <h2>Журнал изменений</h2>
+    <code>GET /api/changes?table=vehicles&amp;since=0</code> — изменения строк таблицы после позиции <code>since</code>:
+    <pre>{ "position": 42, "reset": false, "changes": [{"id": 7, "op": "U"}] }</pre>
+    Операции: I — вставка, U — изменение, D — удаление. <code>reset: true</code> — таблицу нужно перечитать целиком
+    (была массовая запись или журнал уже очищен). Следующий запрос — с <code>since</code> из <code>position</code>.
+    </div>
+    <div class="block">
     <b>Ответы всегда в формате JSON.<br>
     Если объект не найден — 404.<br>
     Если успешно создан — 201, удалён — 204.<br>
@@ -0,0 +1,79 @@
+import argparse
+import statistics
+import time
+from datetime import timedelta
+from sqlalchemy import func, select, text
+from database import db, app
+from modules.vehicle_management import FuelRecord
+from modules.monitoring import TrackingData, GPSData, FuelConsumption
+from migrate_db import create_missing_indexes
+
+BENCH_TABLES = ['gps_data', 'tracking_data', 'fuel_consumption', 'driving_style', 'violations', 'fuel_records', 'maintenance', 'tasks']
+
+
+def sample_params():
+    """ТС, маршрут и месячный интервал, по которым строятся тестовые запросы"""
+    vehicle_id, route_id = db.session.query(TrackingData.vehicle_id, TrackingData.route_id).first() or (1, 1)
+    end = db.session.query(func.max(TrackingData.timestamp)).scalar()
+    if end is None:
+        end = db.session.query(func.max(GPSData.timestamp)).scalar()
+    if end is None:
+        end = db.session.query(func.now()).scalar()
+    return vehicle_id, route_id, end - timedelta(days=30), end
+
+
+def bench_queries(vehicle_id, route_id, start, end):
+    return [
+        ('FuelConsumption: ТС за период (analyze_vehicle_efficiency)',
+         select(FuelConsumption).where(FuelConsumption.vehicle_id == vehicle_id,
+                                       FuelConsumption.timestamp.between(start, end))),
+        ('FuelRecord: сумма по ТС за период (calculate_transportation_cost)',
+         select(func.sum(FuelRecord.cost)).where(FuelRecord.vehicle_id == vehicle_id,
+                                                 FuelRecord.date.between(start, end))),
+        ('TrackingData: трек ТС по маршруту (MapSimulationWidget)',
+         select(TrackingData).where(TrackingData.vehicle_id == vehicle_id, TrackingData.route_id == route_id)
+         .order_by(TrackingData.timestamp)),
+        ('GPSData: ТС за период',
+         select(GPSData).where(GPSData.vehicle_id == vehicle_id, GPSData.timestamp.between(start, end))),
+    ]
+
+
+def run(repeat):
+    """Печать плана и медианного времени выполнения каждого запроса"""
+    params = sample_params()
+    conn = db.session.connection()
+    for title, stmt in bench_queries(*params):
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(stmt).fetchall()
+            timings.append((time.perf_counter() - t0) * 1000)
+        print(f"\n=== {title}: {statistics.median(timings):.2f} мс (медиана из {repeat})")
+        sql = str(stmt.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        explain = 'EXPLAIN ANALYZE ' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+        for row in conn.exec_driver_sql(explain + sql):
+            print('   ', row[-1])
+
+
+def drop_bench_indexes():
+    for table in db.metadata.sorted_tables:
+        if table.name in BENCH_TABLES:
+            for index in table.indexes:
+                db.session.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Планы и время запросов к таблицам телеметрии до и после индексов')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--before', action='store_true', help='сначала удалить индексы и замерить запросы без них')
+    args = parser.parse_args()
+    with app.app_context():
+        if args.before:
+            drop_bench_indexes()
+            print('##### БЕЗ ИНДЕКСОВ #####')
+            run(args.repeat)
+            db.session.commit()
+            create_missing_indexes()
+        print('\n##### С ИНДЕКСАМИ #####')
+        run(args.repeat)
@@ -18,10 +18,51 @@ class Config:
     MAINTENANCE_NOTIFICATION_DAYS = 14
     FUEL_CONSUMPTION_THRESHOLD = 15
     SPEED_LIMIT = 90
-    HARD_BRAKING_THRESHOLD = 0.5
-    HARD_ACCELERATION_THRESHOLD = 0.5
+    HARD_BRAKING_THRESHOLD = 0.5  # g (ускорение свободного падения)
+    HARD_ACCELERATION_THRESHOLD = 0.5  # g
+    VIOLATION_MERGE_GAP_S = 120  # точки нарушения с разрывом больше этого — разные эпизоды
+    HARD_CORNERING_THRESHOLD = 0.3  # g, боковое ускорение в повороте
+    # Оценка стиля вождения: по DRIVING_STYLE_PERCENTILE-му процентилю ускорений поездки (0 баллов — на пороге резкого манёвра)
+    DRIVING_STYLE_PERCENTILE = 95
+    DRIVING_STYLE_MIN_INTERVALS = 10  # поездки с меньшим числом пар соседних точек не оцениваются
+    DRIVING_STYLE_MAX_GAP_S = 120  # между точками с большим разрывом ускорения не считаются
+    # Выделение поездок: скорость движения, минимальная стоянка, разрыв в данных, минимальный пробег поездки
+    TRIP_MOVING_SPEED_KMH = 5
+    TRIP_MIN_STOP_S = 300
+    TRIP_MAX_GAP_S = 600
+    TRIP_MIN_DISTANCE_M = 200
+    MILEAGE_MAX_SPEED_KMH = 200  # шаг между точками GPS с большей скоростью — скачок координат, в пробег не идёт
+    TELEMETRY_FETCH_SIZE = 50000  # строк телеметрии в порции при чтении пакетными заданиями
     SESSION_TIMEOUT = 3600
     MAX_LOGIN_ATTEMPTS = 5
     PASSWORD_MIN_LENGTH = 8
     CACHE_TYPE = 'simple'
-    CACHE_DEFAULT_TIMEOUT = 300 
\ No newline at end of file
+    CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_MAX_SIZE = 256
+    API_PAGE_SIZE = 100
+    API_MAX_PAGE_SIZE = 1000
+    GUI_PAGE_SIZE = 200
+    MAP_CHUNK_TRACKS = 20  # треков в одном сообщении канала карты
+    MAP_MAX_POSITIONS = 1000  # ТС на карте в пределах видимой области
+    SPATIAL_CELL_DEG = 0.05  # размер ячейки пространственного индекса, градусы (около 5 км)
+    GUI_POLL_INTERVAL_MS = 3000
+    CHANGE_LOG_RETENTION_HOURS = 24
+    CHANGE_LOG_MAX_ROWS = 1000  # изменений за один опрос журнала; больше — клиент перечитывает таблицу
+    INGEST_MAX_BATCH = 10000
+    INGEST_CHUNK_SIZE = 1000
+    EXPORT_CHUNK_SIZE = 1000
+    PARTITION_MONTHS_AHEAD = 2
+    TELEMETRY_RETENTION_MONTHS = 12
+    ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH')  # .npz, .osm или список рёбер; если не задан — маршруты через OSRM
+    OSRM_URL = os.getenv('OSRM_URL', 'http://router.project-osrm.org')
+    ROUTING_TIMEOUT = 5
+    ROUTING_PROFILE = 'driving'
+    ROUTE_CACHE_MAX_ENTRIES = 10000
+    ROUTE_CACHE_TOUCH_INTERVAL_S = 3600  # отметка использования геометрии обновляется не чаще
+    ROUTE_CACHE_EVICT_EVERY = 100  # вытеснение при каждом N-м сохранении (и заданием jobs.py route-cache)
+    ROUTING_MAX_WORKERS = 8
+    # Допуск упрощения геометрии (Дуглас — Пекер), метры: для сохраняемых треков и для карты
+    TRACK_SIMPLIFY_TOLERANCE_M = 50
+    TRACK_MAX_POINTS = 100  # больше — допуск для трека удваивается
+    TRACK_API_MAX_ROWS = 100000  # точек трека из базы за один запрос /api/tracks; больше — трек обрезается
+    MAP_SIMPLIFY_TOLERANCE_M = 5
\ No newline at end of file
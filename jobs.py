@@ -0,0 +1,113 @@
+import argparse
+from datetime import date, datetime, timedelta
+from database import db, app
+from config import Config
+from modules.partitioning import PARTITIONED_TABLES, ensure_partitions, drop_expired_partitions
+from modules.analytics import Analytics
+from modules.rollups import backfill_daily_stats
+from modules.versioning import bump_versions, prune_changes
+from modules.routing import load_road_graph
+from modules.driving_style import rate_day
+from modules.trips import update_trips
+from modules.mileage import update_mileage
+from modules.violations import close_stale_episodes
+from modules.route_cache import evict
+
+
+def run_partitions(args):
+    """Создание месячных секций телеметрии на текущий и следующие месяцы"""
+    with db.engine.begin() as conn:
+        created = ensure_partitions(conn)
+    print(f"Создано секций: {len(created)}", *created, sep='\n  ')
+
+
+def run_retention(args):
+    """Удаление секций телеметрии старше срока хранения и старых записей журнала изменений"""
+    with db.engine.begin() as conn:
+        dropped = drop_expired_partitions(conn, args.months)
+        bump_versions(conn, PARTITIONED_TABLES)
+        pruned = prune_changes(conn, Config.CHANGE_LOG_RETENTION_HOURS)
+    print(f"Удалено секций: {len(dropped)}", *dropped, sep='\n  ')
+    print(f"Удалено записей журнала изменений: {pruned}")
+
+
+def run_backfill_rollups(args):
+    """Пересчёт суточных итогов по ТС из исходных записей (за всё время или за --from/--to)"""
+    with db.engine.begin() as conn:
+        written = backfill_daily_stats(conn, args.start, args.end)
+    print(f"Записано суточных итогов: {written}")
+
+
+def run_road_graph(args):
+    """Подготовка дорожного графа для локальной маршрутизации: OSM XML или список рёбер -> .npz"""
+    graph = load_road_graph(args.source)
+    graph.save(args.out)
+    print(f"Граф сохранён в {args.out}: вершин {len(graph)}, рёбер {len(graph.targets)}")
+
+
+def run_driving_style(args):
+    """Оценка стиля вождения по поездкам за сутки (по умолчанию за вчера) по точкам GPS"""
+    day = args.day or date.today() - timedelta(days=1)
+    print(f"Оценок стиля вождения за {day}: {rate_day(day)}")
+
+
+def run_trips(args):
+    """Выделение поездок из новых точек телеметрии (при первом запуске — с --from или за всё время)"""
+    print(f"Записано поездок: {update_trips(args.since)}")
+
+
+def run_mileage(args):
+    """Пополнение суточного пробега ТС по новым точкам GPS (при первом запуске — с --from или за всё время)"""
+    print(f"Обновлено суточных пробегов: {update_mileage(args.since)}")
+
+
+def run_violations(args):
+    """Запись нарушений, эпизоды которых остались открытыми: ТС перестало присылать точки (запускать раз в минуту-две)"""
+    print(f"Записано нарушений: {close_stale_episodes()}")
+
+
+def run_route_cache(args):
+    """Удаление давно не использованных геометрий маршрутов сверх ROUTE_CACHE_MAX_ENTRIES"""
+    with db.engine.begin() as conn:
+        print(f"Удалено геометрий: {evict(conn)}")
+
+
+def run_failure_risk(args):
+    """Вероятность поломки по всему парку на горизонте --horizon дней"""
+    probs = Analytics.fleet_failure_probability(horizon_days=args.horizon)
+    for vid, prob in sorted(probs.items(), key=lambda kv: kv[1], reverse=True):
+        print(f"ТС {vid}: {prob*100:.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Регламентные задания (запускаются по расписанию, например из cron)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('partitions', help=run_partitions.__doc__).set_defaults(func=run_partitions)
+    retention = commands.add_parser('retention', help=run_retention.__doc__)
+    retention.add_argument('--months', type=int, default=None, help='срок хранения в месяцах (по умолчанию TELEMETRY_RETENTION_MONTHS)')
+    retention.set_defaults(func=run_retention)
+    backfill = commands.add_parser('backfill-rollups', help=run_backfill_rollups.__doc__)
+    backfill.add_argument('--from', dest='start', type=date.fromisoformat, default=None)
+    backfill.add_argument('--to', dest='end', type=date.fromisoformat, default=None)
+    backfill.set_defaults(func=run_backfill_rollups)
+    road_graph = commands.add_parser('road-graph', help=run_road_graph.__doc__)
+    road_graph.add_argument('source', help='файл .osm/.xml или список рёбер')
+    road_graph.add_argument('out', help='куда сохранить граф (.npz), затем указать его в ROAD_GRAPH_PATH')
+    road_graph.set_defaults(func=run_road_graph)
+    style = commands.add_parser('driving-style', help=run_driving_style.__doc__)
+    style.add_argument('--date', dest='day', type=date.fromisoformat, default=None)
+    style.set_defaults(func=run_driving_style)
+    trips = commands.add_parser('trips', help=run_trips.__doc__)
+    trips.add_argument('--from', dest='since', type=datetime.fromisoformat, default=None)
+    trips.set_defaults(func=run_trips)
+    mileage = commands.add_parser('mileage', help=run_mileage.__doc__)
+    mileage.add_argument('--from', dest='since', type=datetime.fromisoformat, default=None)
+    mileage.set_defaults(func=run_mileage)
+    commands.add_parser('violations', help=run_violations.__doc__).set_defaults(func=run_violations)
+    commands.add_parser('route-cache', help=run_route_cache.__doc__).set_defaults(func=run_route_cache)
+    risk = commands.add_parser('failure-risk', help=run_failure_risk.__doc__)
+    risk.add_argument('--horizon', type=int, default=30)
+    risk.set_defaults(func=run_failure_risk)
+    args = parser.parse_args()
+    with app.app_context():
+        args.func(args)
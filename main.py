@@ -4,19 +4,31 @@ os.environ["QTWEBENGINE_DISABLE_SANDBOX"] = "1"
 
 import sys
 from PyQt6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QTableWidget, QTableWidgetItem, QHBoxLayout, QMessageBox, QDialog, QLabel, QLineEdit, QFormLayout, QTabWidget, QTextEdit, QComboBox, QDateEdit, QHeaderView, QListWidget, QSlider, QListWidgetItem, QTabBar
+    QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QTableView, QAbstractItemView, QHBoxLayout, QMessageBox, QDialog, QLabel, QLineEdit, QFormLayout, QTabWidget, QTextEdit, QComboBox, QDateEdit, QHeaderView, QListWidget, QSlider, QListWidgetItem, QTabBar, QProgressBar
 )
-from PyQt6.QtCore import Qt, QDate, QTimer, QPoint
+from PyQt6.QtCore import Qt, QDate, QTimer, QPoint, QThread, pyqtSignal, pyqtSlot, QObject, QRunnable, QThreadPool, QAbstractTableModel, QModelIndex, QUrl
 from database import db, app as flask_app
 from modules.vehicle_management import Vehicle, MaintenanceRecord, SparePart, FuelRecord, OwnershipHistory, User
 from modules.dispatch import Driver, Route
 from modules.monitoring import TrackingData
 from modules.analytics import Analytics
+from modules.track_generation import build_tracks, save_tracks
+from modules.pagination import page_query, indexed_columns, sortable_columns, column_filter
+from modules.versioning import latest_change_id, changes_since, DELETED
+from modules.geometry import simplify_mask
+from modules import track_codec
+from modules.spatial import position_index
+from modules.positions import position_store
+from sqlalchemy import tuple_
+from config import Config
 from datetime import datetime
 from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtWebChannel import QWebChannel
+from collections import deque
+from bisect import bisect_left
+from functools import cmp_to_key
 import json
 import random
-import requests
 import bcrypt
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
@@ -71,6 +83,269 @@ class GenericDialog(QDialog):
         return {k: v.text() for k, v in self.inputs.items()}
 
 
+def table_query(model, fields, pk, sort_field, filter_field, filter_text):
+    """Запрос строк таблицы для LazyTableModel: нужные столбцы и фильтр; (query, sort_col, pk_col)"""
+    pk_col = getattr(model, pk)
+    sort_col = getattr(model, sort_field) if sort_field and sort_field != pk else None
+    columns = [getattr(model, f) for f in fields]
+    columns += [c for c in (sort_col, pk_col) if c is not None and c.key not in fields]
+    query = db.session.query(*columns)
+    if filter_field and filter_text:
+        query = query.filter(column_filter(getattr(model, filter_field), filter_text))
+    return query, sort_col, pk_col
+
+
+def table_row(row, fields, pk, sort_field):
+    """(pk, значение ключа сортировки, строки ячеек) для строки результата"""
+    values = row._mapping
+    return values[pk], values[sort_field or pk], [str(values[f]) if values[f] is not None else "" for f in fields]
+
+
+class PageLoaderSignals(QObject):
+    loaded = pyqtSignal(int, object, object, object)  # поколение запроса, строки, курсор следующей страницы, позиция журнала
+    changes = pyqtSignal(int, object, object, object)  # поколение, новая позиция журнала, удалённые pk, изменённые строки
+    reset = pyqtSignal(int)
+    failed = pyqtSignal(int, str)
+
+
+class PageLoader(QRunnable):
+    """Загрузка одной страницы таблицы keyset-запросом в пуле потоков"""
+
+    def __init__(self, signals, generation, model, fields, pk, sort_field, descending, filter_field, filter_text, after, limit):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.args = (model, fields, pk, sort_field, descending, filter_field, filter_text, after, limit)
+
+    def run(self):
+        model, fields, pk, sort_field, descending, filter_field, filter_text, after, limit = self.args
+        try:
+            with flask_app.app_context():
+                # позиция журнала читается до первой страницы: изменения после неё догонит опрос журнала
+                position = latest_change_id(db.session.connection()) if after is None else None
+                query, sort_col, pk_col = table_query(model, fields, pk, sort_field, filter_field, filter_text)
+                rows, next_cursor = page_query(query, sort_col, pk_col, after=after, limit=limit, descending=descending)
+                page = [table_row(row, fields, pk, sort_field) for row in rows]
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.loaded.emit(self.generation, page, next_cursor, position)
+
+
+class ChangeLoader(QRunnable):
+    """Чтение журнала изменений таблицы после позиции и загрузка изменённых строк"""
+
+    def __init__(self, signals, generation, model, fields, pk, sort_field, filter_field, filter_text, position):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.args = (model, fields, pk, sort_field, filter_field, filter_text, position)
+
+    def run(self):
+        model, fields, pk, sort_field, filter_field, filter_text, position = self.args
+        try:
+            with flask_app.app_context():
+                changes, position, reset = changes_since(db.session.connection(), model.__tablename__, position)
+                if reset:
+                    self.signals.reset.emit(self.generation)
+                    return
+                last_op = {row_id: op for _, row_id, op in changes}
+                deleted = {row_id for row_id, op in last_op.items() if op == DELETED}
+                touched = [row_id for row_id, op in last_op.items() if op != DELETED]
+                rows = []
+                if touched:
+                    query, _, pk_col = table_query(model, fields, pk, sort_field, filter_field, filter_text)
+                    rows = [table_row(row, fields, pk, sort_field) for row in query.filter(pk_col.in_(touched))]
+                # изменённые строки, которые больше не проходят фильтр, убираются из таблицы
+                deleted |= set(touched) - {row[0] for row in rows}
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.changes.emit(self.generation, position, deleted, rows)
+
+
+class LazyTableModel(QAbstractTableModel):
+    """
+    Модель таблицы с подгрузкой страниц по мере прокрутки (canFetchMore/fetchMore).
+    Страницы читаются keyset-запросами в фоновом потоке; сортировка и фильтр выполняются в базе:
+    сортировка — только по столбцам с составным индексом (столбец, pk), фильтр — по индексированным столбцам,
+    поэтому время открытия не зависит от размера таблицы.
+    Изменения применяются построчно по журналу изменений (poll_changes).
+    """
+    error = pyqtSignal(str)
+    page_loaded = pyqtSignal()
+
+    def __init__(self, model, fields, headers, pk='id', parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.fields = fields
+        self.headers = headers
+        self.pk = pk
+        self.sortable = [f for f in sortable_columns(model, pk) if f in fields]
+        self.filterable = [f for f in indexed_columns(model) if f in fields]
+        self.sort_field = pk
+        self.descending = False
+        self.filter_field = None
+        self.filter_text = ''
+        self.rows = []  # [(значение pk, значение ключа сортировки, [строки ячеек])] в порядке keyset-запроса
+        self.by_pk = {}  # значение pk -> строка из rows
+        self.order = cmp_to_key(lambda a, b: -1 if self._precedes(a, b) else int(self._precedes(b, a)))
+        self.cursor = None
+        self.exhausted = False
+        self.loading = False
+        self.polling = False
+        self.position = None  # позиция в журнале изменений, до которой изменения уже учтены
+        self.generation = 0
+        self.signals = PageLoaderSignals()
+        self.signals.loaded.connect(self._on_loaded)
+        self.signals.changes.connect(self._on_changes)
+        self.signals.reset.connect(self._on_reset)
+        self.signals.failed.connect(self._on_failed)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.fields)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and index.isValid():
+            return self.rows[index.row()][2][index.column()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        QThreadPool.globalInstance().start(PageLoader(
+            self.signals, self.generation, self.model, self.fields, self.pk, self.sort_field, self.descending,
+            self.filter_field, self.filter_text, self.cursor, Config.GUI_PAGE_SIZE))
+
+    def _on_loaded(self, generation, page, next_cursor, position):
+        if generation != self.generation:
+            return  # ответ на запрос до смены сортировки/фильтра
+        self.loading = False
+        self.cursor = next_cursor
+        self.exhausted = next_cursor is None
+        if position is not None:
+            self.position = position
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.by_pk.update((row[0], row) for row in page)
+            self.endInsertRows()
+        self.page_loaded.emit()
+
+    def _on_failed(self, generation, message):
+        if generation == self.generation:
+            self.loading = False
+            self.polling = False
+            self.exhausted = True
+            self.error.emit(message)
+
+    def poll_changes(self):
+        """Запрос изменений таблицы из журнала; применяются только вставленные, изменённые и удалённые строки"""
+        if self.polling or self.loading or self.position is None:
+            return
+        self.polling = True
+        QThreadPool.globalInstance().start(ChangeLoader(
+            self.signals, self.generation, self.model, self.fields, self.pk, self.sort_field,
+            self.filter_field, self.filter_text, self.position))
+
+    def _on_reset(self, generation):
+        self.polling = False
+        if generation == self.generation:
+            self.reload()
+
+    def _on_changes(self, generation, position, deleted, rows):
+        self.polling = False
+        if generation != self.generation:
+            return
+        self.position = position
+        for pk_value in deleted:
+            self._remove(pk_value)
+        for row in rows:
+            index = self.row_of(row[0])
+            if index >= 0 and self.rows[index][1] == row[1]:
+                self.rows[index] = self.by_pk[row[0]] = row
+                self.dataChanged.emit(self.index(index, 0), self.index(index, len(self.fields) - 1))
+                continue
+            if index >= 0:
+                self._remove(row[0])
+            self._insert(row)
+
+    def _remove(self, pk_value):
+        index = self.row_of(pk_value)
+        if index >= 0:
+            self.beginRemoveRows(QModelIndex(), index, index)
+            del self.rows[index]
+            del self.by_pk[pk_value]
+            self.endRemoveRows()
+
+    def _precedes(self, a, b):
+        """Строка a идёт раньше b в порядке keyset-запроса: (ключ сортировки, pk), NULL в конце"""
+        if a[1] != b[1]:
+            if a[1] is None or b[1] is None:
+                return b[1] is None
+            return a[1] > b[1] if self.descending else a[1] < b[1]
+        return a[0] > b[0] if self.descending else a[0] < b[0]
+
+    def _insert(self, row):
+        index = bisect_left(self.rows, self.order(row), key=self.order)
+        if index == len(self.rows) and not self.exhausted:
+            return  # строка за последней загруженной страницей — придёт при подгрузке
+        self.beginInsertRows(QModelIndex(), index, index)
+        self.rows.insert(index, row)
+        self.by_pk[row[0]] = row
+        self.endInsertRows()
+
+    def reload(self):
+        """Сброс загруженных строк и загрузка первой страницы заново"""
+        self.beginResetModel()
+        self.generation += 1
+        self.rows = []
+        self.by_pk = {}
+        self.cursor = None
+        self.exhausted = False
+        self.loading = False
+        self.polling = False
+        self.position = None
+        self.endResetModel()
+        self.fetchMore()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        field = self.fields[column]
+        if field not in self.sortable:
+            return
+        self.sort_field = field
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.reload()
+
+    def set_filter(self, field, text):
+        self.filter_field = field
+        self.filter_text = text.strip()
+        self.reload()
+
+    def pk_at(self, row):
+        return self.rows[row][0] if 0 <= row < len(self.rows) else None
+
+    def row_of(self, pk_value):
+        """Номер загруженной строки по pk или -1: двоичный поиск по ключу сортировки строки"""
+        row = self.by_pk.get(pk_value)
+        if row is None:
+            return -1
+        index = bisect_left(self.rows, self.order(row), key=self.order)
+        return index if index < len(self.rows) and self.rows[index][0] == pk_value else -1
+
+
 class TableWidget(QWidget):
     def __init__(self, model, fields, headers, pk='id', parent=None):
         super().__init__(parent)
@@ -79,12 +354,38 @@ class TableWidget(QWidget):
         self.headers = headers
         self.pk = pk
         self.layout = QVBoxLayout(self)
-        self.table = QTableWidget()
+        self.table_model = LazyTableModel(model, fields, headers, pk, self)
+        self.table_model.error.connect(lambda message: QMessageBox.warning(self, 'Ошибка загрузки', message))
+        self.table_model.modelAboutToBeReset.connect(self._remember_selection)
+        self.table_model.page_loaded.connect(self._restore_selection)
+        self.selected_pk = None
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(Config.GUI_POLL_INTERVAL_MS)
+        self.poll_timer.timeout.connect(self.poll_changes)
+
+        filter_layout = QHBoxLayout()
+        self.filter_field = QComboBox()
+        for field in self.table_model.filterable:
+            self.filter_field.addItem(headers[fields.index(field)], field)
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText('Фильтр (текст — по началу строки, остальное — точное значение)')
+        self.filter_edit.returnPressed.connect(self.apply_filter)
+        filter_layout.addWidget(self.filter_field)
+        filter_layout.addWidget(self.filter_edit, stretch=1)
+        self.layout.addLayout(filter_layout)
+
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
         self.table.verticalHeader().setVisible(False)
         self.layout.addWidget(self.table)
  
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.horizontalHeader().setSortIndicatorShown(True)
+        self.table.horizontalHeader().setSortIndicator(fields.index(pk), Qt.SortOrder.AscendingOrder)
+        self.table.horizontalHeader().sortIndicatorChanged.connect(self.on_sort_changed)
         btn_layout = QHBoxLayout()
         self.btn_add = QPushButton('Добавить')
         self.btn_edit = QPushButton('Изменить')
@@ -97,27 +398,43 @@ class TableWidget(QWidget):
         self.btn_edit.clicked.connect(self.edit_item)
         self.btn_delete.clicked.connect(self.delete_item)
         self.refresh_table()
+        self.poll_timer.start()
+
+    def current_pk(self):
+        return self.table_model.pk_at(self.table.currentIndex().row())
+
+    def on_sort_changed(self, column, order):
+        if self.fields[column] in self.table_model.sortable:
+            self.table_model.sort(column, order)
+            return
+        # сортировка по столбцу без составного индекса (столбец, pk) не поддерживается — возвращаем прежний индикатор
+        header = self.table.horizontalHeader()
+        header.blockSignals(True)
+        current = Qt.SortOrder.DescendingOrder if self.table_model.descending else Qt.SortOrder.AscendingOrder
+        header.setSortIndicator(self.fields.index(self.table_model.sort_field), current)
+        header.blockSignals(False)
+
+    def apply_filter(self):
+        self.table_model.set_filter(self.filter_field.currentData(), self.filter_edit.text())
+
     def refresh_table(self):
+        self.table_model.reload()
+
+    def poll_changes(self):
+        if self.isVisible():
+            self.table_model.poll_changes()
+
+    def _remember_selection(self):
+        self.selected_pk = self.current_pk()
+
+    def _restore_selection(self):
+        if self.selected_pk is None:
+            return
+        row = self.table_model.row_of(self.selected_pk)
+        if row >= 0:
+            self.table.selectRow(row)
+            self.selected_pk = None
 
-        selected_row = self.table.currentRow()
-        selected_pk = None
-        if selected_row >= 0:
-            selected_pk = self.table.item(selected_row, 0).text()
-        with flask_app.app_context():
-            items = self.model.query.order_by(getattr(self.model, self.pk)).all()
-            self.table.setRowCount(len(items))
-            self.table.setColumnCount(len(self.fields))
-            self.table.setHorizontalHeaderLabels(self.headers)
-            for row, item in enumerate(items):
-                for col, field in enumerate(self.fields):
-                    value = getattr(item, field, "")
-                    self.table.setItem(row, col, QTableWidgetItem(str(value) if value is not None else ""))
-
-        if selected_pk is not None:
-            for row in range(self.table.rowCount()):
-                if self.table.item(row, 0).text() == selected_pk:
-                    self.table.selectRow(row)
-                    break
     def add_item(self):
         dialog = GenericDialog(self.fields, parent=self)
         if dialog.exec():
@@ -129,13 +446,12 @@ class TableWidget(QWidget):
                 obj = self.model(**self._convert_types(data))
                 db.session.add(obj)
                 db.session.commit()
-            self.refresh_table()
+            self.table_model.poll_changes()
     def edit_item(self):
-        row = self.table.currentRow()
-        if row < 0:
+        pk_value = self.current_pk()
+        if pk_value is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите запись для редактирования')
             return
-        pk_value = self.table.item(row, 0).text()
         with flask_app.app_context():
             obj = self.model.query.filter(getattr(self.model, self.pk)==pk_value).first()
             data = {f: getattr(obj, f, "") for f in self.fields}
@@ -148,19 +464,18 @@ class TableWidget(QWidget):
                 for k, v in self._convert_types(new_data).items():
                     setattr(obj, k, v)
                 db.session.commit()
-            self.refresh_table()
+            self.table_model.poll_changes()
     def delete_item(self):
-        row = self.table.currentRow()
-        if row < 0:
+        pk_value = self.current_pk()
+        if pk_value is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите запись для удаления')
             return
-        pk_value = self.table.item(row, 0).text()
         with flask_app.app_context():
             obj = self.model.query.filter(getattr(self.model, self.pk)==pk_value).first()
             if obj:
                 db.session.delete(obj)
                 db.session.commit()
-        self.refresh_table()
+        self.table_model.poll_changes()
     def _convert_types(self, data):
 
         result = {}
@@ -262,14 +577,16 @@ class AnalyticsWidget(QWidget):
         start, end = self.get_dates()
         with flask_app.app_context():
             res = Analytics.calculate_transportation_cost(vid, start, end)
-        self.result.setText(f"Себестоимость перевозок (ТС {vid}):\nТопливо: {res['fuel_cost']}\nОбслуживание: {res['maintenance_cost']}\nИтого: {res['total_cost']}")
+        self.result.setText(f"Себестоимость перевозок (ТС {vid}):\nТопливо: {res['fuel_cost']}\nОбслуживание: {res['maintenance_cost']}\nИтого: {res['total_cost']}"
+                            + (f"\nНа 1 км пробега по GPS: {res['cost_per_km']:.2f}" if res['cost_per_km'] is not None else ''))
 
     def show_efficiency(self):
         vid = self.get_selected_vehicle_id()
         start, end = self.get_dates()
         with flask_app.app_context():
             res = Analytics.analyze_vehicle_efficiency(vid, start, end)
-        self.result.setText(f"Эффективность использования (ТС {vid}):\nПробег: {res['total_distance']} км\nВремя: {res['total_time']} мин\nСредний расход: {res['average_fuel_consumption']} л/100км\nВыполнено задач: {res['tasks_completed']}")
+        self.result.setText(f"Эффективность использования (ТС {vid}):\nПробег: {res['total_distance']} км\nВремя: {res['total_time']} мин\nСредний расход: {res['average_fuel_consumption']} л/100км\nВыполнено задач: {res['tasks_completed']}\n"
+                            f"По телеметрии: поездок {res['trips']}, пробег {res['actual_distance']:.1f} км, в пути {res['actual_time']:.0f} мин, простой {res['idle_time']:.0f} мин")
 
     def show_report(self):
         start, end = self.get_dates()
@@ -295,7 +612,7 @@ class AnalyticsWidget(QWidget):
         with flask_app.app_context():
             res = Analytics.calculate_fuel_consumption_per_100km(vid, start, end)
         if res:
-            self.result.setText(f"Средний расход топлива: {res['avg_consumption_per_100km']:.2f} л/100км\nОбщий пробег: {res['total_distance']:.1f} км\nИзрасходовано топлива: {res['total_fuel']:.1f} л")
+            self.result.setText(f"Средний расход топлива: {res['avg_consumption_per_100km']:.2f} л/100км\nОбщий пробег: {res['total_distance']:.1f} км ({'по GPS' if res['distance_source'] == 'gps' else 'по одометру'})\nИзрасходовано топлива: {res['total_fuel']:.1f} л")
         else:
             self.result.setText('Недостаточно данных для расчёта расхода топлива!')
 
@@ -346,6 +663,358 @@ class AnalyticsWidget(QWidget):
         plt.tight_layout()
         plt.show()
 
+class TrackGenerationWorker(QThread):
+    """Построение и запись треков в фоновом потоке, чтобы окно не зависало"""
+    progress = pyqtSignal(int, int, str)
+    done = pyqtSignal(int, int, int)  # успешно, ошибок, всего точек треков в базе
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, pairs, parent=None):
+        super().__init__(parent)
+        self.pairs = pairs
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def is_cancel_requested(self):
+        return self._cancel_requested
+
+    def run(self):
+        def on_progress(done, total, vid, route_id, status):
+            print(f'[{done}/{total}] ТС {vid}, маршрут {route_id}: {status}')
+            self.progress.emit(done, total, f'ТС {vid}, маршрут {route_id}: {status}')
+
+        try:
+            with flask_app.app_context():
+                tracks = build_tracks(self.pairs, on_progress, should_stop=self.is_cancel_requested)
+                if self._cancel_requested:
+                    self.cancelled.emit()
+                    return
+                success_count = save_tracks(tracks)
+                total_tracks = TrackingData.query.count()
+        except Exception as e:
+            print(f'[ERROR] Генерация треков: {e}')
+            self.failed.emit(str(e))
+            return
+        self.done.emit(success_count, len(tracks) - success_count, total_tracks)
+
+
+# Постоянная страница карты: данные приходят через QWebChannel (объект bridge, см. MapBridge)
+MAP_PAGE_HTML = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8" />
+    <title>Карта маршрута</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <script src="qrc:///qtwebchannel/qwebchannel.js" type="text/javascript"></script>
+    <script src="https://api-maps.yandex.ru/2.1/?apikey=e794f57e-44c6-4dc7-be6c-2be3b174868f&lang=ru_RU" type="text/javascript"></script>
+    <style>
+        #map { height: 100vh; width: 100%; }
+        #error { color: red; font-weight: bold; position: absolute; top: 10px; left: 10px; background: #fff; z-index: 9999; padding: 8px; border-radius: 6px; }
+        .ymaps-2-1-79-balloon__content { font-size: 15px; }
+        .legend-box { position: absolute; top: 10px; right: 10px; background: #232323cc; color: #fff; border-radius: 8px; padding: 10px 18px; font-size: 15px; z-index: 9999; }
+    </style>
+</head>
+<body>
+<div id="error"></div>
+<div id="map"></div>
+<div class="legend-box" id="legend"></div>
+<script>
+    window.onerror = function(msg, url, line, col, error) {
+        document.getElementById('error').innerText = 'JS ERROR: ' + msg + ' (line ' + line + ')';
+    };
+    var colors = __COLORS__;
+    var map = null, bridge = null, tracks = {}, order = [], colorIndex = 0, fleet = {};
+    var step = 0, animationTimer = null, paused = false, SPEED = __DELAY__;
+
+    // Компактный формат трека (track_codec): разности соседних значений в кодировке Google polyline.
+    // Арифметика вместо битовых операций: секунды эпохи не помещаются в 32 бита
+    function decodeDeltas(str) {
+        var deltas = [], index = 0;
+        while (index < str.length) {
+            var shift = 0, result = 0, b;
+            do {
+                b = str.charCodeAt(index++) - 63;
+                result += (b & 0x1f) * Math.pow(2, shift);
+                shift += 5;
+            } while (b >= 0x20);
+            deltas.push((result % 2) ? -(result + 1) / 2 : result / 2);
+        }
+        return deltas;
+    }
+
+    // Ряд значений: строка разностей или обычный список, если в ряду есть пропуски
+    function decodeSeries(series, precision) {
+        if (typeof series !== 'string') return series;
+        var current = 0, factor = Math.pow(10, precision);
+        return decodeDeltas(series).map(function(d) { current += d; return current / factor; });
+    }
+
+    function decodePath(path) {
+        var deltas = decodeDeltas(path), coords = [], lat = 0, lon = 0;
+        for (var k = 0; k + 1 < deltas.length; k += 2) {
+            lat += deltas[k];
+            lon += deltas[k + 1];
+            coords.push([lat / 1e5, lon / 1e5]);
+        }
+        return coords;
+    }
+
+    function formatTime(seconds) {
+        return seconds === null ? '' : new Date(seconds * 1000).toISOString().slice(0, 19).replace('T', ' ');
+    }
+
+    function getTooltipHtml(track, j) {
+        var speed = track.speed[j], fuel = track.fuel[j], time = formatTime(track.times[j]);
+        return '<b>ТС:</b> ' + track.emoji + ' <b>' + track.regnum + '</b><br>' +
+               '<b>Координаты:</b> ' + track.coords[j][0].toFixed(5) + ', ' + track.coords[j][1].toFixed(5) + '<br>' +
+               (speed !== null && speed !== undefined ? '<b>Скорость:</b> ' + speed + ' км/ч<br>' : '') +
+               (fuel !== null && fuel !== undefined ? '<b>Топливо:</b> ' + fuel + ' л<br>' : '') +
+               (time ? '<b>Время:</b> ' + time : '');
+    }
+
+    function updateLegend() {
+        var legendHtml = '<b>Маршрут:</b> ';
+        if (order.length === 0) {
+            legendHtml += '<span style="color:#aaa;">Нет активных маршрутов</span>';
+        }
+        order.forEach(function(key) {
+            var track = tracks[key];
+            legendHtml += '<span style="color:' + track.color + '; font-size:20px; margin-right:12px;">' + track.emoji + ' ' + track.regnum + '</span>';
+        });
+        document.getElementById('legend').innerHTML = legendHtml;
+        document.getElementById('error').innerText = 'ТС-маршрутов: ' + order.length;
+    }
+
+    function removeTrack(key) {
+        var track = tracks[key];
+        if (!track) return;
+        track.objects.forEach(function(obj) { map.geoObjects.remove(obj); });
+        order.splice(order.indexOf(key), 1);
+        delete tracks[key];
+    }
+
+    function addTrack(data) {
+        var coords = decodePath(data.path);
+        if (coords.length < 2) return;
+        var color = tracks[data.key] ? tracks[data.key].color : colors[colorIndex++ % colors.length];
+        removeTrack(data.key);
+        var track = {coords: coords, times: decodeSeries(data.time, 0),
+                     speed: decodeSeries(data.speed, 1), fuel: decodeSeries(data.fuel, 1),
+                     regnum: data.regnum, emoji: data.emoji, color: color};
+        var poly = new ymaps.Polyline(coords, {}, {strokeColor: color, strokeWidth: 5, opacity: 0.7});
+        var startMark = new ymaps.Placemark(coords[0], {hintContent: 'Старт', balloonContent: 'Старт'}, {preset: 'islands#greenDotIcon'});
+        var endMark = new ymaps.Placemark(coords[coords.length - 1], {hintContent: 'Финиш', balloonContent: 'Финиш'}, {preset: 'islands#redDotIcon'});
+        // Маркер ТС (emoji в стандартном маркере)
+        track.marker = new ymaps.Placemark(coords[0], {
+            balloonContent: getTooltipHtml(track, 0),
+            hintContent: track.emoji + ' ' + track.regnum,
+            iconContent: track.emoji
+        }, {
+            preset: 'islands#blueCircleIcon',
+            iconColor: color
+        });
+        track.objects = [poly, startMark, endMark, track.marker];
+        track.objects.forEach(function(obj) { map.geoObjects.add(obj); });
+        tracks[data.key] = track;
+        order.push(data.key);
+    }
+
+    function clearAll() {
+        order.slice().forEach(removeTrack);
+        colorIndex = 0;
+        step = 0;
+        updateLegend();
+    }
+
+    function fit() {
+        if (order.length === 0) return;
+        var minLat = 90, maxLat = -90, minLon = 180, maxLon = -180;
+        order.forEach(function(key) {
+            tracks[key].coords.forEach(function(pt) {
+                minLat = Math.min(minLat, pt[0]); maxLat = Math.max(maxLat, pt[0]);
+                minLon = Math.min(minLon, pt[1]); maxLon = Math.max(maxLon, pt[1]);
+            });
+        });
+        map.setBounds([[minLat, minLon], [maxLat, maxLon]], {checkZoomRange: true, zoomMargin: 40});
+    }
+
+    // Слой текущих позиций ТС: Python присылает только попавшие в видимую область
+    function showPositions(positions) {
+        var seen = {};
+        positions.forEach(function(p) {
+            seen[p.vehicle_id] = true;
+            var hint = p.emoji + ' ' + p.regnum + ' — ' + p.time;
+            var mark = fleet[p.vehicle_id];
+            if (mark) {
+                mark.geometry.setCoordinates([p.lat, p.lon]);
+                mark.properties.set('hintContent', hint);
+            } else {
+                mark = new ymaps.Placemark([p.lat, p.lon], {hintContent: hint, iconContent: p.emoji}, {preset: 'islands#grayCircleIcon'});
+                map.geoObjects.add(mark);
+                fleet[p.vehicle_id] = mark;
+            }
+        });
+        Object.keys(fleet).forEach(function(id) {
+            if (!seen[id]) {
+                map.geoObjects.remove(fleet[id]);
+                delete fleet[id];
+            }
+        });
+    }
+
+    function sendViewport() {
+        var bounds = map.getBounds();
+        bridge.viewport(bounds[0][0], bounds[0][1], bounds[1][0], bounds[1][1]);
+    }
+
+    // Общая анимация: шаг step для всех маркеров
+    function animate() {
+        if (paused) {
+            animationTimer = null;
+            return;
+        }
+        var maxLen = 0;
+        order.forEach(function(key) {
+            var track = tracks[key];
+            maxLen = Math.max(maxLen, track.coords.length);
+            if (step < track.coords.length) {
+                track.marker.geometry.setCoordinates(track.coords[step]);
+                track.marker.properties.set('balloonContent', getTooltipHtml(track, step));
+            }
+        });
+        step++;
+        animationTimer = step < maxLen ? setTimeout(animate, SPEED) : null;
+    }
+
+    function start() {
+        if (animationTimer) clearTimeout(animationTimer);
+        animationTimer = null;
+        step = 0;
+        paused = false;
+        animate();
+    }
+
+    function togglePause() {
+        paused = !paused;
+        if (!paused && animationTimer === null) animate();
+    }
+
+    if (typeof ymaps === 'undefined') {
+        document.getElementById('error').innerText = 'Не удалось загрузить Яндекс.Карты';
+    } else {
+        ymaps.ready(function() {
+            map = new ymaps.Map('map', {center: [56.5, 34.5], zoom: 5});
+            updateLegend();
+            new QWebChannel(qt.webChannelTransport, function(channel) {
+                bridge = channel.objects.bridge;
+                bridge.tracks_added.connect(function(json) {
+                    JSON.parse(json).forEach(addTrack);
+                    updateLegend();
+                });
+                bridge.tracks_removed.connect(function(json) {
+                    JSON.parse(json).forEach(removeTrack);
+                    updateLegend();
+                });
+                bridge.cleared.connect(clearAll);
+                bridge.fit_requested.connect(fit);
+                bridge.started.connect(start);
+                bridge.pause_toggled.connect(togglePause);
+                bridge.speed_changed.connect(function(speed) { SPEED = Math.round(600 / speed); });
+                bridge.positions_shown.connect(function(json) { showPositions(JSON.parse(json)); });
+                map.events.add('boundschange', sendViewport);
+                bridge.ready();
+                sendViewport();
+            });
+        });
+    }
+</script>
+</body>
+</html>
+'''
+
+
+class MapBridge(QObject):
+    """
+    Канал данных между Python и постоянной страницей карты (QWebChannel).
+    До сигнала ready() от страницы сообщения копятся в очереди; затем уходят по одному за такт цикла событий,
+    так что треки большого парка появляются на карте постепенно и не блокируют интерфейс.
+    """
+    tracks_added = pyqtSignal(str)  # JSON-список треков в формате track_codec; трек с тем же key заменяется
+    tracks_removed = pyqtSignal(str)  # JSON-список key
+    cleared = pyqtSignal()
+    fit_requested = pyqtSignal()
+    started = pyqtSignal()
+    pause_toggled = pyqtSignal()
+    speed_changed = pyqtSignal(int)
+    positions_shown = pyqtSignal(str)  # JSON-список текущих позиций ТС в видимой области
+    viewport_changed = pyqtSignal(float, float, float, float)  # для Python: юг, запад, север, восток
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.is_ready = False
+        self.queue = deque()
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self._send_next)
+
+    @pyqtSlot()
+    def ready(self):
+        """Вызывается страницей, когда карта и канал готовы"""
+        self.is_ready = True
+        self._schedule()
+
+    @pyqtSlot(float, float, float, float)
+    def viewport(self, south, west, north, east):
+        """Вызывается страницей при смене видимой области карты"""
+        self.viewport_changed.emit(south, west, north, east)
+
+    def _post(self, signal, *args):
+        self.queue.append((signal, args))
+        self._schedule()
+
+    def _schedule(self):
+        if self.is_ready and self.queue and not self.timer.isActive():
+            self.timer.start()
+
+    def _send_next(self):
+        if not self.queue:
+            self.timer.stop()
+            return
+        signal, args = self.queue.popleft()
+        signal.emit(*args)
+
+    def add_tracks(self, tracks):
+        for start in range(0, len(tracks), Config.MAP_CHUNK_TRACKS):
+            self._post(self.tracks_added, json.dumps(tracks[start:start + Config.MAP_CHUNK_TRACKS]))
+
+    def remove_tracks(self, keys):
+        if keys:
+            self._post(self.tracks_removed, json.dumps(sorted(keys)))
+
+    def clear(self):
+        self.queue.clear()  # неотправленные треки всё равно были бы удалены
+        self._post(self.cleared)
+
+    def fit(self):
+        self._post(self.fit_requested)
+
+    def start(self):
+        self._post(self.started)
+
+    def toggle_pause(self):
+        self._post(self.pause_toggled)
+
+    def set_speed(self, speed):
+        self._post(self.speed_changed, speed)
+
+    def show_positions(self, positions):
+        self._post(self.positions_shown, json.dumps(positions))
+
+
 class MapSimulationWidget(QWidget):
     def refresh_vehicles_and_routes(self):
         for _, label, combo in self.vehicle_route_widgets:
@@ -379,9 +1048,14 @@ class MapSimulationWidget(QWidget):
             if v.id not in self.vehicle_route_map and self.routes:
                 self.vehicle_route_map[v.id] = self.routes[0].id
 
+    def load_map_page(self):
+        """Страница карты загружается один раз; дальше треки передаются через MapBridge"""
+        base_path = os.path.abspath(os.path.dirname(__file__))
+        self.webview.setHtml(self.generate_map_html(), QUrl.fromLocalFile(base_path + os.sep))
+
     def load_empty_map(self):
-        html = self.generate_map_html({}, {}, 5)
-        self.webview.setHtml(html)
+        self.bridge.clear()
+        self.shown_tracks = set()
 
     def get_vehicle_route_pairs(self):
         return [(vid, self.vehicle_route_map[vid]) for vid, _, _ in self.vehicle_route_widgets]
@@ -403,7 +1077,6 @@ class MapSimulationWidget(QWidget):
     def __init__(self):
         super().__init__()
         layout = QVBoxLayout(self)
-        self.osrm_cache = {}  
         
         self.vehicle_route_widgets = []  
         self.vehicle_route_map = {}    
@@ -441,6 +1114,20 @@ class MapSimulationWidget(QWidget):
         btn_layout.addWidget(self.btn_pause)
         btn_layout.addWidget(self.btn_clear)
         layout.addLayout(btn_layout)
+
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat('%v / %m')
+        self.progress_label = QLabel()
+        self.btn_cancel = QPushButton('Отмена')
+        self.btn_cancel.clicked.connect(self.cancel_generation)
+        progress_layout.addWidget(self.progress_bar, stretch=1)
+        progress_layout.addWidget(self.btn_cancel)
+        layout.addLayout(progress_layout)
+        layout.addWidget(self.progress_label)
+        self.generation_worker = None
+        self.after_generation = None
+        self.set_generation_running(False)
    
         self.legend = QLabel()
         self.legend.setStyleSheet('background: #232323; color: #fff; border-radius: 8px; padding: 8px; font-size: 13px;')
@@ -456,13 +1143,26 @@ class MapSimulationWidget(QWidget):
         layout.addLayout(speed_layout)
         self.webview = QWebEngineView()
         layout.addWidget(self.webview, stretch=1)
+        self.bridge = MapBridge(self)
+        self.shown_tracks = set()
+        self.channel = QWebChannel(self.webview.page())
+        self.channel.registerObject('bridge', self.bridge)
+        self.webview.page().setWebChannel(self.channel)
+        self.speed_slider.valueChanged.connect(self.bridge.set_speed)
+        self.bridge.viewport_changed.connect(self.on_viewport_changed)
+        self.viewport = None
+        self.fleet_revision = None
+        self.fleet_timer = QTimer(self)
+        self.fleet_timer.setInterval(Config.GUI_POLL_INTERVAL_MS)
+        self.fleet_timer.timeout.connect(self.poll_fleet_positions)
+        self.fleet_timer.start()
         self.btn_start.clicked.connect(self.start_simulation)
-        self.btn_generate.clicked.connect(self.generate_tracks)
+        self.btn_generate.clicked.connect(lambda: self.generate_tracks())
         self.btn_clear.clicked.connect(self.clear_tracks)
         self.btn_pause.clicked.connect(self.pause_resume_simulation)
         self.setMinimumHeight(500)
         self.setMinimumWidth(900)
-        self.load_empty_map()
+        self.load_map_page()
 
     def clear_tracks(self):
         with flask_app.app_context():
@@ -470,26 +1170,17 @@ class MapSimulationWidget(QWidget):
             db.session.commit()
         self.load_empty_map()
 
-    def get_osrm_route_points(self, start, end):
-        key = (round(start[0], 5), round(start[1], 5), round(end[0], 5), round(end[1], 5))
-        if key in self.osrm_cache:
-            return self.osrm_cache[key]
-        try:
-            url = f"http://router.project-osrm.org/route/v1/driving/{start[1]},{start[0]};{end[1]},{end[0]}?overview=full&geometries=geojson"
-            resp = requests.get(url, timeout=5)
-            data = resp.json()
-            if data.get('routes') and data['routes'][0]['geometry']['coordinates']:
-                points = [(lat, lon) for lon, lat in data['routes'][0]['geometry']['coordinates']]
-                self.osrm_cache[key] = points
-                return points
-            else:
-                QMessageBox.warning(self, 'Ошибка OSRM', 'Не удалось построить маршрут по дорогам. Будет использована прямая линия.')
-        except Exception as e:
-            print(f"OSRM error: {e}")
-            QMessageBox.warning(self, 'Ошибка OSRM', f'Ошибка при обращении к OSRM: {e}\nБудет использована прямая линия.')
-        return None
+    def set_generation_running(self, running):
+        for widget in (self.progress_bar, self.progress_label, self.btn_cancel):
+            widget.setVisible(running)
+        self.btn_generate.setEnabled(not running)
+        self.btn_start.setEnabled(not running)
+        self.btn_clear.setEnabled(not running)
 
-    def generate_tracks(self):
+    def generate_tracks(self, then=None):
+        """Запуск генерации треков в фоне; then() вызывается после успешного завершения"""
+        if self.generation_worker is not None:
+            return
         print('=== НАЧАЛО ГЕНЕРАЦИИ ТРЕКОВ ===')
    
         self.refresh_vehicles_and_routes()
@@ -505,59 +1196,55 @@ class MapSimulationWidget(QWidget):
             print("Нет доступных пар ТС-маршрут!")
             QMessageBox.warning(self, 'Нет данных', 'Нет доступных пар ТС и маршрутов!')
             return
-        success_count = 0
-        fail_count = 0
-        with flask_app.app_context():
-            for vid, route_id in pairs:
-                try:
-                    route = Route.query.filter_by(id=route_id).first()
-                    if not route:
-                        print(f"Маршрут с id={route_id} не найден!")
-                        fail_count += 1
-                        continue
-                    start = [route.start_lat, route.start_lon] if route.start_lat and route.start_lon else [55.7558, 37.6176]
-                    end = [route.end_lat, route.end_lon] if route.end_lat and route.end_lon else [59.9343, 30.3351]
-                    points = self.get_osrm_route_points(start, end)
-                    if points and len(points) >= 2:
-         
-                        if len(points) > 100:
-                            step = max(1, len(points)//100)
-                            points = points[::step]
-                        status = f'OSRM: {len(points)} точек.'
-                    else:
-                        steps = 40
-                        points = [(
-                            start[0] + (end[0] - start[0]) * i / steps,
-                            start[1] + (end[1] - start[1]) * i / steps
-                        ) for i in range(steps+1)]
-                        if len(points) < 2:
-                            status = 'Ошибка: не удалось сгенерировать маршрут.'
-                            fail_count += 1
-                            print(f'[FAIL] ТС {vid}, маршрут {route_id}: {status}')
-                            continue
-                        else:
-                            status = f'Fallback: {len(points)} точек.'
-                    TrackingData.query.filter_by(vehicle_id=vid, route_id=route_id).delete()
-                    for lat, lon in points:
-                        td = TrackingData(vehicle_id=vid, route_id=route_id, latitude=lat, longitude=lon, timestamp=datetime.now())
-                        db.session.add(td)
-                    success_count += 1
-                    print(f'[OK] ТС {vid}, маршрут {route_id}: {status}')
-                except Exception as e:
-                    print(f'[ERROR] ТС {vid}, маршрут {route_id}: {e}')
-                    fail_count += 1
-            db.session.commit()
-        with flask_app.app_context():
-            total_tracks = TrackingData.query.count()
-            print(f'=== КОНЕЦ ГЕНЕРАЦИИ ТРЕКОВ ===\nВсего треков в базе: {total_tracks}')
+        self.after_generation = then
+        self.progress_bar.setRange(0, len(pairs))
+        self.progress_bar.setValue(0)
+        self.progress_label.setText('Построение маршрутов...')
+        self.set_generation_running(True)
+        worker = TrackGenerationWorker(pairs, self)
+        worker.progress.connect(self.on_generation_progress)
+        worker.done.connect(self.on_generation_done)
+        worker.failed.connect(self.on_generation_failed)
+        worker.cancelled.connect(self.on_generation_cancelled)
+        worker.finished.connect(self.on_generation_thread_finished)
+        self.generation_worker = worker
+        worker.start()
+
+    def cancel_generation(self):
+        if self.generation_worker is not None:
+            self.progress_label.setText('Отмена...')
+            self.generation_worker.cancel()
+
+    def on_generation_progress(self, done, total, status):
+        self.progress_bar.setValue(done)
+        self.progress_label.setText(status)
+
+    def on_generation_thread_finished(self):
+        self.generation_worker.deleteLater()
+        self.generation_worker = None
+        self.set_generation_running(False)
+
+    def on_generation_done(self, success_count, fail_count, total_tracks):
+        print(f'=== КОНЕЦ ГЕНЕРАЦИИ ТРЕКОВ ===\nВсего треков в базе: {total_tracks}')
         self.update_legend()
         self.load_empty_map()
+        then, self.after_generation = self.after_generation, None
         if success_count == 0 or total_tracks == 0:
             print('Не удалось сгенерировать ни одного трека!')
             QMessageBox.critical(self, 'Ошибка генерации', 'Не удалось сгенерировать ни одного маршрута. Проверьте соединение с OSRM и попробуйте снова.')
+        elif then:
+            then()
         else:
             QMessageBox.information(self, 'Генерация треков', f'Успешно сгенерировано: {success_count}, ошибок: {fail_count}. В базе треков: {total_tracks}')
 
+    def on_generation_failed(self, error):
+        self.after_generation = None
+        QMessageBox.critical(self, 'Ошибка генерации', f'Ошибка при генерации треков: {error}')
+
+    def on_generation_cancelled(self):
+        self.after_generation = None
+        print('=== ГЕНЕРАЦИЯ ТРЕКОВ ОТМЕНЕНА ===')
+
     def start_simulation(self):
         pairs = self.get_vehicle_route_pairs()
         if not pairs:
@@ -565,207 +1252,91 @@ class MapSimulationWidget(QWidget):
             self.load_empty_map()
             return
         with flask_app.app_context():
-   
-            need_generate = False
-            for vid, route_id in pairs:
-                count = TrackingData.query.filter_by(vehicle_id=vid, route_id=route_id).count()
-                if count < 2:
-                    need_generate = True
-                    break
-            if need_generate:
-                self.generate_tracks()
-       
-                for vid, route_id in pairs:
-                    count = TrackingData.query.filter_by(vehicle_id=vid, route_id=route_id).count()
-                    if count < 2:
-                        QMessageBox.critical(self, 'Ошибка симуляции', f'Не удалось сгенерировать маршрут для ТС {vid}, маршрут {route_id}. Симуляция не будет запущена.')
-                        self.load_empty_map()
-                        return
-
-        tracks = {}
-        meta = {}
-        bounds = []
-        with flask_app.app_context():
-            vehicles_dict = {v.id: (v.registration_number, v.vehicle_type) for v in self.vehicles}
-            for vid, route_id in pairs:
-                points = TrackingData.query.filter_by(vehicle_id=vid, route_id=route_id).order_by(TrackingData.timestamp).all()
-                filtered_points = [p for p in points if p.latitude and p.longitude]
-                if filtered_points and len(filtered_points) > 1:
-                    key = f"{vid}_{route_id}"
-                    tracks[key] = [[p.latitude, p.longitude] for p in filtered_points]
-                    regnum, vtype = vehicles_dict.get(vid, (str(vid), ''))
-                    emoji = "🚗" if (vtype or '').lower() in ["легковой", "car"] else ("🚌" if (vtype or '').lower() in ["автобус", "bus"] else "🚚")
-                    meta[key] = [{
-                        'lat': p.latitude,
-                        'lon': p.longitude,
-                        'speed': p.speed,
-                        'timestamp': p.timestamp.strftime('%Y-%m-%d %H:%M:%S') if p.timestamp else '',
-                        'fuel': p.fuel_level,
-                        'regnum': regnum,
-                        'emoji': emoji,
-                        'route_id': route_id
-                    } for p in filtered_points]
-                    bounds += tracks[key]
-        if not tracks:
-            QMessageBox.critical(self, 'Ошибка симуляции', 'Нет сгенерированных треков для выбранных пар. Симуляция не будет запущена!')
-            self.load_empty_map()
+            need_generate = any(
+                TrackingData.query.filter_by(vehicle_id=vid, route_id=route_id).count() < 2 for vid, route_id in pairs
+            )
+        if need_generate:
+            self.generate_tracks(then=lambda: self.show_simulation(self.get_vehicle_route_pairs()))
             return
-        html = self.generate_map_html(tracks, meta, self.speed_slider.value(), bounds)
-        self.webview.setHtml(html)
+        self.show_simulation(pairs)
+
+    def show_simulation(self, pairs):
+        pairs = list(dict.fromkeys(pairs))
+        with flask_app.app_context():
+            rows = db.session.query(TrackingData.vehicle_id, TrackingData.route_id, TrackingData.latitude,
+                                    TrackingData.longitude, TrackingData.speed, TrackingData.fuel_level,
+                                    TrackingData.timestamp) \
+                .filter(tuple_(TrackingData.vehicle_id, TrackingData.route_id).in_(pairs),
+                        TrackingData.latitude.isnot(None), TrackingData.longitude.isnot(None)) \
+                .order_by(TrackingData.vehicle_id, TrackingData.route_id, TrackingData.timestamp).all()
+        grouped = {}
+        for row in rows:
+            grouped.setdefault((row.vehicle_id, row.route_id), []).append(row)
+        for vid, route_id in pairs:
+            if len(grouped.get((vid, route_id), [])) < 2:
+                QMessageBox.critical(self, 'Ошибка симуляции', f'Не удалось сгенерировать маршрут для ТС {vid}, маршрут {route_id}. Симуляция не будет запущена.')
+                self.load_empty_map()
+                return
+
+        vehicles_dict = {v.id: (v.registration_number, v.vehicle_type) for v in self.vehicles}
+        tracks = []
+        for vid, route_id in pairs:
+            points = grouped[(vid, route_id)]
+            keep = simplify_mask([p.latitude for p in points], [p.longitude for p in points],
+                                 Config.MAP_SIMPLIFY_TOLERANCE_M).tolist()
+            points = [p for p, k in zip(points, keep) if k]
+            regnum, vtype = vehicles_dict.get(vid, (str(vid), ''))
+            emoji = "🚗" if (vtype or '').lower() in ["легковой", "car"] else ("🚌" if (vtype or '').lower() in ["автобус", "bus"] else "🚚")
+            tracks.append(track_codec.encode_track(points, key=f"{vid}_{route_id}", regnum=regnum, emoji=emoji, route_id=route_id))
+        # на карте заменяются только нужные треки: страница и уже загруженные объекты остаются
+        shown = {t['key'] for t in tracks}
+        self.bridge.remove_tracks(self.shown_tracks - shown)
+        self.bridge.add_tracks(tracks)
+        self.bridge.fit()
+        self.bridge.start()
+        self.shown_tracks = shown
         QMessageBox.information(self, 'Симуляция', f'Симуляция успешно запущена! Активных маршрутов: {len(tracks)}')
 
-    def generate_map_html(self, tracks, meta, speed=5, bounds=None):
-        import os
+    def on_viewport_changed(self, south, west, north, east):
+        self.viewport = (south, west, north, east)
+        self.refresh_fleet_layer()
+
+    def poll_fleet_positions(self):
+        """По таймеру: слой позиций перерисовывается, только если изменилось хранилище последних позиций"""
+        if self.viewport is None or not self.isVisible():
+            return
+        with flask_app.app_context():
+            position_store.sync()
+        if position_store.revision != self.fleet_revision:
+            self.refresh_fleet_layer()
+
+    def refresh_fleet_layer(self):
+        """Слой текущих позиций: на страницу уходят только ТС в видимой области (отбор по пространственному индексу)"""
+        with flask_app.app_context():
+            positions, index = position_index()
+            found = index.bbox(*self.viewport).tolist()[:Config.MAP_MAX_POSITIONS]
+        self.fleet_revision = position_store.revision
+        vehicles_dict = {v.id: (v.registration_number, v.vehicle_type) for v in self.vehicles}
+        payload = []
+        for i in found:
+            position = positions[i]
+            regnum, vtype = vehicles_dict.get(position['vehicle_id'], (str(position['vehicle_id']), ''))
+            payload.append({
+                'vehicle_id': position['vehicle_id'],
+                'lat': position['latitude'],
+                'lon': position['longitude'],
+                'regnum': regnum,
+                'emoji': "🚗" if (vtype or '').lower() in ["легковой", "car"] else ("🚌" if (vtype or '').lower() in ["автобус", "bus"] else "🚚"),
+                'time': position['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+            })
+        self.bridge.show_positions(payload)
+
+    def generate_map_html(self):
         colors = ['#e53935', '#1e88e5', '#43a047', '#fbc02d', '#8e24aa', '#00897b', '#6d4c41', '#3949ab', '#d81b60', '#00acc1']
-        js_tracks = json.dumps(tracks)
-        js_colors = json.dumps(colors)
-        js_meta = json.dumps(meta)
-        js_bounds = json.dumps(bounds) if bounds else 'null'
-    
-        base_path = os.path.abspath(os.path.dirname(__file__)).replace('\\', '/')
-  
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8" />
-            <base href="file:///{base_path}/">
-            <title>Карта маршрута</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <script src="https://api-maps.yandex.ru/2.1/?apikey=e794f57e-44c6-4dc7-be6c-2be3b174868f&lang=ru_RU" type="text/javascript"></script>
-            <style>
-                #map {{ height: 100vh; width: 100%; }}
-                #error {{ color: red; font-weight: bold; position: absolute; top: 10px; left: 10px; background: #fff; z-index: 9999; padding: 8px; border-radius: 6px; }}
-                .ymaps-2-1-79-balloon__content {{ font-size: 15px; }}
-                .legend-box {{ position: absolute; top: 10px; right: 10px; background: #232323cc; color: #fff; border-radius: 8px; padding: 10px 18px; font-size: 15px; z-index: 9999; }}
-            </style>
-        </head>
-        <body>
-        <div id="error"></div>
-        <div id="map"></div>
-        <div class="legend-box" id="legend"></div>
-        <script>
-            window.onerror = function(msg, url, line, col, error) {{
-                document.getElementById('error').innerText = 'JS ERROR: ' + msg + ' (line ' + line + ')';
-            }};
-            var tracks = {js_tracks};
-            var colors = {js_colors};
-            var meta = {js_meta};
-            var bounds = {js_bounds};
-            var map, keys, polylines, markers, maxLens, i = 0, animationTimer = null, SPEED = {int(600/speed)};
-            var paused = false;
-            window.togglePause = function() {{
-                paused = !paused;
-                if (!paused && animationTimer === null) animate();
-            }};
-            ymaps.ready(function() {{
-                map = new ymaps.Map('map', {{center: [56.5, 34.5], zoom: 5}});
-                if (bounds && bounds.length > 0) {{
-                    var lats = bounds.map(function(pt) {{return pt[0];}});
-                    var lons = bounds.map(function(pt) {{return pt[1];}});
-                    var minLat = Math.min.apply(null, lats);
-                    var maxLat = Math.max.apply(null, lats);
-                    var minLon = Math.min.apply(null, lons);
-                    var maxLon = Math.max.apply(null, lons);
-                    map.setBounds([[minLat, minLon], [maxLat, maxLon]], {{checkZoomRange:true, zoomMargin:40}});
-                }}
-                keys = Object.keys(tracks);
-                document.getElementById('error').innerText = 'ТС-маршрутов: ' + keys.length;
-
-                var legendHtml = '<b>Маршрут:</b> ';
-                if (keys.length > 0) {{
-                    for (var k=0; k<keys.length; k++) {{
-                        var info = meta[keys[k]][0];
-                        legendHtml += '<span style="color:' + colors[k%colors.length] + '; font-size:20px; margin-right:12px;">' + info.emoji + ' ' + info.regnum + '</span>';
-                    }}
-                }} else {{
-                    legendHtml += '<span style="color:#aaa;">Нет активных маршрутов</span>';
-                }}
-                document.getElementById('legend').innerHTML = legendHtml;
-                polylines = [];
-                markers = [];
-                maxLens = [];
-                // Старт/финиш маркеры
-                for (var k=0; k<keys.length; k++) {{
-                    var key = keys[k];
-                    var color = colors[k % colors.length];
-                    var coords = tracks[key].map(function(pt) {{ return [pt[0], pt[1]]; }});
-                    if (!coords || coords.length < 2) continue;
-                    var poly = new ymaps.Polyline(coords, {{}}, {{strokeColor: color, strokeWidth: 5, opacity: 0.7}});
-                    map.geoObjects.add(poly);
-                    polylines.push(poly);
-                    var info = meta[key][0];
-      
-                    var startMark = new ymaps.Placemark(coords[0], {{hintContent: 'Старт', balloonContent: 'Старт'}}, {{preset: 'islands#greenDotIcon'}});
-                    map.geoObjects.add(startMark);
-  
-                    var endMark = new ymaps.Placemark(coords[coords.length-1], {{hintContent: 'Финиш', balloonContent: 'Финиш'}}, {{preset: 'islands#redDotIcon'}});
-                    map.geoObjects.add(endMark);
-                    // Маркер ТС (emoji в стандартном маркере)
-                    var marker = new ymaps.Placemark(coords[0], {{
-                        balloonContent: getTooltipHtml(info),
-                        hintContent: info.emoji + ' ' + info.regnum,
-                        iconContent: info.emoji
-                    }}, {{
-                        preset: 'islands#blueCircleIcon',
-                        iconColor: color
-                    }});
-                    map.geoObjects.add(marker);
-                    markers.push(marker);
-   
-                    maxLens.push(coords.length);
-                }}
-                function getTooltipHtml(info) {{
-                    return `<b>ТС:</b> ${{info.emoji}} <b>${{info.regnum}}</b><br>` +
-                           `<b>Координаты:</b> ${{info.lat.toFixed(5)}}, ${{info.lon.toFixed(5)}}<br>` +
-                           (info.speed !== null && info.speed !== undefined ? `<b>Скорость:</b> ${{info.speed}} км/ч<br>` : '') +
-                           (info.fuel !== null && info.fuel !== undefined ? `<b>Топливо:</b> ${{info.fuel}} л<br>` : '') +
-                           (info.timestamp ? `<b>Время:</b> ${{info.timestamp}}` : '');
-                }}
-                // Глобальная анимация
-                i = 0;
-                if (animationTimer) clearTimeout(animationTimer);
-                function animate() {{
-                    if (paused) {{
-                        animationTimer = null;
-                        return;
-                    }}
-                    for (var k=0; k<markers.length; k++) {{
-                        var coords = tracks[keys[k]];
-                        var infos = meta[keys[k]];
-                        if (coords && i < coords.length && infos && i < infos.length) {{
-                            markers[k].geometry.setCoordinates([coords[i][0], coords[i][1]]);
-                            var info = infos[i];
-                            markers[k].properties.set('balloonContent', getTooltipHtml(info));
-                            markers[k].properties.set('hintContent', info.emoji + ' ' + info.regnum);
-                        }}
-                    }}
-                    i++;
-                    if (i < Math.max.apply(null, maxLens)) {{
-                        animationTimer = setTimeout(animate, SPEED);
-                    }}
-                    else {{
-                        animationTimer = null;
-                    }}
-                }}
-       
-                map.events.add('boundschange', function (e) {{
-   
-                }});
-                map.events.add('actionend', function (e) {{
- 
-                }});
-                animate();
-                window.animate = animate;
-            }});
-        </script>
-        </body>
-        </html>
-        '''
+        return MAP_PAGE_HTML.replace('__COLORS__', json.dumps(colors)).replace('__DELAY__', str(int(600 / self.speed_slider.value())))
 
     def pause_resume_simulation(self):
-
-        self.webview.page().runJavaScript('window.togglePause && window.togglePause();')
+        self.bridge.toggle_pause()
 
     def _start_scroll(self, direction):
         self._scroll_direction = direction
@@ -926,7 +1497,7 @@ if __name__ == '__main__':
         QPushButton:pressed {
             background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #005999, stop:1 #004080);
         }
-        QTableWidget {
+        QTableView {
             background: #2d2d2d;
             border: 1px solid #3d3d3d;
             border-radius: 8px;
@@ -943,11 +1514,11 @@ if __name__ == '__main__':
             background: #2d2d2d;
             border: none;
         }
-        QTableWidget::item {
+        QTableView::item {
             padding: 8px;
             border-bottom: 1px solid #3d3d3d;
         }
-        QTableWidget::item:selected {
+        QTableView::item:selected {
             background: #007acc;
         }
         QHeaderView::section {
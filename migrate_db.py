@@ -0,0 +1,95 @@
+from sqlalchemy import inspect, text
+from database import db, app
+from modules.vehicle_management import Vehicle, MaintenanceRecord, SparePart, FuelRecord, OwnershipHistory, User
+from modules.dispatch import Driver, Route, Task, WorkHours
+from modules.monitoring import TrackingData, GPSData, FuelConsumption, DrivingStyle, Violation
+from modules.rollups import VehicleDailyStats
+from modules.versioning import TableVersion, RowChange, seed_table_versions
+from modules.route_cache import RouteGeometry
+from modules.trips import Trip, TripProgress
+from modules.mileage import VehicleDailyMileage, MileageProgress
+from modules.violations import ViolationState
+from modules.partitioning import PARTITIONED_TABLES, is_partitioned, convert_to_partitioned, ensure_partitions
+
+
+def create_missing_tables():
+    """Создание таблиц, которых ещё нет в базе (существующие не трогаются)"""
+    existing = set(inspect(db.engine).get_table_names())
+    missing = [t for t in db.metadata.sorted_tables if t.name not in existing]
+    db.metadata.create_all(bind=db.engine, tables=missing)
+    for table in missing:
+        print(f"✅ Создана таблица {table.name}")
+
+
+def partition_telemetry_tables():
+    """Перевод таблиц телеметрии в секционированные по месяцам и создание недостающих секций (PostgreSQL)"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    existing = set(inspect(db.engine).get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name in PARTITIONED_TABLES and table.name in existing and not is_partitioned(conn, table.name):
+                convert_to_partitioned(conn, table)
+                print(f"✅ Таблица {table.name} переведена на помесячные секции")
+        for name in ensure_partitions(conn):
+            print(f"✅ Создана секция {name}")
+
+
+def drop_obsolete_not_null():
+    """Снятие NOT NULL со столбцов, которые в моделях стали необязательными (PostgreSQL)"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {c['name']: c for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            if current is None or current['nullable'] or not column.nullable:
+                continue
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN "{column.name}" DROP NOT NULL'))
+            print(f"✅ Столбец {table.name}.{column.name} теперь допускает NULL")
+
+
+def create_missing_indexes():
+    """
+    Создание индексов, объявленных в моделях, но отсутствующих в базе.
+    В PostgreSQL индексы строятся через CREATE INDEX CONCURRENTLY, без блокировки записи в таблицу
+    (кроме секционированных таблиц, где CONCURRENTLY не поддерживается).
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if db.engine.dialect.name == 'postgresql':
+                columns = ', '.join(f'"{c.name}"' for c in index.columns)
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    concurrently = '' if is_partitioned(conn, table.name) else 'CONCURRENTLY '
+                    conn.execute(text(f'CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {table.name} ({columns})'))
+                    conn.execute(text(f'ANALYZE {table.name}'))
+            else:
+                index.create(bind=db.engine, checkfirst=True)
+            print(f"✅ Создан индекс {index.name} ({table.name})")
+
+
+def migrate():
+    with app.app_context():
+        partition_telemetry_tables()
+        create_missing_tables()
+        drop_obsolete_not_null()
+        create_missing_indexes()
+        with db.engine.begin() as conn:
+            seed_table_versions(conn, [t.name for t in db.metadata.sorted_tables])
+        print("Миграция завершена")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -1,62 +1,199 @@
-from datetime import datetime, timedelta
-from sqlalchemy import func
+from datetime import datetime, time, timedelta
+from itertools import chain
+from sqlalchemy import func, event, inspect
+from sqlalchemy.orm import Session
 from database import db
 from modules.vehicle_management import Vehicle, FuelRecord, MaintenanceRecord
-from modules.dispatch import Task
+from modules.dispatch import Task, Route
 from modules.monitoring import FuelConsumption
-from modules.modeling import predict_failure_probability
+from modules.modeling import predict_failure_probability_batch
+from modules.rollups import VehicleDailyStats, columns_changed, changed_routes
+from modules.trips import Trip
+from modules.mileage import VehicleDailyMileage
+from modules.cache import cached, analytics_cache
+
+# Таблицы, от которых зависят результаты аналитики: модель -> столбец ТС
+CACHE_SOURCES = {
+    FuelRecord: 'vehicle_id',
+    MaintenanceRecord: 'vehicle_id',
+    Task: 'vehicle_id',
+    FuelConsumption: 'vehicle_id',
+}
+# Столбцы ТС, которые выводятся в результатах аналитики: их изменение сбрасывает весь кэш
+VEHICLE_COLUMNS = ('registration_number',)
+
+def _grouped(query, vehicle_column, vehicle_ids):
+    """Группировка запроса по ТС с необязательным ограничением списком vehicle_ids"""
+    if vehicle_ids is not None:
+        query = query.filter(vehicle_column.in_(vehicle_ids))
+    return query.group_by(vehicle_column).all()
+
+
+def _whole_days(start_date, end_date):
+    """Границы периода — целые сутки (date или полночь), значит период можно считать по суточным итогам"""
+    return all(not isinstance(v, datetime) or v.time() == time.min for v in (start_date, end_date))
+
+
+def _day_range(start_date, end_date):
+    """
+    Условие на суточные итоги для периода между start_date и end_date.
+    Как и between по исходным записям с границами в полночь, сутки end_date в период не входят.
+    """
+    start = start_date.date() if isinstance(start_date, datetime) else start_date
+    end = end_date.date() if isinstance(end_date, datetime) else end_date
+    return (VehicleDailyStats.day >= start, VehicleDailyStats.day < end)
+
+
+def _gps_mileage(start_date, end_date, vehicle_ids):
+    """
+    Пробег по точкам GPS за период, км: {vehicle_id: км} по суточному пробегу (modules/mileage).
+    Для границ не в полночь сутки end_date входят в период целиком.
+    """
+    start = start_date.date() if isinstance(start_date, datetime) else start_date
+    end = end_date.date() if isinstance(end_date, datetime) else end_date
+    last_day = VehicleDailyMileage.day < end if _whole_days(start_date, end_date) else VehicleDailyMileage.day <= end
+    return dict(_grouped(db.session.query(VehicleDailyMileage.vehicle_id, func.sum(VehicleDailyMileage.distance)).filter(
+        VehicleDailyMileage.day >= start, last_day
+    ), VehicleDailyMileage.vehicle_id, vehicle_ids))
+
+
+def _fleet_ids(vehicle_ids):
+    if vehicle_ids is not None:
+        return list(vehicle_ids)
+    return [vid for (vid,) in db.session.query(Vehicle.id).order_by(Vehicle.id)]
+
 
 class Analytics:
     @staticmethod
     def calculate_transportation_cost(vehicle_id, start_date, end_date):
         """Расчет себестоимости перевозок для конкретного ТС"""
-        fuel_cost = db.session.query(func.sum(FuelRecord.cost)).filter(
-            FuelRecord.vehicle_id == vehicle_id,
+        return Analytics.fleet_transportation_cost(start_date, end_date, [vehicle_id])[vehicle_id]
+
+    @staticmethod
+    @cached('vehicle_ids')
+    def fleet_transportation_cost(start_date, end_date, vehicle_ids=None):
+        """Себестоимость перевозок по всему парку (или по vehicle_ids): {vehicle_id: {...}}, по запросу на статью затрат"""
+        if _whole_days(start_date, end_date):
+            rows = _grouped(db.session.query(
+                VehicleDailyStats.vehicle_id,
+                func.sum(VehicleDailyStats.fuel_cost),
+                func.sum(VehicleDailyStats.maintenance_cost)
+            ).filter(*_day_range(start_date, end_date)), VehicleDailyStats.vehicle_id, vehicle_ids)
+            fuel = {vid: fuel_cost for vid, fuel_cost, _ in rows}
+            maintenance = {vid: maintenance_cost for vid, _, maintenance_cost in rows}
+        else:
+            fuel, maintenance = Analytics._raw_costs(start_date, end_date, vehicle_ids)
+        mileage = _gps_mileage(start_date, end_date, vehicle_ids)
+
+        result = {}
+        for vid in _fleet_ids(vehicle_ids):
+            fuel_cost = fuel.get(vid) or 0
+            maintenance_cost = maintenance.get(vid) or 0
+            distance = mileage.get(vid) or 0
+            result[vid] = {
+                'fuel_cost': fuel_cost,
+                'maintenance_cost': maintenance_cost,
+                'total_cost': fuel_cost + maintenance_cost,
+                'gps_distance': distance,
+                'cost_per_km': (fuel_cost + maintenance_cost) / distance if distance else None
+            }
+        return result
+
+    @staticmethod
+    def _raw_costs(start_date, end_date, vehicle_ids):
+        fuel = dict(_grouped(db.session.query(FuelRecord.vehicle_id, func.sum(FuelRecord.cost)).filter(
             FuelRecord.date.between(start_date, end_date)
-        ).scalar() or 0
+        ), FuelRecord.vehicle_id, vehicle_ids))
 
-        maintenance_cost = db.session.query(func.sum(MaintenanceRecord.cost)).filter(
-            MaintenanceRecord.vehicle_id == vehicle_id,
+        maintenance = dict(_grouped(db.session.query(MaintenanceRecord.vehicle_id, func.sum(MaintenanceRecord.cost)).filter(
             MaintenanceRecord.date.between(start_date, end_date)
-        ).scalar() or 0
-
-        return {
-            'fuel_cost': fuel_cost,
-            'maintenance_cost': maintenance_cost,
-            'total_cost': fuel_cost + maintenance_cost
-        }
+        ), MaintenanceRecord.vehicle_id, vehicle_ids))
+        return fuel, maintenance
 
     @staticmethod
     def analyze_vehicle_efficiency(vehicle_id, start_date, end_date):
         """Анализ эффективности использования ТС"""
-        tasks = Task.query.filter(
-            Task.vehicle_id == vehicle_id,
-            Task.start_time.between(start_date, end_date)
-        ).all()
+        return Analytics.fleet_vehicle_efficiency(start_date, end_date, [vehicle_id])[vehicle_id]
 
-        total_distance = sum(task.route.distance for task in tasks)
-        total_time = sum(task.route.estimated_time for task in tasks)
+    @staticmethod
+    @cached('vehicle_ids')
+    def fleet_vehicle_efficiency(start_date, end_date, vehicle_ids=None):
+        """Эффективность использования по всему парку (или по vehicle_ids): {vehicle_id: {...}}"""
+        if _whole_days(start_date, end_date):
+            rows = _grouped(db.session.query(
+                VehicleDailyStats.vehicle_id,
+                func.sum(VehicleDailyStats.distance),
+                func.sum(VehicleDailyStats.task_time),
+                func.sum(VehicleDailyStats.task_count),
+                func.sum(VehicleDailyStats.consumption_sum),
+                func.sum(VehicleDailyStats.consumption_count)
+            ).filter(*_day_range(start_date, end_date)), VehicleDailyStats.vehicle_id, vehicle_ids)
+            tasks = {vid: (distance, task_time, task_count) for vid, distance, task_time, task_count, _, _ in rows if task_count}
+            consumption = {vid: c_sum / c_count for vid, _, _, _, c_sum, c_count in rows if c_count}
+        else:
+            tasks, consumption = Analytics._raw_efficiency(start_date, end_date, vehicle_ids)
+        # фактические пробег и время — по поездкам из телеметрии (modules/trips), а не по плановым маршрутам
+        trips = {row[0]: row[1:] for row in _grouped(db.session.query(
+            Trip.vehicle_id,
+            func.sum(Trip.distance),
+            func.sum(Trip.duration),
+            func.sum(Trip.idle_time),
+            func.sum(Trip.fuel_used),
+            func.count(Trip.id)
+        ).filter(Trip.start_time >= start_date, Trip.start_time < end_date), Trip.vehicle_id, vehicle_ids)}
 
-        fuel_consumption = FuelConsumption.query.filter(
-            FuelConsumption.vehicle_id == vehicle_id,
-            FuelConsumption.timestamp.between(start_date, end_date)
-        ).all()
+        result = {}
+        for vid in _fleet_ids(vehicle_ids):
+            total_distance, total_time, tasks_completed = tasks.get(vid, (0, 0, 0))
+            actual_distance, actual_time, idle_time, trip_fuel, trip_count = trips.get(vid, (0, 0, 0, None, 0))
+            result[vid] = {
+                'total_distance': total_distance,
+                'total_time': total_time,
+                'average_fuel_consumption': consumption.get(vid) or 0,
+                'tasks_completed': tasks_completed,
+                'actual_distance': actual_distance,
+                'actual_time': actual_time,
+                'idle_time': idle_time,
+                'trip_fuel_used': trip_fuel,
+                'trips': trip_count
+            }
+        return result
 
-        avg_consumption = (
-            sum(fc.consumption_rate for fc in fuel_consumption) / len(fuel_consumption)
-            if fuel_consumption else 0
-        )
+    @staticmethod
+    def _raw_efficiency(start_date, end_date, vehicle_ids):
+        tasks = {row[0]: row[1:] for row in _grouped(db.session.query(
+            Task.vehicle_id,
+            func.coalesce(func.sum(Route.distance), 0),
+            func.coalesce(func.sum(Route.estimated_time), 0),
+            func.count(Task.id)
+        ).join(Route, Task.route_id == Route.id).filter(
+            Task.start_time.between(start_date, end_date)
+        ), Task.vehicle_id, vehicle_ids)}
 
-        return {
-            'total_distance': total_distance,
-            'total_time': total_time,
-            'average_fuel_consumption': avg_consumption,
-            'tasks_completed': len(tasks)
-        }
+        consumption = dict(_grouped(db.session.query(FuelConsumption.vehicle_id, func.avg(FuelConsumption.consumption_rate)).filter(
+            FuelConsumption.timestamp.between(start_date, end_date)
+        ), FuelConsumption.vehicle_id, vehicle_ids))
+        return tasks, consumption
 
     @staticmethod
+    @cached()
     def generate_regulatory_report(report_type, start_date, end_date):
         """Формирование регламентных отчетов"""
+        if _whole_days(start_date, end_date) and report_type in ('fuel', 'maintenance'):
+            if report_type == 'fuel':
+                columns = (func.sum(VehicleDailyStats.fuel_amount).label('total_fuel'),
+                           func.sum(VehicleDailyStats.fuel_cost).label('total_cost'))
+                count = VehicleDailyStats.fuel_count
+            else:
+                columns = (func.sum(VehicleDailyStats.maintenance_count).label('maintenance_count'),
+                           func.sum(VehicleDailyStats.maintenance_cost).label('total_cost'))
+                count = VehicleDailyStats.maintenance_count
+            return db.session.query(Vehicle.registration_number, *columns).join(
+                VehicleDailyStats, Vehicle.id == VehicleDailyStats.vehicle_id
+            ).filter(*_day_range(start_date, end_date)).group_by(
+                Vehicle.registration_number
+            ).having(func.sum(count) > 0).all()
+
         if report_type == 'fuel':
             return db.session.query(
                 Vehicle.registration_number,
@@ -71,11 +208,12 @@ class Analytics:
                 Vehicle.registration_number,
                 func.count(MaintenanceRecord.id).label('maintenance_count'),
                 func.sum(MaintenanceRecord.cost).label('total_cost')
-            ).join(MaintenanceRecord).filter(
+            ).join(MaintenanceRecord, Vehicle.id == MaintenanceRecord.vehicle_id).filter(
                 MaintenanceRecord.date.between(start_date, end_date)
             ).group_by(Vehicle.registration_number).all()
 
     @staticmethod
+    @cached('vehicle_id')
     def predict_maintenance_needs(vehicle_id):
         """Прогнозный анализ потребностей в обслуживании"""
         last_maintenance = MaintenanceRecord.query.filter(
@@ -108,14 +246,44 @@ class Analytics:
         }
 
     @staticmethod
+    @cached('vehicle_ids')
+    def fleet_fuel_consumption(start_date, end_date, vehicle_ids=None):
+        """Расход топлива на 100 км по всему парку (или по vehicle_ids): заправки за период к пробегу по GPS"""
+        if _whole_days(start_date, end_date):
+            fuel = dict(_grouped(db.session.query(
+                VehicleDailyStats.vehicle_id, func.sum(VehicleDailyStats.fuel_amount)
+            ).filter(*_day_range(start_date, end_date)), VehicleDailyStats.vehicle_id, vehicle_ids))
+        else:
+            fuel = dict(_grouped(db.session.query(FuelRecord.vehicle_id, func.sum(FuelRecord.amount)).filter(
+                FuelRecord.date.between(start_date, end_date)
+            ), FuelRecord.vehicle_id, vehicle_ids))
+        mileage = _gps_mileage(start_date, end_date, vehicle_ids)
+
+        result = {}
+        for vid in _fleet_ids(vehicle_ids):
+            total_fuel = fuel.get(vid) or 0
+            distance = mileage.get(vid) or 0
+            result[vid] = {
+                'total_fuel': total_fuel,
+                'gps_distance': distance,
+                'consumption_per_100km': total_fuel / distance * 100 if distance else None
+            }
+        return result
+
+    @staticmethod
+    @cached('vehicle_id')
     def calculate_fuel_consumption_per_100km(vehicle_id, start_date, end_date):
-        """Расчёт среднего расхода топлива на 100 км по данным о заправках"""
+        """
+        Расчёт среднего расхода топлива на 100 км по данным о заправках.
+        Пробег берётся по точкам GPS, а если их за период нет — по показаниям одометра в заправках.
+        """
         # Получаем все заправки по ТС за период, отсортированные по дате
         fuel_records = FuelRecord.query.filter(
             FuelRecord.vehicle_id == vehicle_id,
             FuelRecord.date.between(start_date, end_date)
         ).order_by(FuelRecord.date).all()
-        if len(fuel_records) < 2:
+        gps_distance = _gps_mileage(start_date, end_date, [vehicle_id]).get(vehicle_id) or 0
+        if not fuel_records or len(fuel_records) < 2 and not gps_distance:
             return None  # Недостаточно данных
         total_fuel = 0.0
         total_distance = 0.0
@@ -127,23 +295,66 @@ class Analytics:
                 prev_mileage = rec.mileage
             if rec.amount is not None:
                 total_fuel += rec.amount
+        source = 'odometer'
+        if gps_distance:
+            total_distance, source = gps_distance, 'gps'
         if total_distance == 0:
             return None  # Нет данных о пробеге
         avg_consumption = (total_fuel / total_distance) * 100
         return {
             'total_fuel': total_fuel,
             'total_distance': total_distance,
-            'avg_consumption_per_100km': avg_consumption
+            'avg_consumption_per_100km': avg_consumption,
+            'distance_source': source
         }
 
     @staticmethod
     def failure_probability(vehicle_id, horizon_days=30):
         """Вероятность поломки ТС в течение horizon_days на основе истории ТО"""
-        maintenance_dates = db.session.query(MaintenanceRecord.date).filter(
-            MaintenanceRecord.vehicle_id == vehicle_id
-        ).order_by(MaintenanceRecord.date).all()
-        maintenance_dates = [d[0] for d in maintenance_dates if d[0] is not None]
-        if len(maintenance_dates) < 2:
-            return None
-        prob = predict_failure_probability(maintenance_dates, horizon_days=horizon_days)
-        return prob 
\ No newline at end of file
+        return Analytics.fleet_failure_probability(horizon_days, [vehicle_id]).get(vehicle_id)
+
+    @staticmethod
+    @cached('vehicle_ids')
+    def fleet_failure_probability(horizon_days=30, vehicle_ids=None):
+        """Вероятность поломки по всему парку (или по vehicle_ids) одним запросом: {vehicle_id: вероятность}"""
+        query = db.session.query(MaintenanceRecord.vehicle_id, MaintenanceRecord.date).filter(
+            MaintenanceRecord.date.isnot(None)
+        )
+        if vehicle_ids is not None:
+            query = query.filter(MaintenanceRecord.vehicle_id.in_(vehicle_ids))
+        rows = query.all()
+        if not rows:
+            return {}
+        vids, dates = zip(*rows)
+        return predict_failure_probability_batch(vids, dates, horizon_days=horizon_days) 
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_vehicles(session, flush_context, instances):
+    """ТС, чьи записи меняются (с учётом прежних значений), — для сброса кэша после commit"""
+    changed = session.info.setdefault('analytics_vehicles', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        column = CACHE_SOURCES.get(type(obj))
+        if column:
+            changed.add(getattr(obj, column))
+            changed.update(inspect(obj).attrs[column].history.deleted)
+        elif isinstance(obj, Vehicle) and (obj not in session.dirty or columns_changed(obj, VEHICLE_COLUMNS)):
+            session.info['analytics_all'] = True
+    if changed_routes(session):
+        session.info['analytics_all'] = True
+    changed.discard(None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_analytics_cache(session):
+    changed = session.info.pop('analytics_vehicles', set())
+    if session.info.pop('analytics_all', False):
+        analytics_cache.clear()
+    elif changed:
+        analytics_cache.invalidate(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_vehicles(session):
+    session.info.pop('analytics_vehicles', None)
+    session.info.pop('analytics_all', None)
@@ -0,0 +1,116 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+# Метка записей, зависящих от всего парка (сбрасываются при любом изменении)
+ALL = '*'
+
+
+def _freeze(value):
+    """Приведение аргумента к хешируемому виду для ключа кэша"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class ResultCache:
+    """
+    Кэш результатов в памяти процесса: LRU с ограничением размера, время жизни записи
+    и метки ТС для точечного сброса. CACHE_TYPE = 'null' отключает кэширование.
+    """
+
+    def __init__(self, max_size=None, timeout=None, enabled=None):
+        self.max_size = Config.CACHE_MAX_SIZE if max_size is None else max_size
+        self.timeout = Config.CACHE_DEFAULT_TIMEOUT if timeout is None else timeout
+        self.enabled = Config.CACHE_TYPE != 'null' if enabled is None else enabled
+        self._entries = OrderedDict()  # ключ -> (срок истечения, метки, значение)
+        self._lock = threading.Lock()
+        self.generation = 0  # растёт при каждом сбросе; результат, посчитанный до сброса, не сохраняется
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value, tags=(ALL,), generation=None):
+        if not self.enabled or self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.timeout, frozenset(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, vehicle_ids):
+        """Сброс записей по указанным ТС и записей по всему парку"""
+        vehicle_ids = set(vehicle_ids)
+        if not vehicle_ids:
+            return
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, (_, tags, _) in self._entries.items() if ALL in tags or tags & vehicle_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+analytics_cache = ResultCache()
+
+
+def cached(vehicles=None, cache=None):
+    """
+    Кэширование результата функции по её аргументам.
+    vehicles — имя аргумента с id ТС (число или список); если он не задан или равен None,
+    запись считается зависящей от всего парка.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            store = analytics_cache if cache is None else cache
+            if not store.enabled:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__qualname__, _freeze(tuple(bound.arguments.items())))
+            found, value = store.get(key)
+            if found:
+                return value
+            generation = store.generation
+            value = func(*args, **kwargs)
+            ids = bound.arguments.get(vehicles) if vehicles else None
+            if ids is None:
+                tags = (ALL,)
+            elif isinstance(ids, (list, tuple, set, frozenset)):
+                tags = tuple(ids)
+            else:
+                tags = (ids,)
+            store.set(key, value, tags, generation)
+            return value
+
+        return wrapper
+    return decorator
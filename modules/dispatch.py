@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from database import db
 
@@ -54,6 +54,9 @@ class Route(db.Model):
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_vehicle_id_start_time', 'vehicle_id', 'start_time'),
+    )
 
     id = Column(Integer, primary_key=True)
     driver_id = Column(Integer, ForeignKey('drivers.id'), nullable=False)
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, delete, insert, or_
+from database import db
+from config import Config
+from modules.dispatch import Task
+from modules.monitoring import GPSData, DrivingStyle
+from modules.telemetry import G, KMH_TO_MS, seconds, to_datetime, fetch_arrays
+
+MIN_CORNERING_SPEED = 5  # км/ч: на меньшей скорости курс GPS шумит, повороты не учитываются
+
+
+def load_day(start, end):
+    """
+    Точки GPS за [start, end) одним запросом, по ТС и времени: словарь массивов vehicle_id, ts (секунды),
+    speed, heading (NaN, если не известны). Строки читаются порциями и сразу переводятся в массивы.
+    """
+    query = select(GPSData.vehicle_id, GPSData.timestamp, GPSData.speed, GPSData.heading) \
+        .where(GPSData.timestamp >= start, GPSData.timestamp < end) \
+        .order_by(GPSData.vehicle_id, GPSData.timestamp)
+    data = fetch_arrays(query, ('vehicle_id', 'ts', 'speed', 'heading'))
+    data['ts'] = data['ts'] / 1e6
+    return data
+
+
+def assign_tasks(vehicle_ids, ts, start, end):
+    """
+    Задача для каждой точки (номер в списке задач или -1) и список задач (vehicle_id, driver_id, id).
+    Точке назначается последняя начавшаяся до неё задача того же ТС, если та ещё не закончилась.
+    """
+    tasks = db.session.execute(
+        select(Task.vehicle_id, Task.start_time, Task.end_time, Task.driver_id, Task.id)
+        .where(Task.start_time < end, or_(Task.end_time.is_(None), Task.end_time >= start))
+        .order_by(Task.vehicle_id, Task.start_time)).all()
+    assigned = np.full(len(ts), -1, dtype=np.int64)
+    if not tasks or not len(ts):
+        return assigned, []
+    task_vehicles = np.array([t.vehicle_id for t in tasks], dtype=np.int64)
+    task_starts = seconds([t.start_time for t in tasks])
+    task_ends = seconds([t.end_time or datetime.max for t in tasks])
+    # поиск по составному ключу (ТС, время): время отсчитывается от начала суток, ключ ТС его перекрывает
+    origin = seconds([start])[0]
+    span = (end - start).total_seconds() + 2
+    task_keys = task_vehicles * span + np.clip(task_starts - origin, -1, span - 1)
+    point_keys = vehicle_ids * span + (ts - origin)
+    index = np.searchsorted(task_keys, point_keys, side='right') - 1
+    found = index >= 0
+    found[found] = (task_vehicles[index[found]] == vehicle_ids[found]) & (task_ends[index[found]] >= ts[found])
+    assigned[found] = index[found]
+    return assigned, [(t.vehicle_id, t.driver_id, t.id) for t in tasks]
+
+
+def group_percentile(groups, values, count, q):
+    """q-й процентиль values по группам 0..count-1 (линейная интерполяция, как np.percentile); NaN для пустых групп"""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    result = np.full(count, np.nan)
+    has = sizes > 0
+    position = (sizes[has] - 1) * q / 100
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    fraction = position - low
+    result[has] = values[starts[has] + low] * (1 - fraction) + values[starts[has] + high] * fraction
+    return result, sizes
+
+
+def _score(metric, limit):
+    """0–100 баллов: 100 — без ускорений, 0 — процентиль на пороге резкого манёвра и выше"""
+    return np.round(100 * np.clip(1 - metric / limit, 0, 1), 1)
+
+
+def score_trips(data, assigned):
+    """
+    Оценки по поездкам — идущим подряд точкам ТС, относящимся к одной задаче.
+    Продольное ускорение — по разности скоростей соседних точек, боковое — скорость, умноженная
+    на угловую скорость изменения курса. Показатель поездки — DRIVING_STYLE_PERCENTILE-й процентиль
+    ускорения (разгона, торможения, бокового) по всем парам точек, так что единичный выброс GPS
+    оценку не портит, а частые резкие манёвры — портят.
+    Возвращает словарь массивов по поездкам: task (номер задачи), start (секунды), intervals и оценки.
+    """
+    keep = assigned >= 0
+    ts, speed, heading, assigned = data['ts'][keep], data['speed'][keep], data['heading'][keep], assigned[keep]
+    empty = np.empty(0)
+    if not len(ts):
+        return {'task': empty.astype(np.int64), 'start': empty, 'intervals': empty.astype(np.int64),
+                'acceleration': empty, 'braking': empty, 'cornering': empty, 'overall': empty}
+    trip_start = np.r_[True, assigned[1:] != assigned[:-1]]
+    trips = np.cumsum(trip_start) - 1
+    count = int(trips[-1]) + 1
+
+    dt = np.diff(ts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = ~trip_start[1:] & (dt > 0) & (dt <= Config.DRIVING_STYLE_MAX_GAP_S) & ~np.isnan(speed[1:]) & ~np.isnan(speed[:-1])
+        accel = np.diff(speed) * KMH_TO_MS / dt
+        turn = (np.diff(heading) + 180) % 360 - 180
+        mean_speed = (speed[1:] + speed[:-1]) / 2
+        lateral = np.abs(np.radians(turn) / dt) * mean_speed * KMH_TO_MS
+    # на стоянке и при неизвестном курсе поворот не учитывается
+    lateral[~(mean_speed >= MIN_CORNERING_SPEED) | np.isnan(lateral)] = 0
+    groups = trips[1:][valid]
+    accel, lateral = accel[valid], lateral[valid]
+
+    q = Config.DRIVING_STYLE_PERCENTILE
+    speeding_up, intervals = group_percentile(groups, np.maximum(accel, 0), count, q)
+    slowing_down, _ = group_percentile(groups, np.maximum(-accel, 0), count, q)
+    cornering, _ = group_percentile(groups, lateral, count, q)
+    scores = {
+        'acceleration': _score(speeding_up, Config.HARD_ACCELERATION_THRESHOLD * G),
+        'braking': _score(slowing_down, Config.HARD_BRAKING_THRESHOLD * G),
+        'cornering': _score(cornering, Config.HARD_CORNERING_THRESHOLD * G),
+    }
+    scores['overall'] = np.round((scores['acceleration'] + scores['braking'] + scores['cornering']) / 3, 1)
+    first = np.flatnonzero(trip_start)
+    return {'task': assigned[first], 'start': ts[first], 'intervals': intervals, **scores}
+
+
+def rate_day(day):
+    """
+    Оценка стиля вождения за сутки day по всем ТС: одна запись DrivingStyle на поездку
+    (время записи — первая точка поездки). Прежние записи за эти сутки заменяются,
+    поэтому задание можно перезапускать. Точки вне задач водителей не оцениваются.
+    Возвращает число записанных оценок.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    data = load_day(start, end)
+    assigned, tasks = assign_tasks(data['vehicle_id'], data['ts'], start, end)
+    trips = score_trips(data, assigned)
+    rows = []
+    enough = trips['intervals'] >= Config.DRIVING_STYLE_MIN_INTERVALS
+    for task, first, acceleration, braking, cornering, overall in zip(
+            trips['task'][enough].tolist(), trips['start'][enough].tolist(), trips['acceleration'][enough].tolist(),
+            trips['braking'][enough].tolist(), trips['cornering'][enough].tolist(), trips['overall'][enough].tolist()):
+        vehicle_id, driver_id, _ = tasks[task]
+        rows.append({'vehicle_id': vehicle_id, 'driver_id': driver_id,
+                     'timestamp': to_datetime(round(first * 1e6)),
+                     'acceleration_score': acceleration, 'braking_score': braking,
+                     'cornering_score': cornering, 'overall_score': overall})
+    db.session.execute(delete(DrivingStyle).where(DrivingStyle.timestamp >= start, DrivingStyle.timestamp < end))
+    if rows:
+        db.session.execute(insert(DrivingStyle), rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,72 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Расстояние по дуге большого круга в метрах (работает и с массивами numpy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def project_m(lat, lon):
+    """
+    Координаты в метрах на плоскости, касательной в средней широте (равнопромежуточная проекция).
+    Для допусков упрощения в метры-десятки метров погрешности проекции на треках в сотни километров хватает.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    scale = np.cos(np.radians(lat.mean())) if len(lat) else 1.0
+    return np.radians(lon) * EARTH_RADIUS_M * scale, np.radians(lat) * EARTH_RADIUS_M
+
+
+def _segment_distances(x, y, first, last):
+    """Расстояния от точек first+1..last-1 до отрезка first-last"""
+    px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+    dx, dy = x[last] - x[first], y[last] - y[first]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return np.hypot(px, py)
+    t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0)
+    return np.hypot(px - t * dx, py - t * dy)
+
+
+def simplify_mask(lat, lon, tolerance_m):
+    """
+    Упрощение ломаной алгоритмом Дугласа — Пекера: маска оставляемых точек.
+    Каждая отброшенная точка лежит не дальше tolerance_m метров от упрощённой линии;
+    первая и последняя точки остаются всегда. Маской удобно прореживать сопутствующие
+    массивы (время, скорость) вместе с координатами.
+    """
+    n = len(lat)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if n < 3 or tolerance_m is None or tolerance_m <= 0:
+        keep[:] = True
+        return keep
+    x, y = project_m(lat, lon)
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(x, y, first, last)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance_m:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify(points, tolerance_m):
+    """Упрощённая ломаная: список (lat, lon) из исходных точек с погрешностью не более tolerance_m метров"""
+    if len(points) < 3:
+        return list(points)
+    coords = np.asarray(points, dtype=np.float64)
+    keep = simplify_mask(coords[:, 0], coords[:, 1], tolerance_m)
+    return [p for p, k in zip(points, keep.tolist()) if k]
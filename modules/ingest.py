@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import insert
+from database import db
+from config import Config
+from modules.vehicle_management import Vehicle
+from modules.partitioning import ensure_partitions_for_rows
+from modules.versioning import table_version
+from modules.positions import position_store, SOURCES
+from modules.violations import detect_violations, save_violations
+
+
+def _coerce(column, value):
+    typ = column.type.python_type
+    if typ is datetime:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value)
+        return datetime.fromisoformat(value)
+    if typ in (int, float) and isinstance(value, bool):
+        raise ValueError('ожидалось число')
+    return typ(value)
+
+
+def validate_point(model, item):
+    """Проверка и приведение типов одной точки телеметрии; ValueError с описанием ошибки"""
+    if not isinstance(item, dict):
+        raise ValueError('ожидался объект')
+    columns = {c.key: c for c in model.__table__.columns if c.key != 'id'}
+    unknown = [k for k in item if k not in columns]
+    if unknown:
+        raise ValueError(f"неизвестные поля: {', '.join(unknown)}")
+    row = {}
+    for key, column in columns.items():
+        value = item.get(key)
+        if value is None:
+            if not column.nullable and column.default is None:
+                raise ValueError(f'не задано поле {key}')
+            continue
+        try:
+            row[key] = _coerce(column, value)
+        except (TypeError, ValueError, OverflowError, OSError):
+            # OverflowError/OSError — время в секундах вне диапазона datetime (например, 1e20)
+            raise ValueError(f'некорректное значение поля {key}: {value!r}')
+    if not -90 <= row.get('latitude', 0) <= 90 or not -180 <= row.get('longitude', 0) <= 180:
+        raise ValueError('координаты вне допустимого диапазона')
+    return row
+
+
+def ingest_points(model, items):
+    """
+    Пакетная запись точек телеметрии (TrackingData, GPSData) одной транзакцией.
+    В той же транзакции записываются выявленные в пакете нарушения (modules/violations).
+    items: список словарей с полями модели
+    Возвращает (inserted, errors), где errors — список {'index', 'error'} для отклонённых точек.
+    """
+    rows, indexes, errors = [], [], []
+    for i, item in enumerate(items):
+        try:
+            rows.append(validate_point(model, item))
+            indexes.append(i)
+        except ValueError as e:
+            errors.append({'index': i, 'error': str(e)})
+
+    vehicle_ids = {r['vehicle_id'] for r in rows if 'vehicle_id' in r}
+    known = {vid for (vid,) in db.session.query(Vehicle.id).filter(Vehicle.id.in_(vehicle_ids))} if vehicle_ids else set()
+    valid = []
+    for i, row in zip(indexes, rows):
+        if row.get('vehicle_id') is not None and row['vehicle_id'] not in known:
+            errors.append({'index': i, 'error': f"неизвестное ТС {row['vehicle_id']}"})
+        else:
+            valid.append(row)
+    errors.sort(key=lambda e: e['index'])
+
+    if valid:
+        table = model.__tablename__
+        connection = db.session.connection()
+        ensure_partitions_for_rows(connection, table, valid)
+        save_violations(detect_violations(table, valid))
+        # executemany в SQLAlchemy 2 собирает многострочные INSERT ... VALUES пачками; первая пачка
+        # блокирует строку версии таблицы до commit, поэтому вставка телеметрии — последний шаг транзакции
+        chunks = range(0, len(valid), Config.INGEST_CHUNK_SIZE)
+        for start in chunks:
+            db.session.execute(insert(model), valid[start:start + Config.INGEST_CHUNK_SIZE])
+        after = table_version(connection, table) if table in SOURCES else None
+        db.session.commit()
+        if table in SOURCES:
+            position_store.apply_write(table, after, len(chunks), valid)
+    return len(valid), errors
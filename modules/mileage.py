@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import Column, Integer, Float, Date, DateTime, select, delete, insert, tuple_
+from database import db
+from config import Config
+from modules.geometry import haversine_m
+from modules.monitoring import GPSData
+from modules.telemetry import EPOCH, micros, to_datetime, fetch_arrays, new_points, replace_progress
+from modules.cache import analytics_cache
+
+DAY_US = 86400 * 10**6
+
+
+class VehicleDailyMileage(db.Model):
+    """Суточный пробег ТС по точкам GPS (сумма расстояний между соседними точками), пополняется заданием mileage"""
+    __tablename__ = 'vehicle_daily_mileage'
+
+    vehicle_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    distance = Column(Float, nullable=False, default=0)  # км
+    points = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<VehicleDailyMileage {self.day} for vehicle {self.vehicle_id}>'
+
+
+class MileageProgress(db.Model):
+    """Последняя учтённая точка GPS ТС: от неё считается расстояние до первой новой точки"""
+    __tablename__ = 'mileage_progress'
+
+    vehicle_id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f'<MileageProgress {self.timestamp} for vehicle {self.vehicle_id}>'
+
+
+def load_points(until, since=None):
+    """
+    Новые точки GPS одним запросом, по ТС и времени: для ТС с записью MileageProgress — позже её точки,
+    для остальных — с since (или все); каждое ТС читается по своей границе (telemetry.new_points).
+    Строки читаются порциями прямо в массивы.
+    """
+    # точки не старше микросекунды, как и само время в базе: «позже» равносильно «с момента + 1 мкс»
+    query = new_points((GPSData.vehicle_id, GPSData.timestamp, GPSData.latitude, GPSData.longitude, GPSData.speed),
+                       MileageProgress.vehicle_id, MileageProgress.timestamp + timedelta(microseconds=1), since, until)
+    return fetch_arrays(query, ('vehicle_id', 'micros', 'latitude', 'longitude', 'speed'))
+
+
+def daily_mileage(data, previous):
+    """
+    Пробег по суткам из точек load_points (отсортированы по ТС и времени).
+    previous — {vehicle_id: (микросекунды, широта, долгота)} последней учтённой точки: с неё начинается первый шаг ТС.
+    Шаг между соседними точками — расстояние по дуге большого круга (формула гаверсинуса; на шагах
+    в сотни метров расхождение с эллипсоидом Винсенти — доли процента). Не учитываются шаги со скоростью
+    выше MILEAGE_MAX_SPEED_KMH (скачки GPS) и шаги на стоянке (обе точки сообщают скорость ниже
+    TRIP_MOVING_SPEED_KMH), чтобы дрожание координат не набегало в пробег. Шаг относится к суткам его конца.
+    Возвращает ({(vehicle_id, day): (км, точек)}, {vehicle_id: последняя точка}).
+    """
+    vid, micros, lat, lon, speed = data['vehicle_id'], data['micros'], data['latitude'], data['longitude'], data['speed']
+    if not len(vid):
+        return {}, {}
+    first = np.r_[True, vid[1:] != vid[:-1]]
+    last = np.r_[vid[1:] != vid[:-1], True]
+    prev_micros = np.r_[0, micros[:-1]]
+    prev_lat, prev_lon, prev_speed = np.r_[np.nan, lat[:-1]], np.r_[np.nan, lon[:-1]], np.r_[np.nan, speed[:-1]]
+    has_prev = ~first
+    for i in np.flatnonzero(first).tolist():
+        point = previous.get(int(vid[i]))
+        if point is not None:
+            prev_micros[i], prev_lat[i], prev_lon[i] = point
+            prev_speed[i] = np.nan
+            has_prev[i] = True
+
+    dt = (micros - prev_micros) / 1e6
+    step = np.where(has_prev, haversine_m(prev_lat, prev_lon, lat, lon), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jump = step / dt * 3.6 > Config.MILEAGE_MAX_SPEED_KMH
+        parked = (speed < Config.TRIP_MOVING_SPEED_KMH) & (prev_speed < Config.TRIP_MOVING_SPEED_KMH)
+    counted = has_prev & (dt > 0) & ~jump & ~parked
+
+    day = micros // DAY_US
+    starts = np.flatnonzero(first | np.r_[True, day[1:] != day[:-1]])
+    distance = np.add.reduceat(np.where(counted, step, 0.0), starts) / 1000
+    points = np.diff(np.r_[starts, len(vid)])
+    days = [(EPOCH + timedelta(days=int(d))).date() for d in day[starts].tolist()]
+    mileage = {(v, d): (km, n) for v, d, km, n in zip(vid[starts].tolist(), days, distance.tolist(), points.tolist())}
+    ends = np.flatnonzero(last)
+    latest = {int(vid[i]): (int(micros[i]), float(lat[i]), float(lon[i])) for i in ends.tolist()}
+    return mileage, latest
+
+
+def update_mileage(since=None, until=None):
+    """
+    Пополнение суточного пробега новыми точками GPS и сдвиг mileage_progress, в одной транзакции.
+    Поздно пришедшие точки старше последней учтённой не учитываются. Возвращает число обновлённых суток ТС.
+    """
+    until = until or datetime.now()
+    previous = {vid: (int(micros([ts])[0]), lat, lon) for vid, ts, lat, lon in db.session.execute(
+        select(MileageProgress.vehicle_id, MileageProgress.timestamp, MileageProgress.latitude, MileageProgress.longitude))}
+    mileage, latest = daily_mileage(load_points(until, since), previous)
+    if not mileage:
+        return 0
+    keys = list(mileage)
+    existing = db.session.execute(select(VehicleDailyMileage.vehicle_id, VehicleDailyMileage.day,
+                                         VehicleDailyMileage.distance, VehicleDailyMileage.points)
+                                  .where(tuple_(VehicleDailyMileage.vehicle_id, VehicleDailyMileage.day).in_(keys)))
+    for vid, day, distance, points in existing:
+        km, n = mileage[(vid, day)]
+        mileage[(vid, day)] = (km + distance, n + points)
+    db.session.execute(delete(VehicleDailyMileage).where(
+        tuple_(VehicleDailyMileage.vehicle_id, VehicleDailyMileage.day).in_(keys)))
+    db.session.execute(insert(VehicleDailyMileage), [
+        {'vehicle_id': vid, 'day': day, 'distance': round(km, 3), 'points': n} for (vid, day), (km, n) in mileage.items()])
+    replace_progress(MileageProgress, [
+        {'vehicle_id': vid, 'timestamp': to_datetime(ts), 'latitude': lat, 'longitude': lon}
+        for vid, (ts, lat, lon) in latest.items()])
+    db.session.commit()
+    # запись мимо flush не видна хукам сброса кэша аналитики (пробег по GPS входит в расход и стоимость)
+    analytics_cache.invalidate(latest)
+    return len(mileage)
@@ -1,6 +1,8 @@
 import numpy as np
 from datetime import datetime
 
+DAY_US = 86_400_000_000
+
 def predict_failure_probability(maintenance_dates, current_date=None, horizon_days=30):
     """
     Оценивает вероятность поломки в течение horizon_days на основе истории ТО.
@@ -10,15 +12,40 @@ def predict_failure_probability(maintenance_dates, current_date=None, horizon_da
     """
     if len(maintenance_dates) < 2:
         return None
-    maintenance_dates = sorted(maintenance_dates)
-    intervals = [(maintenance_dates[i] - maintenance_dates[i-1]).days for i in range(1, len(maintenance_dates))]
-    avg_interval = np.mean(intervals)
-    if avg_interval == 0:
-        return None
-    lambda_ = 1 / avg_interval
+    probs = predict_failure_probability_batch([0] * len(maintenance_dates), maintenance_dates, current_date, horizon_days)
+    return probs.get(0)
+
+
+def predict_failure_probability_batch(vehicle_ids, maintenance_dates, current_date=None, horizon_days=30):
+    """
+    Оценка вероятности поломки сразу для многих ТС, без цикла по ТС.
+    vehicle_ids, maintenance_dates: параллельные последовательности (ТС и дата ТО для каждой записи)
+    current_date: дата, на которую делается прогноз (по умолчанию сейчас)
+    horizon_days: горизонт прогноза в днях
+    Возвращает {vehicle_id: вероятность}; ТС с менее чем двумя ТО или нулевым средним интервалом не попадают в результат.
+    """
+    vids = np.asarray(vehicle_ids, dtype=np.int64)
+    if vids.size == 0:
+        return {}
+    # Микросекунды с эпохи: целые дни считаются так же, как timedelta.days (с округлением вниз)
+    stamps = np.asarray(maintenance_dates, dtype='datetime64[us]').astype(np.int64)
+    order = np.lexsort((stamps, vids))
+    vids, stamps = vids[order], stamps[order]
+    groups, starts, counts = np.unique(vids, return_index=True, return_counts=True)
+
+    intervals = np.diff(stamps) // DAY_US
+    same_vehicle = vids[1:] == vids[:-1]
+    group_of_interval = np.searchsorted(groups, vids[1:][same_vehicle])
+    interval_sum = np.bincount(group_of_interval, weights=intervals[same_vehicle], minlength=groups.size)
+    interval_count = counts - 1
+    avg_interval = interval_sum / np.maximum(interval_count, 1)
+    valid = (interval_count > 0) & (avg_interval != 0)
+
     if current_date is None:
         current_date = datetime.now()
-    days_since_last = (current_date - maintenance_dates[-1]).days
+    now = np.datetime64(current_date, 'us').astype(np.int64)
+    days_since_last = (now - stamps[starts + counts - 1]) // DAY_US
     # Вероятность отказа в течение horizon_days после последнего ТО
-    prob = 1 - np.exp(-lambda_ * (days_since_last + horizon_days))
-    return float(prob) 
\ No newline at end of file
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prob = 1 - np.exp(-(days_since_last[valid] + horizon_days) / avg_interval[valid])
+    return dict(zip(groups[valid].tolist(), prob.tolist())) 
\ No newline at end of file
@@ -1,11 +1,19 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Index, PrimaryKeyConstraint, event
 from database import db
+from modules.partitioning import create_default_partitions
 
 
 class GPSData(db.Model):
     __tablename__ = 'gps_data'
-
-    id = Column(Integer, primary_key=True)
+    # Секционирование по месяцам (modules/partitioning.py): ключ секционирования входит в первичный ключ
+    __table_args__ = (
+        PrimaryKeyConstraint('id', 'timestamp'),
+        Index('ix_gps_data_vehicle_id_timestamp', 'vehicle_id', 'timestamp'),
+        {'postgresql_partition_by': 'RANGE ("timestamp")'},
+    )
+
+    id = Column(Integer, autoincrement=True)
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
     timestamp = Column(DateTime, nullable=False)
     latitude = Column(Float, nullable=False)
@@ -16,9 +24,14 @@ class GPSData(db.Model):
     def __repr__(self):
         return f'<GPSData {self.timestamp} for vehicle {self.vehicle_id}>'
 
+    __mapper_args__ = {'primary_key': [id]}
+
 
 class FuelConsumption(db.Model):
     __tablename__ = 'fuel_consumption'
+    __table_args__ = (
+        Index('ix_fuel_consumption_vehicle_id_timestamp', 'vehicle_id', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True)
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
@@ -32,6 +45,10 @@ class FuelConsumption(db.Model):
 
 class DrivingStyle(db.Model):
     __tablename__ = 'driving_style'
+    __table_args__ = (
+        Index('ix_driving_style_vehicle_id_timestamp', 'vehicle_id', 'timestamp'),
+        Index('ix_driving_style_driver_id_timestamp', 'driver_id', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True)
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
@@ -48,10 +65,13 @@ class DrivingStyle(db.Model):
 
 class Violation(db.Model):
     __tablename__ = 'violations'
+    __table_args__ = (
+        Index('ix_violations_vehicle_id_timestamp', 'vehicle_id', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True)
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
-    driver_id = Column(Integer, ForeignKey('drivers.id'), nullable=False)
+    driver_id = Column(Integer, ForeignKey('drivers.id'))  # None, если водителя не удалось определить
     timestamp = Column(DateTime, nullable=False)
     violation_type = Column(String(50), nullable=False)
     details = Column(JSON)
@@ -63,13 +83,26 @@ class Violation(db.Model):
 
 class TrackingData(db.Model):
     __tablename__ = 'tracking_data'
-
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        PrimaryKeyConstraint('id', 'timestamp'),
+        Index('ix_tracking_data_vehicle_id_timestamp', 'vehicle_id', 'timestamp'),
+        Index('ix_tracking_data_vehicle_id_route_id_timestamp', 'vehicle_id', 'route_id', 'timestamp'),
+        Index('ix_tracking_data_timestamp_id', 'timestamp', 'id'),
+        {'postgresql_partition_by': 'RANGE ("timestamp")'},
+    )
+
+    id = Column(Integer, autoincrement=True)
     vehicle_id = Column(Integer)
     route_id = Column(Integer)
     latitude = Column(Float)
     longitude = Column(Float)
     speed = Column(Float)
     fuel_level = Column(Float)
-    timestamp = Column(DateTime)
-    additional_data = Column(String) 
\ No newline at end of file
+    timestamp = Column(DateTime, nullable=False, default=datetime.now)
+    additional_data = Column(String)
+
+    __mapper_args__ = {'primary_key': [id]}
+
+
+event.listen(GPSData.__table__, 'after_create', create_default_partitions)
+event.listen(TrackingData.__table__, 'after_create', create_default_partitions) 
\ No newline at end of file
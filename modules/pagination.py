@@ -0,0 +1,117 @@
+import base64
+import json
+from datetime import datetime, date
+from sqlalchemy import and_, or_, tuple_
+
+
+def _column(attr):
+    return getattr(attr, 'expression', attr)
+
+
+def _is_nullable(attr):
+    return getattr(_column(attr), 'nullable', True)
+
+
+def encode_cursor(values):
+    """Курсор keyset-пагинации: значения ключей последней строки страницы"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (datetime, date)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Разбор курсора в значения ключей с приведением к типам столбцов; ValueError при ошибке"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError(f'bad cursor: {e}')
+    if not isinstance(raw, list) or len(raw) != len(columns):
+        raise ValueError('bad cursor')
+    values = []
+    for value, attr in zip(raw, columns):
+        if value is None:
+            values.append(None)
+            continue
+        typ = _column(attr).type.python_type
+        if typ is datetime:
+            values.append(datetime.fromisoformat(value))
+        elif typ is date:
+            values.append(date.fromisoformat(value))
+        else:
+            values.append(typ(value))
+    return values
+
+
+def indexed_columns(model):
+    """Столбцы, по которым сортировка и фильтр идут по индексу: первичный ключ, уникальные и первые столбцы индексов"""
+    table = model.__table__
+    keys = [c.key for c in table.primary_key.columns]
+    keys += [c.key for c in table.columns if c.unique or c.index]
+    keys += [next(iter(ix.columns)).key for ix in table.indexes if ix.columns]
+    return list(dict.fromkeys(keys))
+
+
+def sortable_columns(model, pk='id'):
+    """
+    Столбцы, по которым keyset-страница читается диапазоном индекса без сортировки: первичный ключ pk
+    и столбцы с составным индексом, начинающимся с (столбец, pk), — порядок страницы (столбец, pk)
+    """
+    keys = [pk]
+    for ix in model.__table__.indexes:
+        columns = [c.key for c in ix.columns]
+        if len(columns) >= 2 and columns[1] == pk:
+            keys.append(columns[0])
+    return list(dict.fromkeys(keys))
+
+
+def column_filter(attr, raw):
+    """Условие фильтра по значению из строки: префикс для текстовых столбцов, равенство для остальных; ValueError"""
+    typ = _column(attr).type.python_type
+    if typ is str:
+        return attr.startswith(raw, autoescape=True)
+    if typ is datetime:
+        return attr == datetime.fromisoformat(raw)
+    if typ is date:
+        return attr == date.fromisoformat(raw)
+    return attr == typ(raw)
+
+
+def order_clauses(sort_col, pk_col, descending=False):
+    """Порядок строк для keyset-пагинации: (sort_col, pk_col), NULL в конце"""
+    clauses = []
+    if sort_col is not None:
+        clause = sort_col.desc() if descending else sort_col.asc()
+        clauses.append(clause.nulls_last() if _is_nullable(sort_col) else clause)
+    clauses.append(pk_col.desc() if descending else pk_col.asc())
+    return clauses
+
+
+def keyset_condition(sort_col, pk_col, values, descending=False):
+    """Условие «строго после курсора» в порядке order_clauses"""
+    after = (lambda a, b: a < b) if descending else (lambda a, b: a > b)
+    if sort_col is None:
+        return after(pk_col, values[0])
+    value, pk = values
+    if not _is_nullable(sort_col):
+        # Сравнение кортежей использует составной индекс (sort_col, pk_col) как диапазон
+        return after(tuple_(sort_col, pk_col), tuple_(value, pk))
+    if value is None:
+        return and_(sort_col.is_(None), after(pk_col, pk))
+    return or_(after(sort_col, value), and_(sort_col == value, after(pk_col, pk)), sort_col.is_(None))
+
+
+def page_query(query, sort_col, pk_col, after=None, limit=100, descending=False):
+    """
+    Одна страница keyset-пагинации.
+    query: запрос, в выборке которого есть sort_col (если задан) и pk_col
+    after: курсор из предыдущей страницы
+    Возвращает (rows, next_cursor); next_cursor равен None на последней странице.
+    """
+    keys = [c for c in (sort_col, pk_col) if c is not None]
+    if after:
+        query = query.filter(keyset_condition(sort_col, pk_col, decode_cursor(after, keys), descending))
+    rows = query.order_by(*order_clauses(sort_col, pk_col, descending)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    return rows, encode_cursor([last[c.key] for c in keys])
@@ -0,0 +1,184 @@
+import re
+from datetime import datetime, date
+from sqlalchemy import text, event
+from sqlalchemy.engine import Engine
+from config import Config
+
+# Таблицы, секционированные по месяцам: имя таблицы -> столбец-ключ секционирования
+PARTITIONED_TABLES = {
+    'gps_data': 'timestamp',
+    'tracking_data': 'timestamp',
+}
+
+_PARTITION_RE = re.compile(r'^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$')
+
+# Месяцы, для которых секции уже точно есть (кэш процесса, чтобы не проверять на каждой вставке).
+# Пополняется только после фиксации транзакции, в которой секцию увидели или создали
+_known_partitions = set()
+
+
+def _remember(connection, table, month):
+    connection.info.setdefault('partitions_seen', set()).add((table, month))
+
+
+@event.listens_for(Engine, 'commit')
+def _publish_partitions(connection):
+    _known_partitions.update(connection.info.pop('partitions_seen', ()))
+
+
+@event.listens_for(Engine, 'rollback')
+def _forget_partitions(connection):
+    connection.info.pop('partitions_seen', None)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned(connection, table):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {'t': table}).scalar() is True
+
+
+def create_partition(connection, table, month):
+    """
+    Создание месячной секции table за month.
+    Строки этого месяца, уже попавшие в секцию по умолчанию, переносятся в новую секцию.
+    Параллельные транзакции создают одну и ту же секцию по очереди (рекомендательная блокировка
+    до конца транзакции): вторая после фиксации первой видит готовую секцию.
+    """
+    name = partition_name(table, month)
+    connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:n))'), {'n': name})
+    if connection.execute(text('SELECT to_regclass(:n)'), {'n': name}).scalar() is not None:
+        _remember(connection, table, month)
+        return False
+    column = PARTITIONED_TABLES[table]
+    start, end = month, add_months(month, 1)
+    bounds = {'start': start, 'end': end}
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    if connection.execute(text('SELECT to_regclass(:n)'), {'n': f'{table}_default'}).scalar() is not None:
+        connection.execute(text(
+            f'WITH moved AS (DELETE FROM {table}_default WHERE "{column}" >= :start AND "{column}" < :end RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved'), bounds)
+    connection.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+    _remember(connection, table, month)
+    return True
+
+
+def ensure_partitions(connection, tables=None, months=None):
+    """
+    Создание недостающих месячных секций: на текущий месяц и PARTITION_MONTHS_AHEAD вперёд,
+    на переданные months, а также на месяцы строк, осевших в секции по умолчанию.
+    Транзакции обслуживают секции таблицы по очереди (рекомендательная блокировка по имени таблицы
+    до конца транзакции, до чтения секции по умолчанию): иначе одна, прочитав секцию по умолчанию,
+    ждёт блокировку секции, а другая, держа её, ждёт ATTACH PARTITION — взаимоблокировка.
+    """
+    if connection.dialect.name != 'postgresql':
+        return []
+    created = []
+    current = month_start(datetime.now())
+    for table in tables or PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:n))'), {'n': table})
+        wanted = {add_months(current, i) for i in range(Config.PARTITION_MONTHS_AHEAD + 1)}
+        wanted |= {month_start(m) for m in months or ()}
+        column = PARTITIONED_TABLES[table]
+        if connection.execute(text('SELECT to_regclass(:n)'), {'n': f'{table}_default'}).scalar() is not None:
+            wanted |= {month_start(m) for (m,) in connection.execute(text(
+                f'SELECT DISTINCT date_trunc(\'month\', "{column}") FROM {table}_default'))}
+        for month in sorted(wanted):
+            if create_partition(connection, table, month):
+                created.append(partition_name(table, month))
+    return created
+
+
+def ensure_partitions_for_rows(connection, table, rows):
+    """Секции под месяцы пакета вставляемых строк (вызывается на пути загрузки телеметрии)"""
+    if table not in PARTITIONED_TABLES or connection.dialect.name != 'postgresql':
+        return
+    column = PARTITIONED_TABLES[table]
+    months = {month_start(r[column]) for r in rows if r.get(column) is not None}
+    if any((table, m) not in _known_partitions for m in months):
+        ensure_partitions(connection, [table], months)
+
+
+def drop_expired_partitions(connection, keep_months=None):
+    """
+    Политика хранения: удаление целых секций старше keep_months месяцев (без построчного DELETE).
+    Возвращает список удалённых секций.
+    """
+    keep_months = Config.TELEMETRY_RETENTION_MONTHS if keep_months is None else keep_months
+    cutoff = add_months(month_start(datetime.now()), -keep_months)
+    dropped = []
+    for table, column in PARTITIONED_TABLES.items():
+        if not is_partitioned(connection, table):
+            continue
+        partitions = connection.execute(text(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(:t)'), {'t': table}).scalars().all()
+        for name in partitions:
+            m = _PARTITION_RE.match(name)
+            if not m or m.group('table') != table:
+                continue
+            month = date(int(m.group('year')), int(m.group('month')), 1)
+            if add_months(month, 1) <= cutoff:
+                connection.execute(text(f'ALTER TABLE {table} DETACH PARTITION {name}'))
+                connection.execute(text(f'DROP TABLE {name}'))
+                _known_partitions.discard((table, month))
+                dropped.append(name)
+        if f'{table}_default' in partitions:
+            connection.execute(text(f'DELETE FROM {table}_default WHERE "{column}" < :cutoff'), {'cutoff': cutoff})
+    return dropped
+
+
+def convert_to_partitioned(connection, table_obj):
+    """
+    Перевод существующей обычной таблицы в секционированную: данные копируются
+    в новую таблицу с месячными секциями, старая удаляется. Выполняется в одной транзакции.
+    """
+    table = table_obj.name
+    column = PARTITIONED_TABLES[table]
+    legacy = f'{table}_legacy'
+    connection.execute(text(f'ALTER TABLE {table} RENAME TO {legacy}'))
+    connection.execute(text(f'ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey'))
+    connection.execute(text(f'ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {legacy}_id_seq'))
+    for index in table_obj.indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    table_obj.create(bind=connection)
+
+    first, last = connection.execute(text(f'SELECT min("{column}"), max("{column}") FROM {legacy}')).one()
+    if first is not None:
+        month = month_start(first)
+        months = []
+        while month <= month_start(last):
+            months.append(month)
+            month = add_months(month, 1)
+        ensure_partitions(connection, [table], months)
+    columns = ', '.join(f'"{c.name}"' for c in table_obj.columns)
+    source = ', '.join(f'COALESCE("{c.name}", now())' if c.name == column else f'"{c.name}"' for c in table_obj.columns)
+    connection.execute(text(f'INSERT INTO {table} ({columns}) SELECT {source} FROM {legacy}'))
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"))
+    connection.execute(text(f'DROP TABLE {legacy}'))
+
+
+def create_default_partitions(target, connection, **kw):
+    """Секция по умолчанию и ближайшие месячные секции сразу после CREATE TABLE"""
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {target.name}_default PARTITION OF {target.name} DEFAULT'))
+    ensure_partitions(connection, [target.name])
+
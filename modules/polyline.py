@@ -0,0 +1,71 @@
+# Кодирование последовательностей координат в формате Google Encoded Polyline:
+# координаты округляются до целых, хранятся разности соседних точек в текстовом виде
+
+
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode(points, precision=5):
+    """[(lat, lon), ...] -> строка; точность — число знаков после запятой"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat, lon = round(lat * factor), round(lon * factor)
+        _encode_value(lat - prev_lat, out)
+        _encode_value(lon - prev_lon, out)
+        prev_lat, prev_lon = lat, lon
+    return ''.join(out)
+
+
+def _decode_deltas(text):
+    values = []
+    value = shift = 0
+    for ch in text:
+        chunk = ord(ch) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return values
+
+
+def encode_values(values, precision=0):
+    """Одномерный ряд чисел (время, скорость...) -> строка разностей в той же кодировке"""
+    factor = 10 ** precision
+    out = []
+    prev = 0
+    for value in values:
+        value = round(value * factor)
+        _encode_value(value - prev, out)
+        prev = value
+    return ''.join(out)
+
+
+def decode_values(text, precision=0):
+    """Строка -> список чисел (целых при precision=0)"""
+    values = []
+    current = 0
+    for delta in _decode_deltas(text):
+        current += delta
+        values.append(current / 10 ** precision if precision else current)
+    return values
+
+
+def decode(text, precision=5):
+    """Строка -> [(lat, lon), ...]"""
+    factor = 10 ** precision
+    values = _decode_deltas(text)
+    points = []
+    lat = lon = 0
+    for i in range(0, len(values) - 1, 2):
+        lat += values[i]
+        lon += values[i + 1]
+        points.append((lat / factor, lon / factor))
+    return points
@@ -0,0 +1,180 @@
+import threading
+import numpy as np
+from sqlalchemy import select, true
+from database import db
+from modules.vehicle_management import Vehicle
+from modules.monitoring import GPSData, TrackingData
+from modules.versioning import table_version
+from modules.telemetry import micros
+
+# Источники позиций и их столбцы; отсутствующие в таблице поля остаются прежними
+SOURCES = {
+    GPSData.__tablename__: (GPSData, ('latitude', 'longitude', 'speed', 'heading')),
+    TrackingData.__tablename__: (TrackingData, ('latitude', 'longitude', 'speed', 'fuel_level')),
+}
+VALUE_FIELDS = ('latitude', 'longitude', 'speed', 'heading', 'fuel_level')
+# Поля, которые передаёт только один источник: у каждого своё время, чтобы более свежая точка
+# другого источника их не отбрасывала
+SOURCE_FIELDS = ('heading', 'fuel_level')
+
+
+def _last_rows(ids, ts):
+    """Номера строк с последней по времени точкой каждого ТС"""
+    order = np.lexsort((ts, ids))
+    return order[np.r_[ids[order][1:] != ids[order][:-1], True]]
+
+
+class PositionStore:
+    """
+    Последние известные позиции ТС в массивах numpy, индекс массива — vehicle_id.
+    Обновляется при приёме телеметрии в этом процессе (ingest_points); записи других процессов
+    подхватывает sync() по версиям таблиц-источников. Неизвестные в точке скорость, курс и топливо
+    не затирают последние известные значения; курс и топливо (SOURCE_FIELDS) обновляются
+    по своему времени, независимо от более свежих координат из другого источника.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._allocate(0)
+        self.versions = None  # версии таблиц-источников, которым соответствует содержимое
+        self.revision = 0  # растёт при каждом изменении
+
+    def _allocate(self, size):
+        self.present = np.zeros(size, dtype=bool)
+        self.timestamp = np.zeros(size, dtype=np.int64)  # микросекунды эпохи, время как в базе
+        for name in VALUE_FIELDS:
+            setattr(self, name, np.full(size, np.nan))
+        self.field_timestamp = {name: np.full(size, np.iinfo(np.int64).min) for name in SOURCE_FIELDS}
+
+    def _grow(self, max_id):
+        size = len(self.present)
+        if max_id < size:
+            return
+        new_size = max(max_id + 1, 2 * size, 64)
+        for name in ('present', 'timestamp') + VALUE_FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(new_size, dtype=old.dtype) if name in ('present', 'timestamp') else np.full(new_size, np.nan)
+            new[:size] = old
+            setattr(self, name, new)
+        for name, old in self.field_timestamp.items():
+            new = np.full(new_size, np.iinfo(np.int64).min)
+            new[:size] = old
+            self.field_timestamp[name] = new
+
+    def update(self, vehicle_ids, timestamps, **values):
+        """
+        Пакетное обновление: vehicle_ids, timestamps (datetime) и ряды значений VALUE_FIELDS одинаковой длины.
+        Из пакета для каждого ТС берётся последняя точка; координаты и скорость применяются, только если
+        она новее известной позиции. Поле из SOURCE_FIELDS берётся из последней точки ТС, где оно известно,
+        и применяется, если та новее прежнего значения этого поля.
+        """
+        all_ids = np.asarray(vehicle_ids, dtype=np.int64)
+        if not len(all_ids):
+            return
+        all_ts = micros(timestamps)
+        last = _last_rows(all_ids, all_ts)
+        ids, ts = all_ids[last], all_ts[last]
+        with self._lock:
+            self._grow(int(ids.max()))
+            newer = ~self.present[ids] | (ts > self.timestamp[ids])
+            rows, ids, ts = last[newer], ids[newer], ts[newer]
+            self.present[ids] = True
+            self.timestamp[ids] = ts
+            for name, column in values.items():
+                column = np.asarray(column, dtype=np.float64)
+                if name in SOURCE_FIELDS:
+                    known = np.flatnonzero(~np.isnan(column))
+                    if not len(known):
+                        continue
+                    field_rows = known[_last_rows(all_ids[known], all_ts[known])]
+                    field_ids, field_ts = all_ids[field_rows], all_ts[field_rows]
+                    fresher = field_ts > self.field_timestamp[name][field_ids]
+                    field_ids = field_ids[fresher]
+                    getattr(self, name)[field_ids] = column[field_rows[fresher]]
+                    self.field_timestamp[name][field_ids] = field_ts[fresher]
+                    continue
+                column = column[rows]
+                known = ~np.isnan(column)
+                getattr(self, name)[ids[known]] = column[known]
+            self.revision += 1
+
+    def update_rows(self, rows):
+        """Обновление по строкам-словарям телеметрии (как в ingest_points); строки без координат пропускаются"""
+        rows = [r for r in rows if r.get('vehicle_id') is not None and r.get('latitude') is not None
+                and r.get('longitude') is not None and r.get('timestamp') is not None]
+        if not rows:
+            return
+        fields = [f for f in VALUE_FIELDS if any(f in r for r in rows)]
+        self.update([r['vehicle_id'] for r in rows], [r['timestamp'] for r in rows],
+                    **{f: [r.get(f) for r in rows] for f in fields})
+
+    def snapshot(self):
+        """Позиции всего парка: словарь массивов (копий) vehicle_id, timestamp (datetime64) и VALUE_FIELDS, и revision"""
+        with self._lock:
+            ids = np.flatnonzero(self.present)
+            data = {name: getattr(self, name)[ids] for name in VALUE_FIELDS}
+            data['vehicle_id'] = ids
+            data['timestamp'] = self.timestamp[ids].astype('datetime64[us]')
+            data['revision'] = self.revision
+        return data
+
+    @staticmethod
+    def records(snapshot):
+        """Снимок в виде списка словарей (NaN -> None, время -> datetime)"""
+        columns = {name: [None if v != v else v for v in snapshot[name].tolist()] for name in VALUE_FIELDS}
+        columns['vehicle_id'] = snapshot['vehicle_id'].tolist()
+        columns['timestamp'] = snapshot['timestamp'].tolist()
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def get(self, vehicle_id):
+        with self._lock:
+            if not 0 <= vehicle_id < len(self.present) or not self.present[vehicle_id]:
+                return None
+            position = {name: getattr(self, name)[vehicle_id].item() for name in VALUE_FIELDS}
+            position['timestamp'] = self.timestamp[vehicle_id].astype('datetime64[us]').item()
+        return {'vehicle_id': vehicle_id, **{k: (None if v != v else v) for k, v in position.items()}}
+
+    @staticmethod
+    def read_versions(connection):
+        return {table: table_version(connection, table) for table in SOURCES}
+
+    def rebuild(self):
+        """Загрузка из базы: последняя точка каждого ТС из каждого источника (переход по индексу через LATERAL)"""
+        connection = db.session.connection()
+        versions = self.read_versions(connection)
+        with self._lock:
+            self._allocate(0)
+            for model, fields in SOURCES.values():
+                last = select(model.timestamp, *[getattr(model, f) for f in fields]) \
+                    .where(model.vehicle_id == Vehicle.id, model.latitude.isnot(None), model.longitude.isnot(None)) \
+                    .order_by(model.timestamp.desc()).limit(1).lateral()
+                rows = db.session.query(Vehicle.id, *last.c).join(last, true()).all()
+                self.update_rows([{'vehicle_id': r[0], **dict(zip(('timestamp',) + fields, r[1:]))} for r in rows])
+            self.versions = versions
+            self.revision += 1
+
+    def sync(self):
+        """Перестройка, если в таблицы-источники писали мимо этого процесса (проверка версий — по строке на таблицу)"""
+        if self.versions is None or self.read_versions(db.session.connection()) != self.versions:
+            self.rebuild()
+            return True
+        return False
+
+    def apply_write(self, table, after, writes, rows):
+        """
+        После фиксации записи этого процесса: точки применяются к массивам. after — версия таблицы,
+        прочитанная в транзакции записи после её writes операторов: строку версии каждый оператор
+        блокирует до commit (versioning.bump_versions), поэтому до записи версия была after - writes.
+        Версия принимается, только если содержимое соответствовало ей и время есть у всех точек
+        (иначе его проставила база, и следующий sync() перестроит хранилище).
+        """
+        with self._lock:
+            self.update_rows(rows)
+            complete = all(r.get('timestamp') is not None for r in rows)
+            current = self.versions.get(table) if self.versions is not None else None
+            if complete and current is not None and current[0] == after[0] - writes:
+                self.versions[table] = after
+
+
+position_store = PositionStore()
@@ -0,0 +1,236 @@
+from datetime import date, datetime, timedelta
+from itertools import chain
+from sqlalchemy import Column, Integer, Float, Date, event, func, select, delete, insert, inspect, tuple_, and_, or_, values, column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import db
+from modules.vehicle_management import FuelRecord, MaintenanceRecord
+from modules.dispatch import Task, Route
+from modules.monitoring import FuelConsumption
+
+
+class VehicleDailyStats(db.Model):
+    """Суточные итоги по ТС, поддерживаемые инкрементально при изменении исходных записей"""
+    __tablename__ = 'vehicle_daily_stats'
+
+    vehicle_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    fuel_amount = Column(Float, nullable=False, default=0)
+    fuel_cost = Column(Float, nullable=False, default=0)
+    fuel_count = Column(Integer, nullable=False, default=0)
+    maintenance_cost = Column(Float, nullable=False, default=0)
+    maintenance_count = Column(Integer, nullable=False, default=0)
+    distance = Column(Float, nullable=False, default=0)
+    task_time = Column(Float, nullable=False, default=0)
+    task_count = Column(Integer, nullable=False, default=0)
+    consumption_sum = Column(Float, nullable=False, default=0)
+    consumption_count = Column(Integer, nullable=False, default=0)
+
+    @property
+    def average_consumption(self):
+        return self.consumption_sum / self.consumption_count if self.consumption_count else 0
+
+    def __repr__(self):
+        return f'<VehicleDailyStats {self.day} for vehicle {self.vehicle_id}>'
+
+
+# Источники итогов: модель -> (столбец ТС, столбец времени)
+ROLLUP_SOURCES = {
+    FuelRecord: ('vehicle_id', 'date'),
+    MaintenanceRecord: ('vehicle_id', 'date'),
+    Task: ('vehicle_id', 'start_time'),
+    FuelConsumption: ('vehicle_id', 'timestamp'),
+}
+
+STAT_COLUMNS = ['fuel_amount', 'fuel_cost', 'fuel_count', 'maintenance_cost', 'maintenance_count',
+                'distance', 'task_time', 'task_count', 'consumption_sum', 'consumption_count']
+# Столбцы маршрута, входящие в итоги по задачам: их изменение меняет итоги всех задач маршрута
+ROUTE_COLUMNS = ('distance', 'estimated_time')
+# Сколько интервалов дней пересчитывается одним запросом (условия OR по индексу ТС и времени)
+RANGES_PER_QUERY = 200
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _day_ranges(keys):
+    """Непрерывные интервалы дней по ТС из набора (vehicle_id, day): [(vehicle_id, первый день, день после последнего)]"""
+    ranges = []
+    for vid, day in sorted(keys):
+        if ranges and ranges[-1][0] == vid and ranges[-1][2] == day:
+            ranges[-1][2] = day + timedelta(days=1)
+        else:
+            ranges.append([vid, day, day + timedelta(days=1)])
+    return ranges
+
+
+def _aggregate(connection, ranges):
+    """
+    Суточные итоги из исходных таблиц по интервалам [(vehicle_id, start_day, end_day)]
+    (vehicle_id None — все ТС): {(vehicle_id, day): {...}}
+    """
+    def grouped(vehicle_col, time_col, *aggregates, join=None):
+        day = func.date(time_col)
+        query = db.select(vehicle_col, day, *aggregates)
+        if join is not None:
+            query = query.join(*join)
+        spans = []
+        for vid, start_day, end_day in ranges:
+            span = and_(time_col >= datetime.combine(start_day, datetime.min.time()),
+                        time_col < datetime.combine(end_day, datetime.min.time()))
+            spans.append(span if vid is None else and_(vehicle_col == vid, span))
+        return connection.execute(query.where(or_(*spans)).group_by(vehicle_col, day))
+
+    stats = {}
+
+    def add(rows, names):
+        for vid, day, *values in rows:
+            if vid is None:
+                continue
+            row = stats.setdefault((vid, _as_date(day)), dict.fromkeys(STAT_COLUMNS, 0))
+            for name, value in zip(names, values):
+                row[name] = value or 0
+
+    add(grouped(FuelRecord.vehicle_id, FuelRecord.date,
+                func.sum(FuelRecord.amount), func.sum(FuelRecord.cost), func.count(FuelRecord.id)),
+        ['fuel_amount', 'fuel_cost', 'fuel_count'])
+    add(grouped(MaintenanceRecord.vehicle_id, MaintenanceRecord.date,
+                func.sum(MaintenanceRecord.cost), func.count(MaintenanceRecord.id)),
+        ['maintenance_cost', 'maintenance_count'])
+    add(grouped(Task.vehicle_id, Task.start_time,
+                func.sum(Route.distance), func.sum(Route.estimated_time), func.count(Task.id),
+                join=(Route, Task.route_id == Route.id)),
+        ['distance', 'task_time', 'task_count'])
+    add(grouped(FuelConsumption.vehicle_id, FuelConsumption.timestamp,
+                func.sum(FuelConsumption.consumption_rate), func.count(FuelConsumption.id)),
+        ['consumption_sum', 'consumption_count'])
+    return stats
+
+
+def _write(connection, stats):
+    rows = [{'vehicle_id': vid, 'day': day, **values} for (vid, day), values in stats.items()]
+    if rows:
+        connection.execute(insert(VehicleDailyStats), rows)
+
+
+def _lock_keys(connection, keys):
+    """
+    Блокировки (vehicle_id, day) до конца транзакции (pg_advisory_xact_lock с парой ключей),
+    в порядке ключей, чтобы транзакции с пересекающимися наборами не взаимоблокировались
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    rows = values(column('vehicle_id', Integer), column('day', Integer), name='rollup_keys') \
+        .data([(vid, day.toordinal()) for vid, day in sorted(keys)])
+    connection.execute(select(func.pg_advisory_xact_lock(rows.c.vehicle_id, rows.c.day))
+                       .order_by(rows.c.vehicle_id, rows.c.day))
+
+
+def _upsert(connection, stats):
+    """Запись итогов поверх существующих (INSERT ... ON CONFLICT DO UPDATE)"""
+    rows = [{'vehicle_id': vid, 'day': day, **totals} for (vid, day), totals in stats.items()]
+    if not rows:
+        return
+    statement = (sqlite if connection.dialect.name == 'sqlite' else postgresql).insert(VehicleDailyStats).values(rows)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['vehicle_id', 'day'], set_={name: statement.excluded[name] for name in STAT_COLUMNS}))
+
+
+def refresh_daily_stats(connection, keys):
+    """
+    Пересчёт итогов для набора (vehicle_id, day) по исходным таблицам: читаются только
+    непрерывные интервалы затронутых дней каждого ТС, а не весь охватывающий их период.
+    Ключи блокируются до пересчёта, поэтому параллельные транзакции с теми же сутками ТС
+    пересчитывают их по очереди и вторая видит записи первой.
+    """
+    keys = {(vid, _as_date(day)) for vid, day in keys if vid is not None and day is not None}
+    if not keys:
+        return
+    _lock_keys(connection, keys)
+    ranges = _day_ranges(keys)
+    stats = {}
+    for start in range(0, len(ranges), RANGES_PER_QUERY):
+        stats.update(_aggregate(connection, ranges[start:start + RANGES_PER_QUERY]))
+    empty = keys - stats.keys()
+    if empty:
+        connection.execute(delete(VehicleDailyStats).where(
+            tuple_(VehicleDailyStats.vehicle_id, VehicleDailyStats.day).in_(list(empty))))
+    _upsert(connection, stats)
+
+
+def backfill_daily_stats(connection, start_day=None, end_day=None):
+    """Полный пересчёт итогов за [start_day, end_day) помесячно; возвращает число записанных строк"""
+    if start_day is None or end_day is None:
+        bounds = [connection.execute(db.select(func.min(getattr(m, t)), func.max(getattr(m, t)))).one()
+                  for m, (_, t) in ROLLUP_SOURCES.items()]
+        firsts = [_as_date(lo) for lo, _ in bounds if lo is not None]
+        lasts = [_as_date(hi) for _, hi in bounds if hi is not None]
+        if not firsts:
+            return 0
+        start_day = start_day or min(firsts)
+        end_day = end_day or max(lasts) + timedelta(days=1)
+    connection.execute(delete(VehicleDailyStats).where(
+        VehicleDailyStats.day >= start_day, VehicleDailyStats.day < end_day))
+    written = 0
+    chunk_start = start_day
+    while chunk_start < end_day:
+        chunk_end = min(date(chunk_start.year + chunk_start.month // 12, chunk_start.month % 12 + 1, 1), end_day)
+        stats = _aggregate(connection, [(None, chunk_start, chunk_end)])
+        _write(connection, stats)
+        written += len(stats)
+        chunk_start = chunk_end
+    return written
+
+
+def _touched_keys(obj, vehicle_attr, time_attr):
+    """(vehicle_id, day) для текущих и прежних (до изменения) значений объекта"""
+    state = inspect(obj)
+    vids = {getattr(obj, vehicle_attr)} | set(state.attrs[vehicle_attr].history.deleted)
+    times = {getattr(obj, time_attr)} | set(state.attrs[time_attr].history.deleted)
+    return {(vid, _as_date(t)) for vid in vids for t in times if vid is not None and t is not None}
+
+
+def columns_changed(obj, columns):
+    """Изменился ли в объекте сессии хотя бы один из столбцов columns"""
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in columns)
+
+
+def changed_routes(session):
+    """id изменённых в сессии маршрутов, у которых поменялись столбцы ROUTE_COLUMNS (вызывается до flush)"""
+    return {obj.id for obj in session.dirty if isinstance(obj, Route) and columns_changed(obj, ROUTE_COLUMNS)}
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_touched_days(session, flush_context, instances):
+    keys = session.info.setdefault('rollup_keys', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        spec = ROLLUP_SOURCES.get(type(obj))
+        if spec:
+            keys |= _touched_keys(obj, *spec)
+    routes = changed_routes(session)
+    if routes:
+        session.info.setdefault('rollup_routes', set()).update(routes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_touched_days(session, flush_context):
+    keys = session.info.pop('rollup_keys', set())
+    routes = session.info.pop('rollup_routes', set())
+    if not keys and not routes:
+        return
+    connection = session.connection()
+    if routes:
+        keys |= set(connection.execute(db.select(Task.vehicle_id, Task.start_time).where(Task.route_id.in_(routes))))
+    refresh_daily_stats(connection, keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_touched_days(session):
+    session.info.pop('rollup_keys', None)
+    session.info.pop('rollup_routes', None)
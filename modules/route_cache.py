@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from itertools import count
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, select, update, delete, insert, func
+from sqlalchemy.exc import IntegrityError
+from database import db
+from config import Config
+from modules import polyline
+from modules.routing import route_points
+
+# Координаты ключа хранятся целыми: градусы * 10^5 (около метра), как и точность polyline
+KEY_SCALE = 10 ** 5
+# Сохранения в этом процессе: вытеснение запускается на каждом ROUTE_CACHE_EVICT_EVERY-м
+_stores = count(1)
+
+
+class RouteGeometry(db.Model):
+    """Геометрия маршрута по дорогам между двумя точками, общая для GUI, API и фоновых задач"""
+    __tablename__ = 'route_geometries'
+    __table_args__ = (
+        Index('ix_route_geometries_last_used', 'last_used'),
+    )
+
+    profile = Column(String(20), primary_key=True)
+    start_lat = Column(Integer, primary_key=True)
+    start_lon = Column(Integer, primary_key=True)
+    end_lat = Column(Integer, primary_key=True)
+    end_lon = Column(Integer, primary_key=True)
+    geometry = Column(Text, nullable=False)  # encoded polyline
+    point_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    last_used = Column(DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f'<RouteGeometry {self.profile} ({self.start_lat},{self.start_lon})->({self.end_lat},{self.end_lon})>'
+
+
+def route_key(start, end, profile=None):
+    return {
+        'profile': profile or Config.ROUTING_PROFILE,
+        'start_lat': round(start[0] * KEY_SCALE), 'start_lon': round(start[1] * KEY_SCALE),
+        'end_lat': round(end[0] * KEY_SCALE), 'end_lon': round(end[1] * KEY_SCALE),
+    }
+
+
+def _key_condition(key):
+    return [getattr(RouteGeometry, name) == value for name, value in key.items()]
+
+
+def get_cached_route(start, end, profile=None):
+    """
+    Геометрия из кэша (список (lat, lon)) или None. Отметка времени использования обновляется, только если
+    она старше ROUTE_CACHE_TOUCH_INTERVAL_S: для вытеснения давно не использованных записей этого хватает,
+    а частые попадания не пишут в базу.
+    """
+    key = route_key(start, end, profile)
+    with db.engine.begin() as conn:
+        row = conn.execute(select(RouteGeometry.geometry, RouteGeometry.last_used).where(*_key_condition(key))).first()
+        if row is None:
+            return None
+        now = datetime.now()
+        if row.last_used < now - timedelta(seconds=Config.ROUTE_CACHE_TOUCH_INTERVAL_S):
+            conn.execute(update(RouteGeometry).where(*_key_condition(key)).values(last_used=now))
+    return polyline.decode(row.geometry)
+
+
+def store_route(start, end, points, profile=None):
+    """Сохранение геометрии; на каждом ROUTE_CACHE_EVICT_EVERY-м сохранении удаляются записи сверх предела"""
+    key = route_key(start, end, profile)
+    now = datetime.now()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(RouteGeometry).where(*_key_condition(key)))
+            conn.execute(insert(RouteGeometry).values(geometry=polyline.encode(points), point_count=len(points),
+                                                      created_at=now, last_used=now, **key))
+            if next(_stores) % Config.ROUTE_CACHE_EVICT_EVERY == 0:
+                evict(conn)
+    except IntegrityError:
+        pass  # ту же геометрию параллельно сохранил другой процесс
+
+
+def evict(conn, max_entries=None):
+    """Удаление самых давно использованных записей сверх ROUTE_CACHE_MAX_ENTRIES; возвращает число удалённых"""
+    max_entries = Config.ROUTE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    excess = conn.execute(select(func.count()).select_from(RouteGeometry)).scalar() - max_entries
+    if excess <= 0:
+        return 0
+    cutoff = conn.execute(select(RouteGeometry.last_used).order_by(RouteGeometry.last_used)
+                          .offset(excess - 1).limit(1)).scalar()
+    return conn.execute(delete(RouteGeometry).where(RouteGeometry.last_used <= cutoff)).rowcount
+
+
+def cached_route_points(start, end, profile=None):
+    """Маршрут по дорогам (как routing.route_points) с постоянным кэшем геометрий в базе"""
+    points = get_cached_route(start, end, profile)
+    if points is None:
+        points = route_points(start, end, profile)
+        store_route(start, end, points, profile)
+    return points
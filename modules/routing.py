@@ -0,0 +1,214 @@
+import heapq
+import math
+import threading
+import xml.etree.ElementTree as ET
+import numpy as np
+import requests
+from config import Config
+from modules.geometry import haversine_m
+
+# Типы дорог OSM, пригодные для автотранспорта
+DRIVABLE_HIGHWAYS = {
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'road',
+}
+
+
+class RoutingError(Exception):
+    """Маршрут по дорогам построить не удалось"""
+
+
+class RoadGraph:
+    """
+    Дорожный граф в компактном виде: координаты вершин и смежность в формате CSR
+    (offsets[i]:offsets[i+1] — диапазон исходящих рёбер вершины i в targets/weights).
+    Вес ребра — длина в метрах.
+    """
+
+    def __init__(self, lat, lon, sources, targets):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        sources, targets = sources[order], targets[order]
+        self.offsets = np.zeros(len(self.lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.lat)), out=self.offsets[1:])
+        self.targets = targets.astype(np.int32)
+        self.weights = haversine_m(self.lat[sources], self.lon[sources],
+                                   self.lat[targets], self.lon[targets]).astype(np.float32)
+
+    def __len__(self):
+        return len(self.lat)
+
+    @classmethod
+    def _from_edges(cls, coords, edges):
+        """coords: {id вершины: (lat, lon)}, edges: [(id, id, oneway)]; остаются только вершины с рёбрами"""
+        used = sorted({n for a, b, _ in edges for n in (a, b) if a in coords and b in coords})
+        index = {n: i for i, n in enumerate(used)}
+        sources, targets = [], []
+        for a, b, oneway in edges:
+            if a in index and b in index:
+                sources.append(index[a])
+                targets.append(index[b])
+                if not oneway:
+                    sources.append(index[b])
+                    targets.append(index[a])
+        lat = [coords[n][0] for n in used]
+        lon = [coords[n][1] for n in used]
+        return cls(lat, lon, sources, targets)
+
+    @classmethod
+    def from_edge_list(cls, path):
+        """
+        Текстовый формат, по записи на строку (# — комментарий):
+            v <id> <lat> <lon>          — вершина
+            e <id_from> <id_to> [1]     — дорога (1 — одностороннее движение)
+        """
+        coords, edges = {}, []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                parts = line.split('#', 1)[0].split()
+                if not parts:
+                    continue
+                if parts[0] == 'v':
+                    coords[parts[1]] = (float(parts[2]), float(parts[3]))
+                elif parts[0] == 'e':
+                    edges.append((parts[1], parts[2], len(parts) > 3 and parts[3] == '1'))
+        return cls._from_edges(coords, edges)
+
+    @classmethod
+    def from_osm(cls, path):
+        """Граф из выгрузки OSM XML (.osm): дороги с тегом highway из DRIVABLE_HIGHWAYS"""
+        coords, edges = {}, []
+        way_nodes, tags = [], {}
+        for _, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                coords[elem.get('id')] = (float(elem.get('lat')), float(elem.get('lon')))
+                tags = {}
+                elem.clear()
+            elif elem.tag == 'nd':
+                way_nodes.append(elem.get('ref'))
+            elif elem.tag == 'tag':
+                tags[elem.get('k')] = elem.get('v')
+            elif elem.tag == 'way':
+                if tags.get('highway') in DRIVABLE_HIGHWAYS:
+                    oneway = tags.get('oneway')
+                    nodes = way_nodes[::-1] if oneway == '-1' else way_nodes
+                    directed = oneway in ('yes', '1', '-1') or tags.get('highway') == 'motorway'
+                    edges.extend((a, b, directed) for a, b in zip(nodes, nodes[1:]))
+                way_nodes, tags = [], {}
+                elem.clear()
+            elif elem.tag == 'relation':
+                tags = {}
+                elem.clear()
+        return cls._from_edges(coords, edges)
+
+    def save(self, path):
+        """Сохранение в .npz — загружается на порядки быстрее разбора OSM"""
+        np.savez(path, lat=self.lat, lon=self.lon, offsets=self.offsets, targets=self.targets, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        graph = cls.__new__(cls)
+        graph.lat, graph.lon = data['lat'], data['lon']
+        graph.offsets, graph.targets, graph.weights = data['offsets'], data['targets'], data['weights']
+        return graph
+
+    def nearest_node(self, lat, lon):
+        """Ближайшая к точке вершина графа (равнопромежуточное приближение, для выбора ближайшей его достаточно)"""
+        dx = (self.lon - lon) * np.cos(np.radians(lat))
+        dy = self.lat - lat
+        return int(np.argmin(dx * dx + dy * dy))
+
+    def shortest_path(self, source, target):
+        """A* по длине пути с эвристикой — расстоянием по прямой до цели; список вершин или None"""
+        if source == target:
+            return [source]
+        heuristic = haversine_m(self.lat, self.lon, self.lat[target], self.lon[target]).tolist()
+        offsets, targets, weights = self._lists()
+        best = {source: 0.0}
+        previous = {}
+        # при равной оценке первой берётся вершина, ближе подошедшая к цели, — меньше раскрытий на сетке улиц
+        queue = [(heuristic[source], 0.0, source)]
+        while queue:
+            _, dist, node = heapq.heappop(queue)
+            dist = -dist
+            if node == target:
+                path = [node]
+                while node in previous:
+                    node = previous[node]
+                    path.append(node)
+                return path[::-1]
+            if dist > best[node]:
+                continue
+            for i in range(offsets[node], offsets[node + 1]):
+                nxt = targets[i]
+                candidate = dist + weights[i]
+                if candidate < best.get(nxt, math.inf):
+                    best[nxt] = candidate
+                    previous[nxt] = node
+                    heapq.heappush(queue, (candidate + heuristic[nxt], -candidate, nxt))
+        return None
+
+    def _lists(self):
+        """CSR-массивы в виде списков Python: в цикле A* доступ к ним в разы быстрее, чем к элементам numpy"""
+        if getattr(self, '_adjacency', None) is None:
+            self._adjacency = (self.offsets.tolist(), self.targets.tolist(), self.weights.tolist())
+        return self._adjacency
+
+    def route_points(self, start, end):
+        """Маршрут между точками (lat, lon) в виде списка (lat, lon) по вершинам графа"""
+        path = self.shortest_path(self.nearest_node(*start), self.nearest_node(*end))
+        if path is None:
+            raise RoutingError('точки не связаны дорогами в графе')
+        return list(zip(self.lat[path].tolist(), self.lon[path].tolist()))
+
+
+def load_road_graph(path):
+    """Загрузка графа по расширению файла: .npz (готовый граф), .osm/.xml (OSM XML), иначе — список рёбер"""
+    if path.endswith('.npz'):
+        return RoadGraph.load(path)
+    if path.endswith(('.osm', '.xml')):
+        return RoadGraph.from_osm(path)
+    return RoadGraph.from_edge_list(path)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_road_graph():
+    """Граф из ROAD_GRAPH_PATH, загружаемый один раз на процесс; None, если локальный граф не настроен"""
+    global _graph
+    if _graph is None and Config.ROAD_GRAPH_PATH:
+        with _graph_lock:
+            if _graph is None:
+                _graph = load_road_graph(Config.ROAD_GRAPH_PATH)
+    return _graph
+
+
+def fetch_osrm_route(start, end, profile=None, timeout=None):
+    """Маршрут через HTTP API OSRM (OSRM_URL); список (lat, lon)"""
+    url = f"{Config.OSRM_URL}/route/v1/{profile or Config.ROUTING_PROFILE}/{start[1]},{start[0]};{end[1]},{end[0]}?overview=full&geometries=geojson"
+    try:
+        data = requests.get(url, timeout=timeout or Config.ROUTING_TIMEOUT).json()
+    except (requests.RequestException, ValueError) as e:
+        raise RoutingError(f'ошибка при обращении к OSRM: {e}')
+    if not data.get('routes') or not data['routes'][0]['geometry']['coordinates']:
+        raise RoutingError('OSRM не построил маршрут по дорогам')
+    return [(lat, lon) for lon, lat in data['routes'][0]['geometry']['coordinates']]
+
+
+def route_points(start, end, profile=None):
+    """
+    Маршрут по дорогам между точками start и end (lat, lon): по локальному графу,
+    если задан ROAD_GRAPH_PATH (граф автомобильных дорог, profile не учитывается), иначе через OSRM.
+    RoutingError при неудаче.
+    """
+    graph = get_road_graph()
+    if graph is not None:
+        return graph.route_points(start, end)
+    return fetch_osrm_route(start, end, profile)
@@ -0,0 +1,80 @@
+import math
+import threading
+import numpy as np
+from config import Config
+from modules.geometry import EARTH_RADIUS_M, haversine_m
+from modules.positions import position_store
+
+
+class GridIndex:
+    """
+    Сеточный пространственный индекс точек: ячейки cell_deg x cell_deg градусов,
+    точки упорядочены по ячейкам, для каждой занятой ячейки хранится диапазон в массивах.
+    Запросы просматривают только ячейки, пересекающие область, и возвращают номера точек
+    в исходном порядке (как были переданы в конструктор).
+    """
+
+    def __init__(self, lat, lon, cell_deg=None):
+        self.cell = cell_deg or Config.SPATIAL_CELL_DEG
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        rows = np.floor(lat / self.cell).astype(np.int64)
+        cols = np.floor(lon / self.cell).astype(np.int64)
+        self.order = np.lexsort((cols, rows))
+        self.lat, self.lon = lat[self.order], lon[self.order]
+        rows, cols = rows[self.order], cols[self.order]
+        starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])]) if len(rows) else []
+        ends = list(starts[1:]) + [len(rows)]
+        self.cells = {(int(rows[s]), int(cols[s])): (int(s), int(e)) for s, e in zip(starts, ends)}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Позиции (в упорядоченных массивах) точек из ячеек, пересекающих прямоугольник"""
+        r0, r1 = math.floor(min_lat / self.cell), math.floor(max_lat / self.cell)
+        c0, c1 = math.floor(min_lon / self.cell), math.floor(max_lon / self.cell)
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self.cells):
+            # область больше занятой части сетки — дешевле перебрать занятые ячейки
+            ranges = [span for (r, c), span in self.cells.items() if r0 <= r <= r1 and c0 <= c <= c1]
+        else:
+            ranges = [self.cells[(r, c)] for r in range(r0, r1 + 1) for c in range(c0, c1 + 1) if (r, c) in self.cells]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(s, e) for s, e in ranges])
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Номера точек внутри прямоугольника (границы включаются)"""
+        pos = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lat, lon = self.lat[pos], self.lon[pos]
+        pos = pos[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)]
+        return np.sort(self.order[pos])
+
+    def near(self, lat, lon, radius_m):
+        """(номера точек, расстояния в метрах) в радиусе radius_m от точки, по возрастанию расстояния"""
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        pos = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = haversine_m(lat, lon, self.lat[pos], self.lon[pos])
+        inside = distances <= radius_m
+        pos, distances = pos[inside], distances[inside]
+        by_distance = np.argsort(distances, kind='stable')
+        return self.order[pos[by_distance]], distances[by_distance]
+
+
+_state = {'revision': None, 'positions': [], 'index': None}
+_lock = threading.Lock()
+
+
+def position_index():
+    """
+    (последние позиции ТС, GridIndex по ним); номера в индексе — позиции в списке.
+    Источник — хранилище последних позиций (modules/positions); индекс перестраивается только после его изменения.
+    """
+    position_store.sync()
+    with _lock:
+        if _state['index'] is None or _state['revision'] != position_store.revision:
+            snapshot = position_store.snapshot()
+            index = GridIndex(snapshot['latitude'], snapshot['longitude'])
+            _state.update(revision=snapshot['revision'], positions=position_store.records(snapshot), index=index)
+        return _state['positions'], _state['index']
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import DateTime, select, delete, insert, union_all, literal, exists, true
+from database import db
+from config import Config
+from modules.vehicle_management import Vehicle
+
+EPOCH = datetime(1970, 1, 1)
+G = 9.81  # м/с²
+KMH_TO_MS = 1 / 3.6
+
+
+def micros(timestamps):
+    """Время в микросекундах эпохи (массив int64)"""
+    return np.array(timestamps, dtype='datetime64[us]').astype(np.int64)
+
+
+def seconds(timestamps):
+    """Время в секундах эпохи (массив float64)"""
+    return micros(timestamps) / 1e6
+
+
+def to_datetime(value):
+    """Время из микросекунд эпохи"""
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def fetch_arrays(query, names):
+    """
+    Строки запроса телеметрии порциями TELEMETRY_FETCH_SIZE сразу в словарь массивов с ключами names,
+    объекты ORM не создаются. Первый столбец — vehicle_id, второй — время (в микросекунды эпохи),
+    остальные — числа (None -> NaN).
+    """
+    query = query.execution_options(yield_per=Config.TELEMETRY_FETCH_SIZE)
+    parts = {name: [] for name in names}
+    for rows in db.session.execute(query).partitions():
+        columns = list(zip(*rows))
+        parts[names[0]].append(np.array(columns[0], dtype=np.int64))
+        parts[names[1]].append(micros(columns[1]))
+        for name, values in zip(names[2:], columns[2:]):
+            parts[name].append(np.array(values, dtype=np.float64))
+    return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64 if name in names[:2] else np.float64)
+            for name, arrays in parts.items()}
+
+
+def new_points(columns, progress_vehicle, progress_from, since=None, until=None, conditions=()):
+    """
+    Запрос новых точек для задания с таблицей продвижения: columns — столбцы таблицы телеметрии
+    (первые два — vehicle_id и timestamp). Для ТС с записью продвижения точки читаются с progress_from
+    (включительно; выражение над строкой продвижения), для остальных ТС парка — с since (или все).
+    Точки каждого ТС выбираются отдельным подзапросом LATERAL по его собственной границе: используется
+    индекс (vehicle_id, timestamp) и отсекаются старые секции, а ТС, давно не присылавшее точек,
+    не заставляет перечитывать весь парк. Результат упорядочен по ТС и времени.
+    """
+    vehicle_column, time_column = columns[:2]
+    bounds = union_all(
+        select(progress_vehicle.label('vehicle_id'), progress_from.label('since')),
+        select(Vehicle.id, literal(since or EPOCH, DateTime)).where(~exists().where(progress_vehicle == Vehicle.id)),
+    ).subquery('bounds')
+    points = select(*columns).where(vehicle_column == bounds.c.vehicle_id, time_column >= bounds.c.since, *conditions)
+    if until is not None:
+        points = points.where(time_column < until)
+    points = points.lateral('points')
+    return select(*points.c).select_from(bounds).join(points, true()) \
+        .order_by(points.c[vehicle_column.key], points.c[time_column.key])
+
+
+def replace_progress(model, rows):
+    """Запись продвижения задания по ТС (строки с ключом vehicle_id) вместо прежнего, в текущей транзакции"""
+    db.session.execute(delete(model).where(model.vehicle_id.in_([row['vehicle_id'] for row in rows])))
+    db.session.execute(insert(model), rows)
@@ -0,0 +1,57 @@
+import calendar
+from datetime import datetime, timedelta
+from modules import polyline
+
+# Компактное представление трека для API и карты:
+#   path  — координаты в формате Google polyline (5 знаков, около метра);
+#   time  — время точек в секундах (как записано в базе, без пересчёта поясов), разности соседних значений;
+#   speed, fuel — ряды с точностью 0.1 в той же кодировке.
+# Ряд с пропусками (None) передаётся обычным списком; подписи трека (ТС, маршрут) хранятся один раз.
+FORMAT = 'compact-v1'
+EPOCH = datetime(1970, 1, 1)
+COORD_PRECISION = 5
+VALUE_PRECISION = 1
+
+
+def _encode_series(values, precision):
+    if any(v is None for v in values):
+        return [None if v is None else round(v, precision) for v in values]
+    return polyline.encode_values(values, precision)
+
+
+def _decode_series(series, precision):
+    if isinstance(series, str):
+        return polyline.decode_values(series, precision)
+    return list(series)
+
+
+def _epoch(timestamp):
+    return calendar.timegm(timestamp.timetuple()) if timestamp is not None else None
+
+
+def encode_track(points, **meta):
+    """
+    Трек в компактном виде. points — строки TrackingData (или объекты с полями
+    latitude, longitude, timestamp, speed, fuel_level) в порядке времени; meta — поля трека.
+    """
+    return {
+        **meta,
+        'format': FORMAT,
+        'count': len(points),
+        'path': polyline.encode([(p.latitude, p.longitude) for p in points], COORD_PRECISION),
+        'time': _encode_series([_epoch(p.timestamp) for p in points], 0),
+        'speed': _encode_series([p.speed for p in points], VALUE_PRECISION),
+        'fuel': _encode_series([p.fuel_level for p in points], VALUE_PRECISION),
+    }
+
+
+def decode_track(data):
+    """Обратное преобразование: список словарей latitude, longitude, timestamp, speed, fuel_level"""
+    coords = polyline.decode(data['path'], COORD_PRECISION)
+    times = _decode_series(data['time'], 0)
+    speeds = _decode_series(data['speed'], VALUE_PRECISION)
+    fuels = _decode_series(data['fuel'], VALUE_PRECISION)
+    return [{'latitude': lat, 'longitude': lon,
+             'timestamp': EPOCH + timedelta(seconds=t) if t is not None else None,
+             'speed': speed, 'fuel_level': fuel}
+            for (lat, lon), t, speed, fuel in zip(coords, times, speeds, fuels)]
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from sqlalchemy import insert, delete, tuple_
+from database import db, app
+from config import Config
+from modules.dispatch import Route
+from modules.monitoring import TrackingData
+from modules.partitioning import ensure_partitions_for_rows
+from modules.geometry import simplify
+from modules.route_cache import cached_route_points
+
+# Точки по умолчанию, если у маршрута не заданы координаты (как и раньше в MapSimulationWidget)
+DEFAULT_START = (55.7558, 37.6176)
+DEFAULT_END = (59.9343, 30.3351)
+FALLBACK_STEPS = 40
+
+
+def route_endpoints(route):
+    start = (route.start_lat, route.start_lon) if route.start_lat and route.start_lon else DEFAULT_START
+    end = (route.end_lat, route.end_lon) if route.end_lat and route.end_lon else DEFAULT_END
+    return start, end
+
+
+def straight_line(start, end, steps=FALLBACK_STEPS):
+    return [(start[0] + (end[0] - start[0]) * i / steps, start[1] + (end[1] - start[1]) * i / steps)
+            for i in range(steps + 1)]
+
+
+def _fetch_geometry(start, end):
+    # у каждого потока свой контекст приложения: кэш геометрий работает через db.engine
+    with app.app_context():
+        return cached_route_points(start, end)
+
+
+def fetch_geometries(endpoints, max_workers=None, on_done=None, should_stop=None):
+    """
+    Параллельное построение маршрутов для набора пар точек (start, end).
+    Одинаковые пары запрашиваются один раз. Возвращает {(start, end): список точек или исключение}.
+    on_done(key, result) вызывается по мере готовности каждой пары;
+    если should_stop() вернул True, ещё не начатые запросы отменяются.
+    """
+    unique = list(dict.fromkeys(endpoints))
+    results = {}
+    if not unique:
+        return results
+    workers = min(max_workers or Config.ROUTING_MAX_WORKERS, len(unique))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_fetch_geometry, *key): key for key in unique}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:  # ошибка одной пары не должна срывать остальные
+                results[key] = e
+            if on_done:
+                on_done(key, results[key])
+            if should_stop and should_stop():
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+    return results
+
+
+def track_points(start, end, result):
+    """
+    Точки трека по результату маршрутизации: маршрут по дорогам, упрощённый с допуском
+    TRACK_SIMPLIFY_TOLERANCE_M (повороты сохраняются, лишние точки на прямых отбрасываются), или прямая линия.
+    Если точек всё ещё больше TRACK_MAX_POINTS (длинный извилистый маршрут), допуск удваивается до укладывания в предел.
+    """
+    if isinstance(result, Exception) or not result or len(result) < 2:
+        points = straight_line(start, end)
+        reason = f' ({result})' if isinstance(result, Exception) else ''
+        return points, f'Fallback: {len(points)} точек{reason}.'
+    tolerance = Config.TRACK_SIMPLIFY_TOLERANCE_M
+    points = simplify(result, tolerance)
+    while len(points) > Config.TRACK_MAX_POINTS:
+        tolerance *= 2
+        points = simplify(result, tolerance)
+    return points, f'Маршрут по дорогам: {len(points)} точек (из {len(result)}).'
+
+
+def build_tracks(pairs, progress=None, max_workers=None, should_stop=None):
+    """
+    Геометрия треков для пар (vehicle_id, route_id): маршруты читаются одним запросом,
+    маршрутизация идёт параллельно, одинаковые пары точек строятся один раз.
+    progress(done, total, vehicle_id, route_id, status) вызывается по каждой паре по мере готовности;
+    should_stop() позволяет прервать построение (вернутся уже готовые треки).
+    Возвращает список (vehicle_id, route_id, points, status); points равен None, если маршрута нет в базе.
+    """
+    route_ids = {route_id for _, route_id in pairs}
+    routes = {r.id: r for r in Route.query.filter(Route.id.in_(route_ids))} if route_ids else {}
+    endpoints = {route_id: route_endpoints(route) for route_id, route in routes.items()}
+
+    tracks = []
+
+    def report(track):
+        tracks.append(track)
+        if progress:
+            progress(len(tracks), len(pairs), *track[:2], track[3])
+
+    owners = {}
+    for vid, route_id in pairs:
+        if route_id in endpoints:
+            owners.setdefault(endpoints[route_id], []).append((vid, route_id))
+        else:
+            report((vid, route_id, None, f'Маршрут с id={route_id} не найден'))
+
+    def on_done(key, result):
+        points, status = track_points(*key, result)
+        for vid, route_id in owners[key]:
+            report((vid, route_id, points, status))
+
+    fetch_geometries(list(owners), max_workers, on_done, should_stop)
+    return tracks
+
+
+def save_tracks(tracks, end_time=None):
+    """
+    Запись треков в TrackingData одной транзакцией: прежние точки этих пар ТС/маршрут удаляются
+    одним запросом, новые вставляются пакетами (многострочные INSERT).
+    Точки идут с шагом GPS_UPDATE_INTERVAL и заканчиваются в end_time (по умолчанию — сейчас).
+    Возвращает число записанных треков.
+    """
+    tracks = [t for t in tracks if t[2]]
+    if not tracks:
+        return 0
+    end_time = end_time or datetime.now()
+    step = timedelta(seconds=Config.GPS_UPDATE_INTERVAL)
+    rows = []
+    for vid, route_id, points, _ in tracks:
+        start_time = end_time - step * (len(points) - 1)
+        rows.extend({'vehicle_id': vid, 'route_id': route_id, 'latitude': lat, 'longitude': lon,
+                     'timestamp': start_time + step * i} for i, (lat, lon) in enumerate(points))
+    keys = list({(vid, route_id) for vid, route_id, _, _ in tracks})
+    db.session.execute(delete(TrackingData).where(tuple_(TrackingData.vehicle_id, TrackingData.route_id).in_(keys)))
+    ensure_partitions_for_rows(db.session.connection(), TrackingData.__tablename__, rows)
+    for start in range(0, len(rows), Config.INGEST_CHUNK_SIZE):
+        db.session.execute(insert(TrackingData), rows[start:start + Config.INGEST_CHUNK_SIZE])
+    db.session.commit()
+    return len(tracks)
@@ -0,0 +1,169 @@
+from datetime import datetime
+import numpy as np
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index, select, insert
+from database import db
+from config import Config
+from modules.geometry import haversine_m
+from modules.monitoring import TrackingData
+from modules.telemetry import micros, to_datetime, fetch_arrays, new_points, replace_progress
+from modules.cache import analytics_cache
+
+
+class Trip(db.Model):
+    """Поездка ТС, выделенная из точек телеметрии (segment_trips): от последней точки стоянки до первой точки следующей"""
+    __tablename__ = 'trips'
+    __table_args__ = (
+        Index('ix_trips_vehicle_id_start_time', 'vehicle_id', 'start_time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    start_latitude = Column(Float)
+    start_longitude = Column(Float)
+    end_latitude = Column(Float)
+    end_longitude = Column(Float)
+    distance = Column(Float, nullable=False)  # км, как Route.distance
+    duration = Column(Float, nullable=False)  # мин, как Route.estimated_time
+    idle_time = Column(Float, nullable=False)  # мин, остановки короче TRIP_MIN_STOP_S внутри поездки
+    fuel_used = Column(Float)  # по падению уровня топлива; None, если уровень не передавался
+    points = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Trip {self.start_time} for vehicle {self.vehicle_id}>'
+
+
+class TripProgress(db.Model):
+    """Докуда разобраны точки ТС: следующий запуск читает точки начиная с resume_from включительно"""
+    __tablename__ = 'trip_progress'
+
+    vehicle_id = Column(Integer, primary_key=True)
+    resume_from = Column(DateTime, nullable=False)
+    stopped_since = Column(DateTime)  # начало стоянки, которой принадлежит точка resume_from
+
+    def __repr__(self):
+        return f'<TripProgress {self.resume_from} for vehicle {self.vehicle_id}>'
+
+
+def load_points(until, since=None):
+    """
+    Необработанные точки TrackingData с координатами одним запросом, по ТС и времени: для ТС с записью
+    TripProgress — с её resume_from, для остальных — с since (или все); каждое ТС читается по своей
+    границе (telemetry.new_points). Строки читаются порциями сразу в массивы (время — микросекунды эпохи).
+    """
+    query = new_points((TrackingData.vehicle_id, TrackingData.timestamp, TrackingData.latitude, TrackingData.longitude,
+                        TrackingData.speed, TrackingData.fuel_level),
+                       TripProgress.vehicle_id, TripProgress.resume_from, since, until,
+                       (TrackingData.latitude.isnot(None), TrackingData.longitude.isnot(None)))
+    return fetch_arrays(query, ('vehicle_id', 'micros', 'latitude', 'longitude', 'speed', 'fuel_level'))
+
+
+def segment_trips(data, stopped_since, until):
+    """
+    Разбиение потоков точек ТС (массивы load_points, отсортированные по ТС и времени) на поездки и стоянки.
+    Стоянка — серия точек со скоростью ниже TRIP_MOVING_SPEED_KMH длительностью не меньше TRIP_MIN_STOP_S
+    (короткие остановки входят в поездку как простой); разрыв между точками больше TRIP_MAX_GAP_S
+    тоже завершает поездку. Скорость, если не передана, берётся из расстояния между соседними точками.
+    stopped_since — {vehicle_id: микросекунды} начала стоянки, на которой ТС стояло в первой точке.
+    Возвращает (поездки, продолжение): поездки — словарь массивов по завершённым поездкам;
+    продолжение — {vehicle_id: (resume_from, stopped_since)} в микросекундах (второе может быть None).
+    Завершённой считается поездка, после которой началась стоянка или разрыв, в том числе
+    если ТС молчит дольше TRIP_MAX_GAP_S до until. Незавершённая поездка будет разобрана заново в следующий раз.
+    """
+    vid, micros = data['vehicle_id'], data['micros']
+    n = len(vid)
+    if not n:
+        return {name: np.empty(0) for name in ('vehicle_id', 'first', 'last', 'distance', 'idle', 'fuel')}, {}
+    ts = micros / 1e6
+    first = np.r_[True, vid[1:] != vid[:-1]]
+    last = np.r_[vid[1:] != vid[:-1], True]
+
+    # интервал i — между точками i-1 и i
+    dt = np.r_[np.nan, np.diff(ts)]
+    dt[first] = np.nan
+    step = np.r_[0.0, haversine_m(data['latitude'][:-1], data['longitude'][:-1], data['latitude'][1:], data['longitude'][1:])]
+    step[first] = 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        derived = step / dt * 3.6
+        speed = np.where(np.isnan(data['speed']), derived, data['speed'])
+        moving = speed >= Config.TRIP_MOVING_SPEED_KMH
+        gap = dt > Config.TRIP_MAX_GAP_S
+
+    # серии неподвижных точек и их длительность (первая серия ТС может продолжать стоянку прошлого запуска)
+    still = ~moving
+    run_starts = np.flatnonzero(still & (first | np.r_[True, moving[:-1]]))
+    run_ends = np.flatnonzero(still & (last | np.r_[moving[1:], True]))
+    run_begin = micros[run_starts]
+    for k in np.flatnonzero(first[run_starts]).tolist():
+        since = stopped_since.get(int(vid[run_starts[k]]))
+        if since is not None:
+            run_begin[k] = min(run_begin[k], since)
+    run_of = np.cumsum(still & (first | np.r_[True, moving[:-1]])) - 1
+    stop = np.zeros(n, dtype=bool)
+    stop[still] = ((micros[run_ends] - run_begin) / 1e6 >= Config.TRIP_MIN_STOP_S)[run_of[still]]
+
+    in_trip = ~first & ~gap & ~(stop & np.r_[False, stop[:-1]])
+    starts = np.flatnonzero(in_trip & ~np.r_[False, in_trip[:-1]])
+    ends = np.flatnonzero(in_trip & ~np.r_[in_trip[1:], False])
+    first_points, last_points = starts - 1, ends
+
+    def per_trip(values):
+        return np.add.reduceat(np.where(in_trip, values, 0), starts) if len(starts) else np.empty(0)
+
+    fuel = data['fuel_level']
+    with np.errstate(invalid='ignore'):
+        burned = np.r_[0.0, np.maximum(fuel[:-1] - fuel[1:], 0)]  # заправки (рост уровня) не учитываются
+    measured = np.r_[False, ~np.isnan(fuel[:-1]) & ~np.isnan(fuel[1:])]
+    distance = per_trip(step)
+    idle = per_trip(np.where(still & np.r_[False, still[:-1]], dt, 0))
+    fuel_used = np.where(per_trip(measured) > 0, per_trip(np.nan_to_num(burned)), np.nan)
+    moved = per_trip(moving)
+
+    closed = ~last[last_points] | ((until / 1e6 - ts[last_points]) > Config.TRIP_MAX_GAP_S)
+    keep = closed & (moved > 0) & (distance >= Config.TRIP_MIN_DISTANCE_M)
+    trips = {'vehicle_id': vid[first_points][keep], 'first': first_points[keep], 'last': last_points[keep],
+             'distance': distance[keep], 'idle': idle[keep], 'fuel': fuel_used[keep]}
+
+    # продолжение: с начала незавершённой поездки, иначе с последней точки ТС
+    resume = np.flatnonzero(last)
+    open_trips = ~closed & last[last_points]
+    resume_of = np.searchsorted(vid[resume], vid[first_points[open_trips]])
+    resume[resume_of] = first_points[open_trips]
+    progress = {int(vid[r]): (int(micros[r]), int(run_begin[run_of[r]]) if still[r] else None) for r in resume.tolist()}
+    return trips, progress
+
+
+def update_trips(since=None, until=None):
+    """
+    Выделение поездок из новых точек телеметрии и запись их в trips вместе с продолжением в trip_progress,
+    в одной транзакции. Поздно пришедшие точки старше продолжения ТС не учитываются.
+    Возвращает число записанных поездок.
+    """
+    until = until or datetime.now()
+    stopped_since = {vid: int(micros([since])[0]) for vid, since in db.session.execute(
+        select(TripProgress.vehicle_id, TripProgress.stopped_since).where(TripProgress.stopped_since.isnot(None)))}
+    data = load_points(until, since)
+    trips, progress = segment_trips(data, stopped_since, int(micros([until])[0]))
+    times, lat, lon = data['micros'], data['latitude'], data['longitude']
+    rows = []
+    for vid, first, last, distance, idle, fuel in zip(*(trips[k].tolist() for k in
+                                                        ('vehicle_id', 'first', 'last', 'distance', 'idle', 'fuel'))):
+        rows.append({'vehicle_id': vid, 'start_time': to_datetime(times[first]), 'end_time': to_datetime(times[last]),
+                     'start_latitude': lat[first].item(), 'start_longitude': lon[first].item(),
+                     'end_latitude': lat[last].item(), 'end_longitude': lon[last].item(),
+                     'distance': round(distance / 1000, 3), 'duration': round(int(times[last] - times[first]) / 6e7, 2),
+                     'idle_time': round(idle / 60, 2), 'fuel_used': None if fuel != fuel else round(fuel, 2),
+                     'points': last - first + 1})
+    if rows:
+        db.session.execute(insert(Trip), rows)
+    if progress:
+        replace_progress(TripProgress, [
+            {'vehicle_id': vid, 'resume_from': to_datetime(resume_from),
+             'stopped_since': None if since is None else to_datetime(since)}
+            for vid, (resume_from, since) in progress.items()])
+    db.session.commit()
+    if rows:
+        # запись мимо flush не видна хукам сброса кэша аналитики (поездки входят в эффективность ТС)
+        analytics_cache.invalidate({row['vehicle_id'] for row in rows})
+    return len(rows)
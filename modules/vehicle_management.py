@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Date
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Index
 from database import db
 
 
 class Vehicle(db.Model):
     __tablename__ = 'vehicles'
+    __table_args__ = (
+        Index('ix_vehicles_registration_number_id', 'registration_number', 'id'),  # сортировка списка ТС
+    )
 
     id = Column(Integer, primary_key=True)
     registration_number = Column(String, unique=True, nullable=False)
@@ -18,6 +21,9 @@ class Vehicle(db.Model):
 
 class FuelRecord(db.Model):
     __tablename__ = 'fuel_records'
+    __table_args__ = (
+        Index('ix_fuel_records_vehicle_id_date', 'vehicle_id', 'date'),
+    )
 
     id = Column(Integer, primary_key=True)
     vehicle_id = Column(Integer, nullable=False)
@@ -30,6 +36,9 @@ class FuelRecord(db.Model):
 
 class MaintenanceRecord(db.Model):
     __tablename__ = 'maintenance'
+    __table_args__ = (
+        Index('ix_maintenance_vehicle_id_date', 'vehicle_id', 'date'),
+    )
 
     id = Column(Integer, primary_key=True)
     vehicle_id = Column(Integer, nullable=False)
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index, event, select, insert, delete, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import db
+from config import Config
+
+# Операции журнала изменений: вставка, изменение, удаление строки и «перечитать таблицу целиком»
+INSERTED, UPDATED, DELETED, RESET = 'I', 'U', 'D', 'R'
+
+
+class TableVersion(db.Model):
+    """Счётчик изменений таблицы: растёт при каждой записи, служит основой ETag/Last-Modified в API"""
+    __tablename__ = 'table_versions'
+
+    table_name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)  # UTC
+
+    def __repr__(self):
+        return f'<TableVersion {self.table_name} v{self.version}>'
+
+
+class RowChange(db.Model):
+    """
+    Журнал изменений строк: позиция в журнале (id) монотонно растёт, клиенты читают изменения после своей позиции.
+    Для пакетных записей через session.execute (вставка телеметрии, массовые изменения и удаления)
+    пишется одна метка R — клиенту проще перечитать загруженные строки, чем разбирать журнал построчно.
+    """
+    __tablename__ = 'row_changes'
+    __table_args__ = (
+        Index('ix_row_changes_table_name_id', 'table_name', 'id'),
+    )
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    table_name = Column(String(100), nullable=False)
+    row_id = Column(BigInteger)
+    op = Column(String(1), nullable=False)
+    changed_at = Column(DateTime, nullable=False)  # UTC
+
+    def __repr__(self):
+        return f'<RowChange {self.id} {self.op} {self.table_name}:{self.row_id}>'
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _upsert(connection):
+    """INSERT ... ON CONFLICT для диалекта соединения"""
+    return (sqlite if connection.dialect.name == 'sqlite' else postgresql).insert(TableVersion)
+
+
+def seed_table_versions(connection, tables):
+    """Строки версий для таблиц tables, которых ещё нет (при миграции), чтобы запись не начиналась со вставки"""
+    rows = [{'table_name': t, 'version': 0, 'updated_at': _utcnow()} for t in sorted(tables)]
+    if rows:
+        connection.execute(_upsert(connection).values(rows).on_conflict_do_nothing(index_elements=['table_name']))
+
+
+def bump_versions(connection, tables, changes=None):
+    """
+    Увеличение версии таблиц tables в текущей транзакции и запись в журнал изменений.
+    changes: {таблица: [(id строки, операция)]}; для таблиц без построчных изменений пишется метка RESET.
+    Для записей через сессию (flush и пакетные insert/update/delete через session.execute)
+    вызывается автоматически; запись напрямую через соединение должна вызывать его сама.
+    """
+    tables = set(tables) - {TableVersion.__tablename__, RowChange.__tablename__}
+    if not tables:
+        return
+    now = _utcnow()
+    # одним INSERT ... ON CONFLICT DO UPDATE: первая запись в таблицу не гоняется с другой сессией,
+    # а строки блокируются в порядке имён таблиц, поэтому сессии с несколькими таблицами не взаимоблокируются
+    statement = _upsert(connection).values([{'table_name': t, 'version': 1, 'updated_at': now} for t in sorted(tables)])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['table_name'],
+        set_={'version': TableVersion.version + 1, 'updated_at': statement.excluded.updated_at}))
+    changes = changes or {}
+    log = []
+    for table in sorted(tables):
+        rows = changes.get(table) or [(None, RESET)]
+        log.extend({'table_name': table, 'row_id': row_id, 'op': op, 'changed_at': now} for row_id, op in rows)
+    connection.execute(insert(RowChange), log)
+
+
+def table_version(connection, table):
+    """(версия, время последнего изменения в UTC) таблицы; (0, None), если записей через приложение ещё не было"""
+    row = connection.execute(select(TableVersion.version, TableVersion.updated_at)
+                             .where(TableVersion.table_name == table)).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+def latest_change_id(connection):
+    """Текущая позиция конца журнала изменений"""
+    return connection.execute(select(func.max(RowChange.id))).scalar() or 0
+
+
+def changes_since(connection, table, after_id, limit=None):
+    """
+    Изменения таблицы после позиции after_id: (список (id, id строки, операция), новая позиция, reset).
+    reset=True — клиенту нужно перечитать таблицу: была массовая запись, изменений больше limit
+    или журнал до его позиции уже очищен.
+    """
+    limit = limit or Config.CHANGE_LOG_MAX_ROWS
+    first = connection.execute(select(func.min(RowChange.id))).scalar()
+    if first is not None and after_id + 1 < first:
+        return [], latest_change_id(connection), True
+    rows = connection.execute(
+        select(RowChange.id, RowChange.row_id, RowChange.op)
+        .where(RowChange.table_name == table, RowChange.id > after_id)
+        .order_by(RowChange.id).limit(limit + 1)).all()
+    if len(rows) > limit or any(op == RESET for _, _, op in rows):
+        return [], latest_change_id(connection), True
+    return [tuple(r) for r in rows], (rows[-1][0] if rows else after_id), False
+
+
+def prune_changes(connection, keep_hours):
+    """Очистка журнала изменений старше keep_hours часов; возвращает число удалённых записей"""
+    cutoff = _utcnow() - timedelta(hours=keep_hours)
+    return connection.execute(delete(RowChange).where(RowChange.changed_at < cutoff)).rowcount
+
+
+def _row_id(obj):
+    """
+    Номер строки для журнала: первичный ключ из одного целого столбца или столбец id составного ключа
+    (у секционированной телеметрии ключ (id, timestamp), id уникален сам по себе)
+    """
+    mapper = inspect(obj).mapper
+    key = mapper.primary_key_from_instance(obj)
+    if len(key) == 1 and isinstance(key[0], int):
+        return key[0]
+    row_id = getattr(obj, 'id', None) if 'id' in obj.__table__.primary_key.columns else None
+    return row_id if isinstance(row_id, int) else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_tables(session, flush_context):
+    changes = {}
+    tables = set()
+    for objects, op in ((session.new, INSERTED), (session.deleted, DELETED),
+                        ([o for o in session.dirty if session.is_modified(o)], UPDATED)):
+        for obj in objects:
+            table = obj.__table__.name
+            tables.add(table)
+            row_id = _row_id(obj)
+            if row_id is None:
+                changes[table] = None  # строки без простого ключа — метка RESET для всей таблицы
+            elif table not in changes or changes[table] is not None:
+                changes.setdefault(table, []).append((row_id, op))
+    if tables:
+        bump_versions(session.connection(), tables, changes)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_bulk_tables(orm_execute_state):
+    state = orm_execute_state
+    if (state.is_insert or state.is_update or state.is_delete) and state.bind_mapper is not None:
+        # одна метка RESET на оператор: построчный журнал удвоил бы запись в самые нагруженные таблицы
+        bump_versions(state.session.connection(), [state.bind_mapper.local_table.name])
@@ -0,0 +1,260 @@
+import math
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import Column, Integer, Float, String, DateTime, JSON, select, insert, update, bindparam, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db
+from config import Config
+from modules.dispatch import Route, Task
+from modules.monitoring import GPSData, TrackingData, Violation
+from modules.telemetry import G, KMH_TO_MS, seconds, to_datetime
+
+SPEEDING = 'Превышение скорости'
+HARD_BRAKING = 'Резкое торможение'
+HARD_ACCELERATION = 'Резкое ускорение'
+
+class ViolationState(db.Model):
+    """Состояние выявления нарушений между пакетами по ТС и таблице-источнику: последняя точка и незакрытые эпизоды"""
+    __tablename__ = 'violation_state'
+
+    table_name = Column(String(100), primary_key=True)
+    vehicle_id = Column(Integer, primary_key=True)
+    last_timestamp = Column(DateTime)
+    last_speed = Column(Float)
+    open_episodes = Column(JSON(none_as_null=True))  # список эпизодов, время — ISO 8601
+
+    def __repr__(self):
+        return f'<ViolationState {self.table_name} for vehicle {self.vehicle_id}>'
+
+
+class ViolationDetector:
+    """
+    Потоковое выявление нарушений по точкам телеметрии одного источника.
+    Между пакетами для каждого ТС хранятся последняя точка (время, скорость) и незакрытые эпизоды
+    (в таблице violation_state, см. detect_violations); идущие подряд точки с нарушением объединяются
+    в один эпизод — одну запись Violation. Эпизод закрывается, когда нарушение прекратилось, при разрыве
+    между точками больше VIOLATION_MERGE_GAP_S или когда ТС столько же не присылает точек
+    (close_stale_episodes). Внутри пакета расчёт векторный, цикл Python — только по эпизодам.
+    """
+
+    def __init__(self):
+        self.last = {}  # vehicle_id -> (время в секундах, скорость км/ч)
+        self.open = {}  # (vehicle_id, тип) -> эпизод
+
+    def detect(self, rows):
+        """
+        Эпизоды по пакету точек (словари с vehicle_id, timestamp, speed и, если есть, latitude, longitude, route_id).
+        Возвращает (закрытые эпизоды, новые последние точки, новые незакрытые эпизоды); состояние не меняется.
+        Опоздавшие точки — не новее последней уже обработанной точки ТС — пропускаются: связать их с ходом
+        эпизодов нельзя, а последняя точка ТС не должна уходить назад во времени.
+        """
+        rows = [r for r in rows if r.get('vehicle_id') is not None and r.get('timestamp') is not None]
+        open_after = dict(self.open)
+        if not rows:
+            return [], {}, open_after
+        ids = np.array([r['vehicle_id'] for r in rows], dtype=np.int64)
+        ts = seconds([r['timestamp'] for r in rows])
+        speed = np.array([r.get('speed') for r in rows], dtype=np.float64)
+        vids, inverse = np.unique(ids, return_inverse=True)
+        fresh = ts > np.array([self.last.get(int(vid), (-np.inf,))[0] for vid in vids.tolist()])[inverse]
+        if not fresh.any():
+            return [], {}, open_after
+        order = np.flatnonzero(fresh)[np.lexsort((ts[fresh], ids[fresh]))]
+        rows = [rows[i] for i in order]
+        ids, ts, speed = ids[order], ts[order], speed[order]
+
+        first = np.r_[True, ids[1:] != ids[:-1]]
+        last = np.r_[ids[1:] != ids[:-1], True]
+        prev_ts, prev_speed = np.r_[np.nan, ts[:-1]], np.r_[np.nan, speed[:-1]]
+        for i in np.flatnonzero(first).tolist():
+            prev_ts[i], prev_speed[i] = self.last.get(int(ids[i]), (np.nan, np.nan))
+        dt = ts - prev_ts
+        with np.errstate(invalid='ignore'):
+            # точки с тем же временем не связываются: ни ускорения, ни продолжения эпизода по ним нет
+            linked = (dt > 0) & (dt <= Config.VIOLATION_MERGE_GAP_S)
+        accel = np.full(len(ids), np.nan)
+        accel[linked] = (speed[linked] - prev_speed[linked]) * KMH_TO_MS / dt[linked]
+
+        with np.errstate(invalid='ignore'):
+            checks = (
+                # тип, маска нарушения, показатель для пика эпизода
+                (SPEEDING, speed > Config.SPEED_LIMIT, speed),
+                (HARD_BRAKING, accel <= -Config.HARD_BRAKING_THRESHOLD * G, -accel / G),
+                (HARD_ACCELERATION, accel >= Config.HARD_ACCELERATION_THRESHOLD * G, accel / G),
+            )
+        closed = []
+        for kind, mask, value in checks:
+            cont = mask & np.r_[False, mask[:-1]] & linked & ~first
+            # первая точка ТС в пакете продолжает незакрытый эпизод прошлого пакета
+            for i in np.flatnonzero(first & mask & linked).tolist():
+                if (int(ids[i]), kind) in open_after:
+                    cont[i] = True
+            starts = np.flatnonzero(mask & (~cont | first))
+            if not len(starts):
+                continue
+            ends = np.flatnonzero(mask & ~np.r_[cont[1:] & ~first[1:], False])
+            peaks = np.maximum.reduceat(np.where(mask, value, -np.inf), starts)
+            for s, e, peak in zip(starts.tolist(), ends.tolist(), peaks.tolist()):
+                key = (int(ids[s]), kind)
+                if cont[s]:
+                    episode = open_after.pop(key)
+                else:
+                    start = rows[s]
+                    episode = {'vehicle_id': key[0], 'type': kind, 'start': start['timestamp'],
+                               'latitude': start.get('latitude'), 'longitude': start.get('longitude'),
+                               'route_id': start.get('route_id'), 'peak': -math.inf, 'points': 0}
+                episode.update(end=rows[e]['timestamp'], end_ts=ts[e], peak=max(episode['peak'], peak),
+                               points=episode['points'] + e - s + 1)
+                if last[e]:
+                    open_after[key] = episode
+                else:
+                    closed.append(episode)
+
+        # незакрытыми остаются эпизоды, доходящие до последней точки ТС в пакете, и эпизоды ТС без точек в пакете,
+        # если те не молчат дольше VIOLATION_MERGE_GAP_S
+        last_points = {int(ids[i]): (ts[i], speed[i]) for i in np.flatnonzero(last).tolist()}
+        stale_before = ts.max() - Config.VIOLATION_MERGE_GAP_S
+        for key, episode in list(open_after.items()):
+            point = last_points.get(key[0])
+            if point is not None and episode['end_ts'] != point[0] or point is None and episode['end_ts'] < stale_before:
+                closed.append(open_after.pop(key))
+        return closed, last_points, open_after
+
+
+DETECTED_TABLES = (GPSData.__tablename__, TrackingData.__tablename__)
+
+
+def _dump_episode(episode):
+    return {**episode, 'start': episode['start'].isoformat(), 'end': episode['end'].isoformat()}
+
+
+def _load_episode(data):
+    return {**data, 'start': datetime.fromisoformat(data['start']), 'end': datetime.fromisoformat(data['end'])}
+
+
+def _update_state(connection, rows):
+    """Пакетное обновление строк состояния; rows — словари с ключами state_table, state_vehicle и новыми значениями"""
+    table = ViolationState.__table__
+    connection.execute(update(table).where(table.c.table_name == bindparam('state_table'),
+                                           table.c.vehicle_id == bindparam('state_vehicle')), rows)
+
+
+def _load_state(connection, table, vehicle_ids):
+    """
+    Детектор с состоянием ТС vehicle_ids; строки состояния блокируются до конца транзакции
+    (в порядке vehicle_id, чтобы параллельные пакеты не взаимоблокировались)
+    """
+    ids = sorted(vehicle_ids)
+    upsert = (sqlite if connection.dialect.name == 'sqlite' else postgresql).insert(ViolationState)
+    connection.execute(upsert.values([{'table_name': table, 'vehicle_id': vid} for vid in ids])
+                       .on_conflict_do_nothing(index_elements=['table_name', 'vehicle_id']))
+    rows = connection.execute(
+        select(ViolationState.vehicle_id, ViolationState.last_timestamp, ViolationState.last_speed, ViolationState.open_episodes)
+        .where(ViolationState.table_name == table, ViolationState.vehicle_id.in_(ids))
+        .order_by(ViolationState.vehicle_id).with_for_update())
+    detector = ViolationDetector()
+    for vid, last_timestamp, last_speed, episodes in rows:
+        if last_timestamp is not None:
+            detector.last[vid] = (seconds([last_timestamp])[0], np.nan if last_speed is None else last_speed)
+        for data in episodes or ():
+            detector.open[(vid, data['type'])] = _load_episode(data)
+    return detector
+
+
+def detect_violations(table, rows):
+    """
+    Выявление нарушений в пакете точек таблицы table в текущей транзакции; возвращает закрытые эпизоды.
+    Состояние ТС пакета читается из violation_state с блокировкой и записывается туда же, поэтому фиксируется
+    или откатывается вместе с пакетом, а пакеты одного ТС из разных процессов обрабатываются по очереди.
+    """
+    if table not in DETECTED_TABLES:
+        return []
+    vehicle_ids = {r['vehicle_id'] for r in rows if r.get('vehicle_id') is not None and r.get('timestamp') is not None}
+    if not vehicle_ids:
+        return []
+    connection = db.session.connection()
+    detector = _load_state(connection, table, vehicle_ids)
+    closed, last_points, open_after = detector.detect(rows)
+    episodes = {}
+    for (vid, _), episode in open_after.items():
+        episodes.setdefault(vid, []).append(_dump_episode(episode))
+    state = []
+    for vid in sorted(vehicle_ids):
+        # у ТС, все точки которого в пакете опоздали, последняя точка остаётся прежней
+        ts, speed = last_points.get(vid) or detector.last[vid]
+        state.append({'state_table': table, 'state_vehicle': vid,
+                      'last_timestamp': to_datetime(round(ts * 1e6)),
+                      'last_speed': None if speed != speed else float(speed),
+                      'open_episodes': episodes.get(vid)})
+    _update_state(connection, state)
+    return closed
+
+
+def close_stale_episodes(now=None):
+    """
+    Запись эпизодов ТС, которые не присылают точек дольше VIOLATION_MERGE_GAP_S: сами по себе такие эпизоды
+    закрываются только следующим пакетом ТС. Запускается по расписанию (jobs.py violations);
+    возвращает число записанных нарушений.
+    """
+    cutoff = (now or datetime.now()) - timedelta(seconds=Config.VIOLATION_MERGE_GAP_S)
+    connection = db.session.connection()
+    rows = connection.execute(
+        select(ViolationState.table_name, ViolationState.vehicle_id, ViolationState.open_episodes)
+        .where(ViolationState.open_episodes.isnot(None))
+        .order_by(ViolationState.table_name, ViolationState.vehicle_id).with_for_update()).all()
+    closed, state = [], []
+    for table, vid, episodes in rows:
+        episodes = [_load_episode(data) for data in episodes]
+        stale = [e for e in episodes if e['end'] < cutoff]
+        if stale:
+            closed.extend(stale)
+            state.append({'state_table': table, 'state_vehicle': vid,
+                          'open_episodes': [_dump_episode(e) for e in episodes if e['end'] >= cutoff] or None})
+    if state:
+        _update_state(connection, state)
+    written = save_violations(closed)
+    db.session.commit()
+    return written
+
+
+def resolve_drivers(episodes):
+    """Водитель для каждого эпизода: по задаче ТС, идущей в момент начала, иначе по маршруту точки; иначе None"""
+    if not episodes:
+        return []
+    vehicle_ids = {e['vehicle_id'] for e in episodes}
+    first, last = min(e['start'] for e in episodes), max(e['start'] for e in episodes)
+    tasks = {}
+    for vid, driver_id, start, end in db.session.query(Task.vehicle_id, Task.driver_id, Task.start_time, Task.end_time) \
+            .filter(Task.vehicle_id.in_(vehicle_ids), Task.start_time <= last,
+                    or_(Task.end_time.is_(None), Task.end_time >= first)) \
+            .order_by(Task.start_time):
+        tasks.setdefault(vid, []).append((start, end, driver_id))
+    route_ids = {e['route_id'] for e in episodes if e['route_id'] is not None}
+    route_drivers = dict(db.session.query(Route.id, Route.driver_id).filter(Route.id.in_(route_ids))) if route_ids else {}
+    drivers = []
+    for e in episodes:
+        covering = [d for start, end, d in tasks.get(e['vehicle_id'], ()) if start <= e['start'] and (end is None or end >= e['start'])]
+        drivers.append(covering[-1] if covering else route_drivers.get(e['route_id']))
+    return drivers
+
+
+def save_violations(episodes):
+    """Запись эпизодов одним пакетным INSERT в текущей транзакции; возвращает число записей"""
+    if not episodes:
+        return 0
+    rows = []
+    for episode, driver_id in zip(episodes, resolve_drivers(episodes)):
+        details = {'start': episode['start'].isoformat(), 'end': episode['end'].isoformat(),
+                   'duration_s': round((episode['end'] - episode['start']).total_seconds()),
+                   'points': episode['points']}
+        if episode['type'] == SPEEDING:
+            details.update(max_speed=round(episode['peak'], 1), limit=Config.SPEED_LIMIT)
+        else:
+            details['peak_g'] = round(episode['peak'], 2)
+        location = None
+        if episode['latitude'] is not None and episode['longitude'] is not None:
+            location = f"{episode['latitude']:.5f}, {episode['longitude']:.5f}"
+        rows.append({'vehicle_id': episode['vehicle_id'], 'driver_id': driver_id, 'timestamp': episode['start'],
+                     'violation_type': episode['type'], 'details': details, 'location': location})
+    db.session.execute(insert(Violation), rows)
+    return len(rows)
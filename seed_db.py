@@ -2,6 +2,9 @@ from database import db, app
 from modules.vehicle_management import Vehicle, MaintenanceRecord, SparePart, FuelRecord, OwnershipHistory
 from modules.dispatch import Driver, Route, Task, WorkHours, TaskStatus
 from modules.monitoring import TrackingData, GPSData, FuelConsumption, DrivingStyle, Violation
+from modules.rollups import VehicleDailyStats
+from modules.versioning import TableVersion, RowChange
+from modules.route_cache import RouteGeometry
 from datetime import datetime, timedelta
 import random
 
@@ -0,0 +1,15 @@
+import pytest
+from modules.ingest import validate_point
+from modules.monitoring import GPSData
+
+
+def test_numeric_timestamp():
+    row = validate_point(GPSData, {'vehicle_id': 1, 'timestamp': 1_700_000_000, 'latitude': 55.7, 'longitude': 37.6})
+    assert row['timestamp'].year == 2023
+
+
+@pytest.mark.parametrize('timestamp', [1e20, -1e20])
+def test_out_of_range_timestamp_is_item_error(timestamp):
+    # вне диапазона datetime: должна быть ошибка точки (ValueError), а не OverflowError/OSError на весь пакет
+    with pytest.raises(ValueError, match='timestamp'):
+        validate_point(GPSData, {'vehicle_id': 1, 'timestamp': timestamp})
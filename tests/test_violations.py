@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+from config import Config
+from modules.telemetry import seconds
+from modules.violations import ViolationDetector
+
+T0 = datetime(2026, 1, 1, 10, 0)
+
+
+def points(*items):
+    return [{'vehicle_id': 1, 'timestamp': T0 + timedelta(seconds=s), 'speed': v} for s, v in items]
+
+
+def test_late_points_are_skipped():
+    detector = ViolationDetector()
+    detector.last[1] = (seconds([T0 + timedelta(seconds=10)])[0], 50.0)
+    closed, last_points, open_after = detector.detect(points((5, Config.SPEED_LIMIT + 30), (10, Config.SPEED_LIMIT + 30)))
+    # обе точки не новее последней обработанной: ни эпизода, ни сдвига последней точки назад
+    assert (closed, last_points, open_after) == ([], {}, {})
+
+
+def test_late_point_among_new_ones():
+    detector = ViolationDetector()
+    detector.last[1] = (seconds([T0 + timedelta(seconds=10)])[0], 50.0)
+    closed, last_points, open_after = detector.detect(points((5, Config.SPEED_LIMIT + 30), (20, 50.0)))
+    # опоздавшая точка с превышением не даёт эпизода, новая связывается с последней обработанной
+    assert closed == [] and open_after == {}
+    assert last_points[1] == (seconds([T0 + timedelta(seconds=20)])[0], 50.0)